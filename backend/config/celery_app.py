@@ -1,10 +1,18 @@
 import os
+import time
 from datetime import timedelta
 from asgiref.sync import async_to_sync
 
 from celery import Celery
 
-from config.settings import TASKS_INTERVAL_MINUTES
+import sentry_sdk
+
+from config.settings import (
+    ENV,
+    TASKS_INTERVAL_MINUTES,
+    SCRAPER_TIME_BUDGET_SECONDS,
+    SCRAPER_STREAMING_PIPELINE,
+)
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
@@ -36,11 +44,27 @@ def setup_periodic_tasks(sender: Celery, **kwargs):
     )
 
 
-async def look_for_new_products():
+async def look_for_new_products(time_budget_seconds: float):
     from pingcycle.tools.scraper import Scraper
+    from pingcycle.tools.notification_pipeline import NotificationPipeline
+    from pingcycle.tools.messaging_providers import get_messaging_provider
+    import pingcycle.apps.core.models as core_models
 
     scraper = Scraper()
-    await scraper.run_main()
+    if not SCRAPER_STREAMING_PIPELINE:
+        await scraper.run_main(time_budget_seconds=time_budget_seconds)
+        return
+
+    # Batches still queued when the scraper is done may use the rest of its
+    # budget, the time reserved after it is for the pass that follows
+    drain_deadline = time.monotonic() + time_budget_seconds
+    telegram_provider = get_messaging_provider(core_models.Chat.Provider.TELEGRAM)
+    async with NotificationPipeline(
+        telegram_provider, drain_deadline=drain_deadline
+    ) as pipeline:
+        await scraper.run_main(
+            time_budget_seconds=time_budget_seconds, pipeline=pipeline
+        )
 
 
 @celery_app.task
@@ -49,8 +73,16 @@ def look_for_new_products_task_and_notify():
     from pingcycle.tools.messaging_providers import get_messaging_provider
     import pingcycle.apps.core.models as core_models
 
-    async_to_sync(look_for_new_products)()
+    # Scraping stops early enough to leave time for matching & sending
+    # whatever was scraped before the task time limit
+    try:
+        async_to_sync(look_for_new_products)(SCRAPER_TIME_BUDGET_SECONDS)
+    except Exception as e:
+        print(f"❌ Scraper failed, processing products found so far - {e}")
+        if ENV != "DEV":
+            sentry_sdk.capture_exception(e)
 
+    # Everything when not streaming, otherwise whatever the pipeline missed
     core_models.NotifiedProduct.objects.find_keyword_matches()
 
     telegram_provider = get_messaging_provider(core_models.Chat.Provider.TELEGRAM)
@@ -250,6 +250,17 @@ TEMP_ALLOWED_EMAILS = CONFIG["TEMP_ALLOWED_EMAILS"]
 TASKS_INTERVAL_MINUTES = 10
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TIME_LIMIT = TASKS_INTERVAL_MINUTES * 60
+# Part of the task time limit kept for matching & sending after scraping
+SCRAPER_MATCH_AND_SEND_RESERVE_SECONDS = CONFIG.get(
+    "SCRAPER_MATCH_AND_SEND_RESERVE_SECONDS", 120
+)
+SCRAPER_TIME_BUDGET_SECONDS = (
+    CELERY_TASK_TIME_LIMIT - SCRAPER_MATCH_AND_SEND_RESERVE_SECONDS
+)
+if SCRAPER_TIME_BUDGET_SECONDS <= 0:
+    raise RuntimeError(
+        f"'SCRAPER_MATCH_AND_SEND_RESERVE_SECONDS' needs to be lower than the task time limit ({CELERY_TASK_TIME_LIMIT}s)"
+    )
 CELERY_BROKER_URL = f"redis://{CONFIG['REDIS_HOST']}:6379/0"
 
 ##################
@@ -263,12 +274,123 @@ if not isinstance(MAX_KEYWORDS_PER_USER, int):
     )
 CHAT_TEMP_UUID_MAX_VALID_SECONDS = 20
 MAX_RETRIES_PER_MESSAGE = 3
+# Rate limited (429) sends are retried apart from MAX_RETRIES_PER_MESSAGE,
+# up to this many times per message
+MAX_RATE_LIMITED_RETRIES_PER_MESSAGE = CONFIG.get(
+    "MAX_RATE_LIMITED_RETRIES_PER_MESSAGE", 10
+)
+# Wait before the first retry of a failed message, doubled for every retry
+MESSAGE_RETRY_BACKOFF_SECONDS = CONFIG.get("MESSAGE_RETRY_BACKOFF_SECONDS", 1)
+# "SYNC" sends messages one at a time, "ASYNC" keeps up to
+# MESSAGING_MAX_IN_FLIGHT sends in flight over a pooled async HTTP client
+MESSAGING_DISPATCH_MODE = CONFIG.get("MESSAGING_DISPATCH_MODE", "SYNC")
+if MESSAGING_DISPATCH_MODE not in ("SYNC", "ASYNC"):
+    raise RuntimeError(
+        f"'MESSAGING_DISPATCH_MODE' needs to be 'SYNC' or 'ASYNC', but got: {MESSAGING_DISPATCH_MODE}"
+    )
+MESSAGING_MAX_IN_FLIGHT = CONFIG.get("MESSAGING_MAX_IN_FLIGHT", 10)
+# Consecutive failed provider requests (unreachable or 5xx) after which
+# sending pauses for MESSAGING_CIRCUIT_RESET_SECONDS
+MESSAGING_CIRCUIT_FAILURE_THRESHOLD = CONFIG.get(
+    "MESSAGING_CIRCUIT_FAILURE_THRESHOLD", 5
+)
+MESSAGING_CIRCUIT_RESET_SECONDS = CONFIG.get("MESSAGING_CIRCUIT_RESET_SECONDS", 30)
+# "SQL" matches keywords inside Postgres, "IN_MEMORY" scores them in the
+# worker against an in-process trigram index of the active keywords and
+# "VECTORIZED" scores whole batches with sparse matrices (large backlogs)
+KEYWORD_MATCHER = CONFIG.get("KEYWORD_MATCHER", "SQL")
+if KEYWORD_MATCHER not in ("SQL", "IN_MEMORY", "VECTORIZED"):
+    raise RuntimeError(
+        f"'KEYWORD_MATCHER' needs to be 'SQL', 'IN_MEMORY' or 'VECTORIZED', but got: {KEYWORD_MATCHER}"
+    )
 MAX_RETRIES_PER_PROXY = 10
+# Seconds a scraper holds a proxy before another scraper may claim it again
+PROXY_LEASE_SECONDS = CONFIG.get("PROXY_LEASE_SECONDS", 300)
+# Weight of the latest attempt in a proxy's rolling latency & success rate
+PROXY_SCORE_SMOOTHING = CONFIG.get("PROXY_SCORE_SMOOTHING", 0.2)
+# Share of leases that pick the least recently used proxy instead of the
+# best scored one, so weaker proxies get re-measured
+PROXY_EXPLORATION_RATE = CONFIG.get("PROXY_EXPLORATION_RATE", 0.1)
+# Wait before trying to lease again while every active proxy is leased by
+# another scraper, doubling up to the max. The run's time budget still applies.
+PROXY_LEASE_WAIT_SECONDS = CONFIG.get("PROXY_LEASE_WAIT_SECONDS", 2)
+PROXY_LEASE_MAX_WAIT_SECONDS = CONFIG.get("PROXY_LEASE_MAX_WAIT_SECONDS", 30)
 
 ##################
 # Business Logic #
 ##################
 DEBUG_PLAYWRIGHT_LOGS = CONFIG.get("DEBUG_PLAYWRIGHT_LOGS", False)
+# Number of towns scraped at the same time (each with its own proxy & browser)
+SCRAPER_CONCURRENCY = CONFIG.get("SCRAPER_CONCURRENCY", 1)
+if not isinstance(SCRAPER_CONCURRENCY, int) or SCRAPER_CONCURRENCY < 1:
+    raise RuntimeError(
+        f"'SCRAPER_CONCURRENCY' needs to be a positive integer, but got: {SCRAPER_CONCURRENCY}"
+    )
+# "evaluate" reads all product rows in one in-page call, "locator" reads field by field
+SCRAPER_EXTRACTION_MODE = CONFIG.get("SCRAPER_EXTRACTION_MODE", "evaluate")
+if SCRAPER_EXTRACTION_MODE not in ("evaluate", "locator"):
+    raise RuntimeError(
+        f"'SCRAPER_EXTRACTION_MODE' needs to be 'evaluate' or 'locator', but got: {SCRAPER_EXTRACTION_MODE}"
+    )
+# "HTTP" reads the listing without a browser (falling back to it when needed),
+# "BROWSER" always uses Playwright. Used for towns without their own fetch mode.
+SCRAPER_FETCH_MODE = CONFIG.get("SCRAPER_FETCH_MODE", "BROWSER")
+if SCRAPER_FETCH_MODE not in ("HTTP", "BROWSER"):
+    raise RuntimeError(
+        f"'SCRAPER_FETCH_MODE' needs to be 'HTTP' or 'BROWSER', but got: {SCRAPER_FETCH_MODE}"
+    )
+# Bounds of the adaptive per-town polling interval
+SCRAPER_MIN_POLL_MINUTES = CONFIG.get(
+    "SCRAPER_MIN_POLL_MINUTES", TASKS_INTERVAL_MINUTES
+)
+SCRAPER_MAX_POLL_MINUTES = CONFIG.get("SCRAPER_MAX_POLL_MINUTES", 60)
+# Number of new posts we aim to find per poll of a town
+SCRAPER_TARGET_POSTS_PER_POLL = CONFIG.get("SCRAPER_TARGET_POSTS_PER_POLL", 2)
+# Minimum seconds between two requests to the same host / through the same proxy
+SCRAPER_HOST_MIN_GAP_SECONDS = CONFIG.get("SCRAPER_HOST_MIN_GAP_SECONDS", 3)
+SCRAPER_PROXY_MIN_GAP_SECONDS = CONFIG.get("SCRAPER_PROXY_MIN_GAP_SECONDS", 10)
+# Random extra seconds added to each gap so the pace does not look automated
+SCRAPER_GAP_JITTER_SECONDS = CONFIG.get("SCRAPER_GAP_JITTER_SECONDS", 5)
+# Match & send each town's products as soon as they are stored, instead of
+# after the whole scraper run
+SCRAPER_STREAMING_PIPELINE = CONFIG.get("SCRAPER_STREAMING_PIPELINE", False)
+# Towns are skipped when less than this is left of the run's time budget
+SCRAPER_MIN_SECONDS_PER_TOWN = CONFIG.get("SCRAPER_MIN_SECONDS_PER_TOWN", 30)
+# Attempts (including hedged ones) before a town is given up for this run
+SCRAPER_MAX_ATTEMPTS_PER_TOWN = CONFIG.get("SCRAPER_MAX_ATTEMPTS_PER_TOWN", 5)
+# Start a second attempt on another proxy when a town attempt is slower than
+# the SCRAPER_HEDGE_PERCENTILE of successful attempts in the run
+SCRAPER_HEDGING = CONFIG.get("SCRAPER_HEDGING", False)
+SCRAPER_HEDGE_PERCENTILE = CONFIG.get("SCRAPER_HEDGE_PERCENTILE", 90)
+# Deadline used until SCRAPER_HEDGE_MIN_SAMPLES attempts succeeded in the run
+SCRAPER_HEDGE_MIN_SAMPLES = CONFIG.get("SCRAPER_HEDGE_MIN_SAMPLES", 3)
+SCRAPER_HEDGE_DEFAULT_SECONDS = CONFIG.get("SCRAPER_HEDGE_DEFAULT_SECONDS", 45)
+# How far back a town is re-read after a failed or overrunning run
+SCRAPER_MAX_CATCHUP_HOURS = CONFIG.get("SCRAPER_MAX_CATCHUP_HOURS", 24)
+# Requests aborted by the scraper's browser, the scraper only reads text & attributes
+SCRAPER_BLOCKED_RESOURCE_TYPES = CONFIG.get(
+    "SCRAPER_BLOCKED_RESOURCE_TYPES", ["image", "media", "font"]
+)
+SCRAPER_BLOCKED_DOMAINS = CONFIG.get(
+    "SCRAPER_BLOCKED_DOMAINS",
+    [
+        # Consent manager
+        "quantcast.com",
+        "quantserve.com",
+        "consensu.org",
+        # Ads & analytics
+        "googletagmanager.com",
+        "google-analytics.com",
+        "doubleclick.net",
+        "googlesyndication.com",
+        "googletagservices.com",
+        "adservice.google.com",
+        "amazon-adsystem.com",
+        "facebook.net",
+        "scorecardresearch.com",
+        "hotjar.com",
+    ],
+)
 
 
 if ENV != "DEV":
@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+import pingcycle.apps.core.models as core_models
+from pingcycle.tools.keyword_matchers import KEYWORD_MATCHER_CLASSES
+
+
+class Command(BaseCommand):
+    help = (
+        "Times every keyword matcher on the latest products & active keywords "
+        "and checks that they all find the same matches (nothing is saved)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--products",
+            action="store",
+            dest="products",
+            type=int,
+            default=1000,
+            help="Number of latest products to match",
+        )
+
+    def handle(self, *args, **options):
+        products = list(
+            core_models.NotifiedProduct.objects.order_by("-id").values_list(
+                "id", "product_name", "description"
+            )[: options["products"]]
+        )
+        keywords = list(
+            core_models.Keyword.objects.filter(
+                user__chats__state=core_models.Chat.State.ACTIVE
+            )
+            .distinct()
+            .values_list("id", "name")
+        )
+        self.stdout.write(
+            f"Matching {len(products)} products against {len(keywords)} keywords"
+        )
+
+        start = time.perf_counter()
+        expected_matches = set(
+            core_models.NotifiedProduct.objects.get_keyword_matches(
+                [product_id for product_id, _, _ in products],
+                only_created=False,
+            )
+        )
+        self._write_result("SQL", time.perf_counter() - start, expected_matches, True)
+
+        for name, matcher_class in KEYWORD_MATCHER_CLASSES.items():
+            matcher = matcher_class(core_models.KEYWORD_SIMILARITY_THRESHOLD)
+            start = time.perf_counter()
+            matcher.sync(keywords)
+            matches = set(matcher.find_matches(products))
+            self._write_result(
+                name,
+                time.perf_counter() - start,
+                matches,
+                matches == expected_matches,
+            )
+
+    def _write_result(self, name: str, seconds: float, matches: set, agrees: bool):
+        style = self.style.SUCCESS if agrees else self.style.ERROR
+        self.stdout.write(
+            style(
+                f"{name:<12} {seconds:>8.3f}s {len(matches):>8} matches"
+                f"{'' if agrees else '  (differs from SQL)'}"
+            )
+        )
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+import pingcycle.apps.core.models as core_models
+
+
+class Command(BaseCommand):
+    help = "Shows proxies ordered by score (expected seconds per successful scrape)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            dest="all",
+            default=False,
+            help="Include inactive proxies",
+        )
+
+    def handle(self, *args, **options):
+        proxies = core_models.Proxy.with_score().order_by(
+            F("score").asc(nulls_first=True), "id"
+        )
+        if not options["all"]:
+            proxies = proxies.filter(status=core_models.Proxy.Status.ACTIVE)
+
+        self.stdout.write(
+            f"{'proxy':<40} {'status':<10} {'score':>8} {'latency':>8} "
+            f"{'success':>8} {'fails':>6}  last used"
+        )
+        for proxy in proxies:
+            self.stdout.write(
+                f"{f'{proxy.domain}:{proxy.port}':<40} {proxy.status:<10} "
+                f"{self._format(proxy.score, 's'):>8} "
+                f"{self._format(proxy.latency_seconds, 's'):>8} "
+                f"{proxy.success_rate:>8.0%} {proxy.fail_count:>6}  "
+                f"{proxy.last_used or '-'}"
+            )
+
+    @staticmethod
+    def _format(value, unit: str) -> str:
+        return f"{value:.2f}{unit}" if value is not None else "-"
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def delete_duplicate_external_ids(apps, schema_editor):
+    """
+    Keeps the oldest product for every external_id scraped more than once
+    """
+    NotifiedProduct = apps.get_model("core", "NotifiedProduct")
+
+    oldest_ids = (
+        NotifiedProduct.objects.values("external_id")
+        .annotate(oldest_id=Min("id"))
+        .values_list("oldest_id", flat=True)
+    )
+    NotifiedProduct.objects.exclude(id__in=oldest_ids).delete()
+
+
+class Migration(migrations.Migration):
+    # Deleting duplicates cascades to their keywords & messages, leaving
+    # trigger events that block altering the table in the same transaction.
+    # The cleanup is committed before the constraint is added instead.
+    atomic = False
+
+    dependencies = [
+        ("core", "0021_alter_keyword_user"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_external_ids, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="notifiedproduct",
+            constraint=models.UniqueConstraint(
+                fields=("external_id",), name="unique_external_id"
+            ),
+        ),
+    ]
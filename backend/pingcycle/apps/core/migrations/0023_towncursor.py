@@ -0,0 +1,31 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0022_notifiedproduct_unique_external_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TownCursor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("town_url_ext", models.CharField(max_length=200, unique=True)),
+                ("latest_external_id", models.BigIntegerField()),
+                ("latest_posted_at", models.DateTimeField(null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+# Towns that were previously hard-coded in the scraper, most important first
+INITIAL_TOWNS = [
+    ("Dublin", "DublinIE"),
+    ("County Kildare", "KildareIE"),
+    ("County Wicklow", "CountyWicklow"),
+    ("County Wexford", "WexfordIRE"),
+    ("Waterford", "WaterfordIE"),
+]
+
+
+def create_initial_towns(apps, schema_editor):
+    Town = apps.get_model("core", "Town")
+    for index, (name, url_ext) in enumerate(INITIAL_TOWNS):
+        Town.objects.get_or_create(
+            url_ext=url_ext,
+            defaults={"name": name, "priority": len(INITIAL_TOWNS) - index},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0023_towncursor"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Town",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=200)),
+                ("url_ext", models.CharField(max_length=200, unique=True)),
+                ("enabled", models.BooleanField(default=True)),
+                ("priority", models.IntegerField(default=0)),
+                (
+                    "fetch_mode",
+                    models.CharField(
+                        blank=True,
+                        choices=[("HTTP", "Http"), ("BROWSER", "Browser")],
+                        max_length=20,
+                        null=True,
+                    ),
+                ),
+                ("poll_interval_minutes", models.FloatField(default=10)),
+                (
+                    "next_due_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("last_scraped_at", models.DateTimeField(blank=True, null=True)),
+                ("posts_per_hour", models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["-priority"],
+            },
+        ),
+        migrations.RunPython(create_initial_towns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0024_town"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="proxy",
+            name="lease_token",
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="proxy",
+            name="leased_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0025_proxy_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="proxy",
+            name="latency_seconds",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="proxy",
+            name="success_rate",
+            field=models.FloatField(default=1.0),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:00
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Builds the indexes without blocking the scraper's inserts
+    atomic = False
+
+    dependencies = [
+        ("core", "0026_proxy_score"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="notifiedproduct",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["product_name"],
+                name="product_name_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="notifiedproduct",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["description"],
+                name="description_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+    ]
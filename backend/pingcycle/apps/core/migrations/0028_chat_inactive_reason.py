@@ -0,0 +1,41 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0027_notifiedproduct_trgm_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="inactive_reason",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("BOT_BLOCKED", "Bot Blocked"),
+                    ("USER_DEACTIVATED", "User Deactivated"),
+                    ("CHAT_NOT_FOUND", "Chat Not Found"),
+                ],
+                max_length=30,
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="message",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("CREATED", "Created"),
+                    ("SENT", "Sent"),
+                    ("FAILED", "Failed"),
+                    ("SKIPPED", "Skipped"),
+                ],
+                default="CREATED",
+                max_length=30,
+            ),
+        ),
+    ]
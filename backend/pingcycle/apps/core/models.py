@@ -1,16 +1,17 @@
 import re
 import uuid
+import random
 from datetime import timedelta
-from typing import Optional
+from typing import Any, Dict, Optional, List, Tuple
 
 from django.utils import timezone
-from django.db import models, IntegrityError
+from django.db import models, connection, transaction, IntegrityError
 from django.conf import settings
-from django.db.models import Q, QuerySet
+from django.db.models import Q, F, Case, When, Value, Exists, OuterRef, QuerySet
 from django.db.models.functions import Greatest
 from django.db.models.constraints import CheckConstraint, UniqueConstraint
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.contrib.postgres.search import TrigramStrictWordSimilarity
+from django.contrib.postgres.indexes import GinIndex
 
 from rest_framework.exceptions import ValidationError
 import sentry_sdk
@@ -20,10 +21,21 @@ from config.settings import (
     CHAT_TEMP_UUID_MAX_VALID_SECONDS,
     MAX_CHATS_PER_USER,
     MAX_RETRIES_PER_MESSAGE,
+    KEYWORD_MATCHER,
     MAX_RETRIES_PER_PROXY,
+    PROXY_LEASE_SECONDS,
+    PROXY_SCORE_SMOOTHING,
+    PROXY_EXPLORATION_RATE,
+    SCRAPER_MIN_POLL_MINUTES,
+    SCRAPER_MAX_POLL_MINUTES,
+    SCRAPER_TARGET_POSTS_PER_POLL,
     ENV,
 )
 
+# Minimum strict word similarity between a keyword and a product's name or
+# description for the product to be sent to the keyword's user
+KEYWORD_SIMILARITY_THRESHOLD = 0.3
+
 
 class KeywordManager(models.Manager):
     def create(self, name, user):
@@ -87,56 +99,189 @@ class Keyword(models.Model):
 
 
 class NotifiedProductManager(models.Manager):
-    def find_keyword_matches(self):
+    def find_keyword_matches(self, external_ids: Optional[List[int]] = None):
+        """
+        `external_ids` limits matching to a batch of products, e.g. the ones
+        a single town just stored.
+
+        Links and state changes are written in one transaction, so the
+        message creator never sees a partially matched batch. The batch rows
+        are locked first: products stored meanwhile are left CREATED for the
+        next run and a concurrent run skips them instead of matching twice.
+        """
         products_qs = NotifiedProduct.objects.filter(
             state=NotifiedProduct.State.CREATED
         )
-        if not products_qs:
-            print("No new products...")
-            return
-        print("Checking CREATED products...")
-        for product in products_qs:
-            print(f"{product.product_name}: ", product.description)
-        # Set to track product IDs that have matched keywords
-        matching_product_ids = set()
-        # For each keyword linked to an active chat, check if there are any matches
-        for keyword in Keyword.objects.filter(
-            user__chats__state=Chat.State.ACTIVE
-        ).distinct():
-            print("Checking for keyword: ", keyword.name)
-
-            # Annotate the products with their similarity scores for the current keyword
-            matched_products = (
-                products_qs.annotate(
-                    similarity=Greatest(
-                        TrigramStrictWordSimilarity(keyword.name, "product_name"),
-                        TrigramStrictWordSimilarity(keyword.name, "description"),
-                    )
+        if external_ids is not None:
+            products_qs = products_qs.filter(external_id__in=external_ids)
+
+        with transaction.atomic():
+            product_ids = list(
+                products_qs.select_for_update(skip_locked=True).values_list(
+                    "id", flat=True
                 )
-                .filter(similarity__gt=0.3)
-                .order_by("-similarity")
             )
+            if not product_ids:
+                print("No new products...")
+                return
+            print("Checking CREATED products...")
+
+            products_qs = NotifiedProduct.objects.filter(id__in=product_ids)
+            if KEYWORD_MATCHER == "SQL":
+                matches_count = self._link_matching_keywords(product_ids)
+            else:
+                matches_count = self._link_matching_keywords_in_python(products_qs)
+            print(f"{matches_count} keyword matches found")
+
+            # Products without any matched keywords are irrelevant
+            products_qs.update(
+                state=Case(
+                    When(
+                        Exists(
+                            NotifiedProduct.keywords.through.objects.filter(
+                                notifiedproduct_id=OuterRef("pk")
+                            )
+                        ),
+                        then=Value(NotifiedProduct.State.KEYWORDS_LINKED),
+                    ),
+                    default=Value(NotifiedProduct.State.IRRELEVANT),
+                )
+            )
+
+    def _link_matching_keywords(self, product_ids: List[int]) -> int:
+        """
+        Links the given CREATED products to every keyword (of a user with an active
+        chat) it matches, in a single INSERT ... SELECT into the through table.
+
+        Same rule as `Greatest(TrigramStrictWordSimilarity(keyword, field))`
+        over the product name & description, but for all keywords at once so
+        the number of queries does not grow with the number of keywords.
+
+        Candidates are first found with the `<<%` operator, which can use the
+        trigram GIN indexes, and only those are scored. The operator compares
+        with `>=` to `pg_trgm.strict_word_similarity_threshold` (set for this
+        transaction only) while the score check is strict.
+        """
+        through_table = NotifiedProduct.keywords.through._meta.db_table
+        select_sql, params = self._get_keyword_matches_sql(product_ids)
+
+        with connection.cursor() as cursor:
+            self._set_similarity_threshold(cursor)
+            cursor.execute(
+                f"""
+                INSERT INTO {through_table} (notifiedproduct_id, keyword_id)
+                {select_sql}
+                ON CONFLICT DO NOTHING
+                """,
+                params,
+            )
+            return cursor.rowcount
 
-            print(
-                f"{matched_products.count()} products found for keyword {keyword}: {matched_products}"
+    def get_keyword_matches(
+        self, product_ids: Optional[List[int]] = None, only_created: bool = True
+    ) -> List[Tuple[int, int]]:
+        """
+        Returns the (product id, keyword id) pairs `_link_matching_keywords`
+        would link, without linking them. With `only_created=False` products
+        that were already matched are scored again (e.g. to benchmark).
+        """
+        select_sql, params = self._get_keyword_matches_sql(product_ids, only_created)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            self._set_similarity_threshold(cursor)
+            cursor.execute(select_sql, params)
+            return cursor.fetchall()
+
+    @staticmethod
+    def _set_similarity_threshold(cursor):
+        # Same as `SET LOCAL`, but takes a parameter
+        cursor.execute(
+            "SELECT set_config('pg_trgm.strict_word_similarity_threshold', %s, true)",
+            [str(KEYWORD_SIMILARITY_THRESHOLD)],
+        )
+
+    @staticmethod
+    def _get_keyword_matches_sql(
+        product_ids: Optional[List[int]] = None, only_created: bool = True
+    ) -> Tuple[str, Dict[str, Any]]:
+        params = {
+            "created": NotifiedProduct.State.CREATED,
+            "active": Chat.State.ACTIVE,
+            "threshold": KEYWORD_SIMILARITY_THRESHOLD,
+        }
+        state_filter = "AND product.state = %(created)s" if only_created else ""
+        product_ids_filter = ""
+        if product_ids is not None:
+            product_ids_filter = "AND product.id = ANY(%(product_ids)s)"
+            params["product_ids"] = list(product_ids)
+
+        # Keywords are scored once per distinct name (lower-cased, whitespace
+        # collapsed, which never changes trigrams) and the matches joined back
+        # to every keyword with that name
+        select_sql = f"""
+            WITH active_keyword AS (
+                SELECT
+                    keyword.id,
+                    TRIM(REGEXP_REPLACE(LOWER(keyword.name), '[[:space:]]+', ' ', 'g'))
+                        AS name
+                FROM {Keyword._meta.db_table} AS keyword
+                WHERE EXISTS (
+                    SELECT 1 FROM {Chat._meta.db_table} AS chat
+                    WHERE chat.user_id = keyword.user_id
+                        AND chat.state = %(active)s
+                )
+            ),
+            keyword_name AS (
+                SELECT DISTINCT name FROM active_keyword
+            ),
+            name_match AS (
+                SELECT product.id AS product_id, keyword_name.name
+                FROM {NotifiedProduct._meta.db_table} AS product
+                JOIN keyword_name
+                    ON (
+                        keyword_name.name <<%% product.product_name
+                        OR keyword_name.name <<%% product.description
+                    )
+                    AND GREATEST(
+                        STRICT_WORD_SIMILARITY(keyword_name.name, product.product_name),
+                        STRICT_WORD_SIMILARITY(keyword_name.name, product.description)
+                    ) > %(threshold)s
+                WHERE TRUE
+                    {state_filter}
+                    {product_ids_filter}
             )
+            SELECT name_match.product_id, active_keyword.id
+            FROM name_match
+            JOIN active_keyword ON active_keyword.name = name_match.name
+        """
+        return select_sql, params
 
-            # Track matches
-            for product in matched_products:
-                # Add the keyword to the product
-                product.keywords.add(keyword)
-                # Track this product ID as having a keyword match
-                matching_product_ids.add(product.id)
+    def _link_matching_keywords_in_python(self, products_qs: QuerySet) -> int:
+        """
+        Same as `_link_matching_keywords`, but scored in this process by the
+        KEYWORD_MATCHER from `pingcycle.tools.keyword_matchers`
+        """
+        from pingcycle.tools.keyword_matchers import get_keyword_matcher
 
-        # Update products that did not match any keywords
-        products_qs.exclude(id__in=matching_product_ids).update(
-            state=NotifiedProduct.State.IRRELEVANT
+        matcher = get_keyword_matcher(KEYWORD_MATCHER, KEYWORD_SIMILARITY_THRESHOLD)
+        matcher.sync(
+            Keyword.objects.filter(user__chats__state=Chat.State.ACTIVE)
+            .distinct()
+            .values_list("id", "name")
+        )
+        matches = matcher.find_matches(
+            products_qs.values_list("id", "product_name", "description")
         )
 
-        # Update products that have matched keywords
-        products_qs.filter(id__in=matching_product_ids).update(
-            state=NotifiedProduct.State.KEYWORDS_LINKED
+        Through = NotifiedProduct.keywords.through
+        Through.objects.bulk_create(
+            [
+                Through(notifiedproduct_id=product_id, keyword_id=keyword_id)
+                for product_id, keyword_id in matches
+            ],
+            ignore_conflicts=True,
         )
+        return len(matches)
 
     def delete_irrelevant(self):
         irrelevant_products_one_day_old = NotifiedProduct.objects.filter(
@@ -168,6 +313,25 @@ class NotifiedProduct(models.Model):
     keywords = models.ManyToManyField(Keyword, related_name="notified_products")
     img = models.URLField(null=True)
 
+    class Meta:
+        constraints = [
+            # Lets overlapping scraper runs insert with ignore_conflicts
+            UniqueConstraint(fields=["external_id"], name="unique_external_id")
+        ]
+        indexes = [
+            # Used by the `<<%` keyword matching operator
+            GinIndex(
+                fields=["product_name"],
+                name="product_name_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+            GinIndex(
+                fields=["description"],
+                name="description_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ]
+
     def get_full_url(self):
         return f"https://www.freecycle.org/posts/{self.external_id}"
 
@@ -203,6 +367,15 @@ class Chat(models.Model):
         ACTIVE = "ACTIVE"
         INACTIVE = "INACTIVE"
 
+    class InactiveReason(models.TextChoices):
+        """
+        Why a chat was deactivated without the user turning it off
+        """
+
+        BOT_BLOCKED = "BOT_BLOCKED"
+        USER_DEACTIVATED = "USER_DEACTIVATED"
+        CHAT_NOT_FOUND = "CHAT_NOT_FOUND"
+
     class Provider(models.TextChoices):
         TELEGRAM = "TELEGRAM"
 
@@ -216,8 +389,34 @@ class Chat(models.Model):
         on_delete=models.CASCADE,
     )
     state = models.CharField(max_length=30, choices=State.choices, default=State.SETUP)
+    inactive_reason = models.CharField(
+        max_length=30, choices=InactiveReason.choices, null=True, blank=True
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    def deactivate_unreachable(self, reason: "Chat.InactiveReason") -> int:
+        """
+        Deactivates a chat the provider can no longer send to (bot blocked,
+        account deleted...) and skips its queued messages, so no more
+        messages are created for or sent to it.
+
+        Returns the number of skipped messages
+        """
+        with transaction.atomic():
+            self.state = Chat.State.INACTIVE
+            self.inactive_reason = reason
+            self.save(update_fields=["state", "inactive_reason"])
+
+            skipped_count = self.messages.filter(status=Message.Status.CREATED).update(
+                status=Message.Status.SKIPPED
+            )
+
+        print(
+            f"🚫 Chat {self.id} deactivated ({reason}), "
+            f"{skipped_count} queued messages skipped"
+        )
+        return skipped_count
+
     def get_valid_linking_session(self) -> Optional["ChatLinkingSession"]:
         assert self.state == Chat.State.SETUP, "Expected chat to be in 'SETUP' state."
 
@@ -313,6 +512,8 @@ class Message(models.Model):
         CREATED = "CREATED"
         SENT = "SENT"
         FAILED = "FAILED"
+        # Not sent because the chat became unreachable
+        SKIPPED = "SKIPPED"
 
     class Sender(models.TextChoices):
         BOT = "BOT"
@@ -355,37 +556,235 @@ class Proxy(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     last_used = models.DateTimeField(null=True)
     fail_count = models.IntegerField(default=0)
+    # Set while a scraper holds the proxy, see `lease`
+    leased_until = models.DateTimeField(null=True, blank=True)
+    lease_token = models.UUIDField(null=True, blank=True)
+    # Rolling averages of the scraping attempts made through the proxy
+    latency_seconds = models.FloatField(null=True, blank=True)
+    success_rate = models.FloatField(default=1.0)
 
     class Meta:
         constraints = [
             UniqueConstraint(fields=["domain", "port"], name="unique_domain_port_combo")
         ]
 
+    @staticmethod
+    def score_expression():
+        """
+        Expected seconds per successful attempt, lower is better.
+        Proxies that were never measured have no score.
+        """
+        return F("latency_seconds") / Greatest(
+            F("success_rate"), Value(0.05), output_field=models.FloatField()
+        )
+
     @classmethod
-    def get_relevant_proxy(cls):
-        # Try to get an unused proxy (i.e., last_used is None)
-        unused_proxy = cls.objects.filter(
-            status=cls.Status.ACTIVE, last_used__isnull=True
-        ).first()
-
-        if unused_proxy:
-            return unused_proxy
-
-        # If no unused proxy is available, get the one used the longest time ago
-        oldest_used_proxy = (
-            cls.objects.filter(status=cls.Status.ACTIVE, last_used__isnull=False)
-            .order_by("last_used")
-            .first()
+    def with_score(cls) -> QuerySet:
+        return cls.objects.annotate(score=cls.score_expression())
+
+    @classmethod
+    def lease(cls, lease_seconds: int = PROXY_LEASE_SECONDS) -> Optional["Proxy"]:
+        """
+        Atomically claims the best scored active proxy that is not leased by
+        another scraper. Unmeasured proxies are tried first, and a share of
+        leases (PROXY_EXPLORATION_RATE) picks the least recently used proxy
+        instead so weaker proxies get another chance.
+
+        Locked rows are skipped so concurrent scrapers never wait on, or pick,
+        the same proxy. A lease that is never released expires on its own.
+        """
+        now = timezone.now()
+        if random.random() < PROXY_EXPLORATION_RATE:
+            ordering = [F("last_used").asc(nulls_first=True), "id"]
+        else:
+            ordering = [
+                F("score").asc(nulls_first=True),
+                F("last_used").asc(nulls_first=True),
+                "id",
+            ]
+
+        with transaction.atomic():
+            proxy = (
+                cls.with_score()
+                .select_for_update(skip_locked=True)
+                .filter(status=cls.Status.ACTIVE)
+                .filter(Q(leased_until__isnull=True) | Q(leased_until__lt=now))
+                .order_by(*ordering)
+                .first()
+            )
+            if proxy is None:
+                return None
+
+            proxy.leased_until = now + timedelta(seconds=lease_seconds)
+            proxy.lease_token = uuid.uuid4()
+            proxy.last_used = now
+            proxy.save(update_fields=["leased_until", "lease_token", "last_used"])
+
+        return proxy
+
+    def release(
+        self, success: Optional[bool] = None, latency_seconds: Optional[float] = None
+    ):
+        """
+        Gives the lease back, counting a failure if `success` is False and
+        updating the rolling success rate of the proxy. The rolling latency
+        only takes successful attempts, failures often end early or time out.
+        `None` releases the proxy without recording a result.
+
+        Counters are updated in the database so concurrent releases are not lost.
+        Does nothing if the lease expired and was claimed by another scraper.
+        """
+        updates = {
+            "leased_until": None,
+            "lease_token": None,
+            "last_used": timezone.now(),
+        }
+        if success is not None:
+            updates["success_rate"] = PROXY_SCORE_SMOOTHING * float(success) + (
+                1 - PROXY_SCORE_SMOOTHING
+            ) * F("success_rate")
+        if success and latency_seconds is not None:
+            updates["latency_seconds"] = Case(
+                When(latency_seconds__isnull=True, then=Value(latency_seconds)),
+                default=PROXY_SCORE_SMOOTHING * latency_seconds
+                + (1 - PROXY_SCORE_SMOOTHING) * F("latency_seconds"),
+                output_field=models.FloatField(),
+            )
+        if success is False:
+            updates["fail_count"] = F("fail_count") + 1
+            # Compared against the value before this update
+            updates["status"] = Case(
+                When(
+                    fail_count__gte=MAX_RETRIES_PER_PROXY,
+                    then=Value(self.Status.INACTIVE),
+                ),
+                default=F("status"),
+            )
+
+        Proxy.objects.filter(id=self.id, lease_token=self.lease_token).update(**updates)
+        self.leased_until = None
+        self.lease_token = None
+
+
+class TownManager(models.Manager):
+    def due(self):
+        """
+        Enabled towns whose next poll is due, most important first.
+
+        A small margin stops towns from missing a scheduler tick by seconds.
+        """
+        return self.filter(
+            enabled=True, next_due_at__lte=timezone.now() + timedelta(minutes=1)
+        ).order_by("-priority", "next_due_at")
+
+
+class Town(models.Model):
+    objects = TownManager()
+
+    class FetchMode(models.TextChoices):
+        HTTP = "HTTP"
+        BROWSER = "BROWSER"
+
+    # Weight of the latest observation in the posts per hour average
+    POSTS_PER_HOUR_SMOOTHING = 0.3
+
+    name = models.CharField(max_length=200)
+    url_ext = models.CharField(max_length=200, unique=True)
+    enabled = models.BooleanField(default=True)
+    # Towns with higher priority are scraped first
+    priority = models.IntegerField(default=0)
+    # Uses SCRAPER_FETCH_MODE when not set
+    fetch_mode = models.CharField(
+        max_length=20, choices=FetchMode.choices, null=True, blank=True
+    )
+    poll_interval_minutes = models.FloatField(default=SCRAPER_MIN_POLL_MINUTES)
+    next_due_at = models.DateTimeField(default=timezone.now)
+    last_scraped_at = models.DateTimeField(null=True, blank=True)
+    posts_per_hour = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-priority"]
+
+    def __str__(self):
+        return f"{self.name} ({self.url_ext})"
+
+    def schedule_next_poll(self, new_posts_count: int):
+        """
+        Updates the observed post rate and spaces out the next poll so that
+        busy towns are polled often and quiet towns rarely.
+
+        The first poll keeps the default interval, the posts it counts go back
+        further than any interval so they can't give a rate.
+        """
+        now = timezone.now()
+        if self.last_scraped_at is not None:
+            hours_since_last_scrape = (
+                now - self.last_scraped_at
+            ).total_seconds() / 3600
+            observed_posts_per_hour = new_posts_count / max(
+                hours_since_last_scrape, 1 / 60
+            )
+
+            if self.posts_per_hour is None:
+                self.posts_per_hour = observed_posts_per_hour
+            else:
+                self.posts_per_hour = (
+                    self.POSTS_PER_HOUR_SMOOTHING * observed_posts_per_hour
+                    + (1 - self.POSTS_PER_HOUR_SMOOTHING) * self.posts_per_hour
+                )
+
+            if self.posts_per_hour > 0:
+                interval_minutes = (
+                    SCRAPER_TARGET_POSTS_PER_POLL / self.posts_per_hour * 60
+                )
+            else:
+                interval_minutes = SCRAPER_MAX_POLL_MINUTES
+            self.poll_interval_minutes = min(
+                max(interval_minutes, SCRAPER_MIN_POLL_MINUTES),
+                SCRAPER_MAX_POLL_MINUTES,
+            )
+
+        self.last_scraped_at = now
+        self.next_due_at = now + timedelta(minutes=self.poll_interval_minutes)
+        self.save(
+            update_fields=[
+                "posts_per_hour",
+                "poll_interval_minutes",
+                "last_scraped_at",
+                "next_due_at",
+            ]
         )
 
-        return oldest_used_proxy
 
-    def update_usage(self, success: bool):
-        self.last_used = timezone.now()
+class TownCursor(models.Model):
+    """
+    Newest post already ingested for a town, so the scraper can stop as
+    soon as it reaches posts it has seen before
+    """
+
+    town_url_ext = models.CharField(max_length=200, unique=True)
+    latest_external_id = models.BigIntegerField()
+    latest_posted_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
-        if not success:
-            self.fail_count += 1
-            if self.fail_count > MAX_RETRIES_PER_PROXY:
-                self.status = self.Status.INACTIVE
+    @classmethod
+    def advance(cls, town_url_ext: str, external_id: int, posted_at):
+        """
+        Moves the cursor forward, never backwards (e.g. by an overlapping run)
+        """
+        cursor, created = cls.objects.get_or_create(
+            town_url_ext=town_url_ext,
+            defaults={
+                "latest_external_id": external_id,
+                "latest_posted_at": posted_at,
+            },
+        )
+        if not created:
+            cls.objects.filter(id=cursor.id, latest_external_id__lt=external_id).update(
+                latest_external_id=external_id,
+                latest_posted_at=posted_at,
+                updated_at=timezone.now(),
+            )
 
-        self.save()
+    def __str__(self):
+        return f"{self.town_url_ext} up to {self.latest_external_id}"
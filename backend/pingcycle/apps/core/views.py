@@ -117,8 +117,10 @@ class ChatsViewSet(
             if chat.state == Chat.State.ACTIVE
             else Chat.State.ACTIVE
         )
+        # Turned on/off by the user, e.g. after unblocking the bot
+        chat.inactive_reason = None
 
-        chat.save(update_fields=["state"])
+        chat.save(update_fields=["state", "inactive_reason"])
 
         serializer = ChatsSerializer(chat)
         return Response({"chat": serializer.data})
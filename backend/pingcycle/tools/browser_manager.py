@@ -0,0 +1,74 @@
+import time
+import asyncio
+from typing import Optional, Dict, List
+
+from playwright.async_api import Playwright, Browser, BrowserContext
+
+
+class BrowserManager:
+    """
+    Keeps one long-lived Chromium per scraper run and hands out a fresh
+    context (each with its own proxy) for every town attempt.
+
+    The browser is only relaunched if it crashes or gets disconnected.
+    """
+
+    LAUNCH_ARGS = ["--disable-gpu"]
+
+    def __init__(self, playwright: Playwright):
+        self.playwright = playwright
+        self._browser: Optional[Browser] = None
+        self._lock = asyncio.Lock()
+        # Seconds taken by each launch / context creation
+        self.timings: Dict[str, List[float]] = {"launch": [], "new_context": []}
+
+    async def get_browser(self) -> Browser:
+        async with self._lock:
+            if self._browser is None or not self._browser.is_connected():
+                if self._browser is not None:
+                    print("🔁 Browser disconnected, relaunching")
+
+                start = time.perf_counter()
+                self._browser = await self.playwright.chromium.launch(
+                    headless=True, args=self.LAUNCH_ARGS
+                )
+                elapsed = time.perf_counter() - start
+                self.timings["launch"].append(elapsed)
+                print(f"Browser launched in {elapsed:.2f}s")
+
+            return self._browser
+
+    async def new_context(
+        self, proxy_settings: Optional[dict] = None, **kwargs
+    ) -> BrowserContext:
+        """
+        Creates a new isolated context, relaunching the browser once if
+        it died between the health check and the call
+        """
+        for attempt in range(2):
+            browser = await self.get_browser()
+            start = time.perf_counter()
+            try:
+                context = await browser.new_context(proxy=proxy_settings, **kwargs)
+            except Exception:
+                if attempt == 0 and not browser.is_connected():
+                    continue
+                raise
+            self.timings["new_context"].append(time.perf_counter() - start)
+            return context
+
+    async def close(self):
+        async with self._lock:
+            if self._browser is not None and self._browser.is_connected():
+                await self._browser.close()
+            self._browser = None
+
+    def get_timings_summary(self) -> Dict[str, Dict[str, float]]:
+        summary = {}
+        for name, values in self.timings.items():
+            summary[name] = {
+                "count": len(values),
+                "total": round(sum(values), 3),
+                "avg": round(sum(values) / len(values), 3) if values else 0.0,
+            }
+        return summary
@@ -0,0 +1,54 @@
+import time
+from typing import Optional
+
+
+class CircuitBreaker:
+    """
+    Stops calling a service that is down: after `failure_threshold` failures
+    in a row the circuit opens and calls are refused for `reset_seconds`.
+    A single trial call is then let through, closing the circuit if it
+    succeeds and opening it again if not.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self.failure_count = 0
+        # Time until which calls are refused, None while the circuit is closed
+        self.open_until: Optional[float] = None
+        self._trial_in_progress = False
+
+    @property
+    def paused_until(self) -> Optional[float]:
+        """
+        Earliest time a call may be allowed, None if calls are allowed now
+        """
+        if self.open_until is None:
+            return None
+        if self._trial_in_progress:
+            # Decided by the trial call, check again once it is done
+            return time.time() + self.reset_seconds
+        return self.open_until
+
+    def allow_request(self) -> bool:
+        if self.open_until is None:
+            return True
+        if self._trial_in_progress or time.time() < self.open_until:
+            return False
+
+        self._trial_in_progress = True
+        return True
+
+    def record_success(self):
+        self.failure_count = 0
+        self.open_until = None
+        self._trial_in_progress = False
+
+    def record_failure(self):
+        self.failure_count += 1
+        self._trial_in_progress = False
+        if self.failure_count >= self.failure_threshold:
+            if self.open_until is None:
+                print(f"⚡ Circuit opened after {self.failure_count} failures")
+            self.open_until = time.time() + self.reset_seconds
@@ -0,0 +1,250 @@
+import time
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Any
+from urllib.parse import quote
+
+import httpx
+
+import pingcycle.apps.core.models as core_models
+
+# Signs that we got an anti-bot page instead of the listing
+CHALLENGE_MARKERS = [
+    "challenge-platform",
+    "cf-browser-verification",
+    "cf-chl-",
+    "just a moment...",
+    "g-recaptcha",
+    "h-captcha",
+]
+CHALLENGE_STATUS_CODES = [403, 429, 503]
+
+VOID_ELEMENTS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "track",
+    "wbr",
+}
+
+
+class HttpFallbackError(Exception):
+    """
+    Raised when the listing cannot be served over plain HTTP and
+    the browser should be used instead
+    """
+
+    pass
+
+
+class ProductRowsParser(HTMLParser):
+    """
+    Reads product rows (`#fc-data div[data-id]`) from server-rendered HTML,
+    returning the same fields as the in-page extraction
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.found_data_container = False
+        self.product_rows: List[Dict[str, Any]] = []
+
+        self._stack: List[str] = []
+        self._data_container_depth: Optional[int] = None
+        self._row_depth: Optional[int] = None
+        self._name_description_depth: Optional[int] = None
+        self._location_depth: Optional[int] = None
+        # (field, depth, collected text) of elements whose text we are reading
+        self._captures: List[list] = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get("class") or "").split()
+        depth = len(self._stack)
+
+        if tag not in VOID_ELEMENTS:
+            self._stack.append(tag)
+
+        if attrs.get("id") == "fc-data":
+            self.found_data_container = True
+            self._data_container_depth = depth
+            return
+
+        if self._data_container_depth is None:
+            return
+
+        if self._row_depth is None:
+            if tag == "div" and "data-id" in attrs:
+                self._row_depth = depth
+                self.product_rows.append(
+                    {
+                        "external_id": attrs["data-id"],
+                        "is_offered": False,
+                        "time_ago": None,
+                        "product_name": None,
+                        "description": None,
+                        "img": None,
+                        "sublocation": None,
+                    }
+                )
+            return
+
+        product_row = self.product_rows[-1]
+
+        if "text-offer" in classes:
+            product_row["is_offered"] = True
+
+        if tag == "img" and product_row["img"] is None and "data-src" in attrs:
+            product_row["img"] = attrs["data-src"]
+
+        if (
+            tag == "span"
+            and "post-list-item-date" in classes
+            and "text-lighten-less" in classes
+        ):
+            self._start_capture("time_ago", depth)
+
+        if (
+            "post-list-item-content-description" in classes
+            and "hide-for-small-only" in classes
+        ):
+            self._name_description_depth = depth
+        elif self._name_description_depth is not None:
+            if tag == "a" and self._stack[-2:] == ["h4", "a"]:
+                self._start_capture("product_name", depth)
+            elif tag == "p":
+                self._start_capture("description", depth)
+
+        if "post-list-item-header-icon" in classes and "location-icon" in classes:
+            self._location_depth = depth
+        elif self._location_depth is not None and tag == "span":
+            self._start_capture("sublocation", depth)
+
+    def handle_endtag(self, tag):
+        if tag not in self._stack:
+            return
+
+        # Tolerate unclosed elements by popping up to the matching tag
+        while self._stack:
+            popped = self._stack.pop()
+            self._close_element(len(self._stack))
+            if popped == tag:
+                break
+
+    def handle_data(self, data):
+        for capture in self._captures:
+            capture[2].append(data)
+
+    def _start_capture(self, field: str, depth: int):
+        if self.product_rows[-1][field] is None and not any(
+            capture[0] == field for capture in self._captures
+        ):
+            self._captures.append([field, depth, []])
+
+    def _close_element(self, depth: int):
+        for capture in [c for c in self._captures if c[1] == depth]:
+            field, _, texts = capture
+            self.product_rows[-1][field] = " ".join("".join(texts).split())
+            self._captures.remove(capture)
+
+        if self._name_description_depth == depth:
+            self._name_description_depth = None
+        if self._location_depth == depth:
+            self._location_depth = None
+        if self._row_depth == depth:
+            self._row_depth = None
+        if self._data_container_depth == depth:
+            self._data_container_depth = None
+
+
+class HttpFetcher:
+    """
+    Fetches town listings over plain async HTTP, keeping one
+    keep-alive client per proxy for the whole scraper run
+    """
+
+    TIMEOUT = httpx.Timeout(20.0, connect=10.0)
+
+    def __init__(self):
+        self._clients: Dict[Optional[int], httpx.AsyncClient] = {}
+        # Seconds taken by each fetch
+        self.timings: List[float] = []
+
+    def _get_client(self, proxy: Optional[core_models.Proxy]) -> httpx.AsyncClient:
+        key = proxy.id if proxy is not None else None
+        if key not in self._clients:
+            proxy_url = self._get_proxy_url(proxy) if proxy is not None else None
+            self._clients[key] = httpx.AsyncClient(
+                proxy=proxy_url, timeout=self.TIMEOUT, follow_redirects=True
+            )
+        return self._clients[key]
+
+    @staticmethod
+    def _get_proxy_url(proxy: core_models.Proxy) -> str:
+        # Credentials may contain characters with a meaning in URLs (@, :, /...)
+        username = quote(proxy.username, safe="")
+        password = quote(proxy.password, safe="")
+        return f"http://{username}:{password}@{proxy.domain}:{proxy.port}"
+
+    async def fetch_product_rows(
+        self, url: str, user_agent: str, proxy: Optional[core_models.Proxy] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns the product rows of a listing page, raising HttpFallbackError
+        if the page was blocked or does not contain the expected markup
+        """
+        client = self._get_client(proxy)
+
+        start = time.perf_counter()
+        res = await client.get(
+            url,
+            headers={
+                "User-Agent": user_agent,
+                "Accept": "text/html,application/xhtml+xml",
+                "Accept-Language": "en-IE,en;q=0.9",
+            },
+        )
+        self.timings.append(time.perf_counter() - start)
+
+        lowered_html = res.text.lower()
+        if res.status_code in CHALLENGE_STATUS_CODES or any(
+            marker in lowered_html for marker in CHALLENGE_MARKERS
+        ):
+            raise HttpFallbackError(f"Challenge page detected ({res.status_code})")
+        res.raise_for_status()
+
+        parser = ProductRowsParser()
+        parser.feed(res.text)
+        parser.close()
+
+        if not parser.found_data_container or not parser.product_rows:
+            raise HttpFallbackError("Product rows not found in HTML")
+        # Markup we only partly understand, the browser reads it as rendered
+        if any(
+            not (product_row["external_id"] or "").isdigit()
+            or (product_row["is_offered"] and not product_row["product_name"])
+            for product_row in parser.product_rows
+        ):
+            raise HttpFallbackError("Incomplete product rows in HTML")
+
+        return parser.product_rows
+
+    def get_timings_summary(self) -> Dict[str, float]:
+        return {
+            "count": len(self.timings),
+            "total": round(sum(self.timings), 3),
+            "avg": (
+                round(sum(self.timings) / len(self.timings), 3) if self.timings else 0.0
+            ),
+        }
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients = {}
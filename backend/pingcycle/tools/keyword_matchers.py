@@ -0,0 +1,268 @@
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from pingcycle.tools.trigrams import (
+    get_trigrams,
+    get_trigram_set,
+    normalize_keyword_name,
+    strict_word_similarity,
+)
+
+
+class InMemoryKeywordMatcher:
+    """
+    Matches products against an in-process inverted trigram index of the
+    active keywords, giving the same results as the SQL matcher.
+
+    Keywords are indexed by normalized name, so a name watched by many users
+    is scored once per product and the match fanned out to all its keywords.
+    Each product is only scored against the names sharing at least one
+    trigram with it, since any other name has a similarity of 0.
+
+    The index lives as long as the worker process. It is brought up to date
+    on every `sync` by diffing against the current active keywords, since
+    keywords & chats are changed from other processes (web, bot webhooks)
+    whose model signals never reach the worker.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+
+        self._keyword_names: Dict[int, str] = {}
+        # Normalized name -> ids of the keywords with that name
+        self._keyword_ids_by_name: Dict[str, Set[int]] = {}
+        self._name_trigrams: Dict[str, FrozenSet[str]] = {}
+        # Trigram -> normalized names containing it
+        self._index: Dict[str, Set[str]] = defaultdict(set)
+
+    def sync(self, keywords: Iterable[Tuple[int, str]]):
+        """
+        Updates the index to the given (id, name) active keywords, only
+        touching keywords that were added, removed or renamed
+        """
+        keyword_names = dict(keywords)
+
+        for keyword_id, name in list(self._keyword_names.items()):
+            if keyword_names.get(keyword_id) != name:
+                self._remove_keyword(keyword_id)
+
+        for keyword_id, name in keyword_names.items():
+            if keyword_id not in self._keyword_names:
+                self._add_keyword(keyword_id, name)
+
+    def find_matches(
+        self, products: Iterable[Tuple[int, str, Optional[str]]]
+    ) -> List[Tuple[int, int]]:
+        """
+        Returns the (product id, keyword id) pairs whose similarity is above
+        the threshold, for (id, product name, description) products
+        """
+        matches = []
+        for product_id, product_name, description in products:
+            texts_trigrams = [
+                get_trigrams(text) for text in (product_name, description) if text
+            ]
+
+            candidate_names = set()
+            for trigrams, _ in texts_trigrams:
+                for trigram in set(trigrams):
+                    candidate_names.update(self._index.get(trigram, ()))
+
+            for name in candidate_names:
+                name_trigrams = self._name_trigrams[name]
+                similarity = max(
+                    strict_word_similarity(name_trigrams, trigrams, bounds)
+                    for trigrams, bounds in texts_trigrams
+                )
+                if similarity > self.threshold:
+                    matches.extend(
+                        (product_id, keyword_id)
+                        for keyword_id in self._keyword_ids_by_name[name]
+                    )
+
+        return matches
+
+    def _add_keyword(self, keyword_id: int, name: str):
+        self._keyword_names[keyword_id] = name
+
+        normalized_name = normalize_keyword_name(name)
+        if normalized_name not in self._keyword_ids_by_name:
+            trigrams = get_trigram_set(normalized_name)
+            self._keyword_ids_by_name[normalized_name] = set()
+            self._name_trigrams[normalized_name] = trigrams
+            for trigram in trigrams:
+                self._index[trigram].add(normalized_name)
+
+        self._keyword_ids_by_name[normalized_name].add(keyword_id)
+
+    def _remove_keyword(self, keyword_id: int):
+        normalized_name = normalize_keyword_name(self._keyword_names.pop(keyword_id))
+        keyword_ids = self._keyword_ids_by_name[normalized_name]
+        keyword_ids.discard(keyword_id)
+        if keyword_ids:
+            return
+
+        # Last keyword with this name
+        del self._keyword_ids_by_name[normalized_name]
+        for trigram in self._name_trigrams.pop(normalized_name):
+            names = self._index[trigram]
+            names.discard(normalized_name)
+            if not names:
+                del self._index[trigram]
+
+
+class VectorizedKeywordMatcher:
+    """
+    Scores large batches of products against all keywords at once, e.g. to
+    catch up after an outage or to backfill a new keyword.
+
+    Products and keywords become sparse binary trigram vectors and a single
+    sparse matrix product gives, for every pair, the number of keyword
+    trigrams found anywhere in the product. The strict word similarity of a
+    pair can never be above `shared trigrams / keyword trigrams`, so only
+    pairs whose bound passes the threshold are scored exactly, with the same
+    code as the in-memory matcher. Like there, each row of the keyword matrix
+    is a normalized name shared by all keywords with that name.
+    """
+
+    # Products scored per matrix product, bounds the memory used
+    CHUNK_SIZE = 5_000
+    # Scores are rounded to float4, which can push a pair whose exact ratio
+    # equals the threshold just above it. Keep those for exact scoring.
+    BOUND_MARGIN = 1e-6
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+
+        self._keywords: Dict[int, str] = {}
+        # Ids of the keywords of each row's normalized name
+        self._row_keyword_ids: List[List[int]] = []
+        self._name_trigrams: List[FrozenSet[str]] = []
+        # Trigram -> column of the keyword matrix
+        self._vocabulary: Dict[str, int] = {}
+        self._keyword_matrix: Optional[sparse.csr_matrix] = None
+        self._name_trigram_counts: Optional[np.ndarray] = None
+
+    def sync(self, keywords: Iterable[Tuple[int, str]]):
+        """
+        Sets the (id, name) keywords to match, the keyword matrix is only
+        rebuilt if they changed
+        """
+        keywords = dict(keywords)
+        if keywords == self._keywords and self._keyword_matrix is not None:
+            return
+
+        self._keywords = keywords
+        keyword_ids_by_name = defaultdict(list)
+        for keyword_id, name in keywords.items():
+            keyword_ids_by_name[normalize_keyword_name(name)].append(keyword_id)
+        self._row_keyword_ids = list(keyword_ids_by_name.values())
+        self._name_trigrams = [get_trigram_set(name) for name in keyword_ids_by_name]
+        self._vocabulary = {}
+        rows, columns = [], []
+        for row, trigrams in enumerate(self._name_trigrams):
+            for trigram in trigrams:
+                rows.append(row)
+                columns.append(
+                    self._vocabulary.setdefault(trigram, len(self._vocabulary))
+                )
+
+        self._keyword_matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+            shape=(len(self._row_keyword_ids), len(self._vocabulary)),
+        )
+        self._name_trigram_counts = np.array(
+            [len(trigrams) for trigrams in self._name_trigrams], dtype=np.float64
+        )
+
+    def find_matches(
+        self, products: Iterable[Tuple[int, str, Optional[str]]]
+    ) -> List[Tuple[int, int]]:
+        """
+        Returns the (product id, keyword id) pairs whose similarity is above
+        the threshold, for (id, product name, description) products
+        """
+        if not self._row_keyword_ids:
+            return []
+
+        matches = []
+        chunk = []
+        for product in products:
+            chunk.append(product)
+            if len(chunk) == self.CHUNK_SIZE:
+                matches.extend(self._find_chunk_matches(chunk))
+                chunk = []
+        if chunk:
+            matches.extend(self._find_chunk_matches(chunk))
+
+        return matches
+
+    def _find_chunk_matches(
+        self, products: List[Tuple[int, str, Optional[str]]]
+    ) -> List[Tuple[int, int]]:
+        products_texts_trigrams = []
+        rows, columns = [], []
+        for row, (_, product_name, description) in enumerate(products):
+            texts_trigrams = [
+                get_trigrams(text) for text in (product_name, description) if text
+            ]
+            products_texts_trigrams.append(texts_trigrams)
+
+            product_columns = {
+                self._vocabulary[trigram]
+                for trigrams, _ in texts_trigrams
+                for trigram in trigrams
+                if trigram in self._vocabulary
+            }
+            rows.extend([row] * len(product_columns))
+            columns.extend(product_columns)
+
+        product_matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+            shape=(len(products), len(self._vocabulary)),
+        )
+        # Shared trigrams of every (product, name) pair with at least one
+        shared_counts = (product_matrix @ self._keyword_matrix.T).tocoo()
+
+        upper_bounds = shared_counts.data / self._name_trigram_counts[shared_counts.col]
+        candidates = upper_bounds > self.threshold - self.BOUND_MARGIN
+
+        matches = []
+        for row, column in zip(
+            shared_counts.row[candidates], shared_counts.col[candidates]
+        ):
+            name_trigrams = self._name_trigrams[column]
+            similarity = max(
+                strict_word_similarity(name_trigrams, trigrams, bounds)
+                for trigrams, bounds in products_texts_trigrams[row]
+            )
+            if similarity > self.threshold:
+                matches.extend(
+                    (products[row][0], keyword_id)
+                    for keyword_id in self._row_keyword_ids[column]
+                )
+
+        return matches
+
+
+KEYWORD_MATCHER_CLASSES = {
+    "IN_MEMORY": InMemoryKeywordMatcher,
+    "VECTORIZED": VectorizedKeywordMatcher,
+}
+
+_keyword_matchers = {}
+
+
+def get_keyword_matcher(name: str, threshold: float):
+    """
+    Returns the matcher shared by the whole process, so its keyword index
+    is kept between matching cycles
+    """
+    matcher = _keyword_matchers.get(name)
+    if matcher is None or matcher.threshold != threshold:
+        matcher = KEYWORD_MATCHER_CLASSES[name](threshold)
+        _keyword_matchers[name] = matcher
+    return matcher
@@ -1,6 +1,8 @@
 from datetime import timedelta
 from typing import Optional, Tuple, List, Dict
 import requests
+from requests.adapters import HTTPAdapter
+import httpx
 import uuid
 import time
 
@@ -14,7 +16,16 @@ from rest_framework.response import Response
 import sentry_sdk
 
 import pingcycle.apps.core.models as core_models
-from config.settings import FRONTEND_ORIGIN, WH_BASE_DOMAIN, CONFIG, ENV
+from pingcycle.tools.circuit_breaker import CircuitBreaker
+from config.settings import (
+    FRONTEND_ORIGIN,
+    WH_BASE_DOMAIN,
+    CONFIG,
+    ENV,
+    MESSAGING_MAX_IN_FLIGHT,
+    MESSAGING_CIRCUIT_FAILURE_THRESHOLD,
+    MESSAGING_CIRCUIT_RESET_SECONDS,
+)
 
 
 class UserFriendlyChatError(Exception):
@@ -39,6 +50,10 @@ class MessagingProvider:
         self._rate_limit_count = 10
         self._rate_limit_time = timedelta(seconds=10)
         self._has_image_capability = False
+        # Pauses sending while the provider is unreachable or failing
+        self.circuit_breaker = CircuitBreaker(
+            MESSAGING_CIRCUIT_FAILURE_THRESHOLD, MESSAGING_CIRCUIT_RESET_SECONDS
+        )
         if self.key is None:
             raise NotImplementedError(
                 f"{self.__class__.__name__} must define a value for `key`"
@@ -77,6 +92,16 @@ class MessagingProvider:
             f"{self.__class__.__name__}.send_message() not implemented."
         )
 
+    def get_async_client(self) -> httpx.AsyncClient:
+        raise NotImplementedError(
+            f"{self.__class__.__name__}.get_async_client() not implemented."
+        )
+
+    async def send_message_async(self, message, client: httpx.AsyncClient):
+        raise NotImplementedError(
+            f"{self.__class__.__name__}.send_message_async() not implemented."
+        )
+
     def handle_webhook(self, request: requests.Request):
         raise NotImplementedError(
             f"{self.__class__.__name__}.handle_webhook_data() not implemented."
@@ -164,12 +189,23 @@ class Telegram(MessagingProvider):
     CHAT_LIMIT_SECONDS = (1, 1)
     TOTAL_LIMIT_SECONDS = (30, 1)
 
+    CONNECT_TIMEOUT_SECONDS = 5
+    READ_TIMEOUT_SECONDS = 10
+
     def __init__(self):
         super().__init__()
         self.api_url = "https://api.telegram.org"
         self.bot_username = CONFIG["TELEGRAM_BOT_USERNAME"]
         self.bot_token = CONFIG["TELEGRAM_BOT_TOKEN"]
         self.webhook_secret = CONFIG["TELEGRAM_WEBHOOK_SECRET"]
+
+        # Keep-alive connections to the API, reused by every request
+        self.session = requests.Session()
+        self.session.mount(
+            self.api_url,
+            HTTPAdapter(pool_connections=1, pool_maxsize=MESSAGING_MAX_IN_FLIGHT),
+        )
+
         self._setup_webhook()
 
     @staticmethod
@@ -189,21 +225,103 @@ class Telegram(MessagingProvider):
         :return: A dictionary with:
             - "is_ok" (bool): True if the request was successful, False otherwise.
             - "time_sent" (datetime): Present only if successful, indicating when the request was sent.
+            - "retry_after" (int | None): Present only if unsuccessful, seconds to
+              wait before retrying when rate limited.
+            - "unreachable_reason" (Chat.InactiveReason | None): Present only if
+              unsuccessful, set when the chat cannot be sent to anymore.
             - "error_obj" (dict): Present only if unsuccessful, containing:
               - "error_res_code" (int): The HTTP status code.
               - "error_msg" (str): The response content as text.
+            - "circuit_open" (bool): Present only if the request was not made
+              because the circuit breaker is open.
+        """
+        if not self.circuit_breaker.allow_request():
+            return self._get_circuit_open_result()
+
+        url = f"{self.api_url}/bot{self.bot_token}/{method_name}"
+        try:
+            res = self.session.post(
+                url,
+                json=params,
+                timeout=(self.CONNECT_TIMEOUT_SECONDS, self.READ_TIMEOUT_SECONDS),
+            )
+        except requests.RequestException as e:
+            return self._get_request_error_result(e)
+        except BaseException:
+            # Anything else still ends a trial call, or the circuit stays open
+            self.circuit_breaker.record_failure()
+            raise
+
+        return self._get_api_result(res, method_name, params)
+
+    async def _post_api_async(
+        self, client: httpx.AsyncClient, method_name: str, **params
+    ):
+        """
+        Same as `_post_api`, but over a pooled async client so many requests
+        can be in flight at once
         """
+        if not self.circuit_breaker.allow_request():
+            return self._get_circuit_open_result()
+
         url = f"{self.api_url}/bot{self.bot_token}/{method_name}"
-        res = requests.post(url, json=params)
+        try:
+            res = await client.post(url, json=params)
+        except httpx.HTTPError as e:
+            return self._get_request_error_result(e)
+        except BaseException:
+            # Includes the send being cancelled
+            self.circuit_breaker.record_failure()
+            raise
+
+        return self._get_api_result(res, method_name, params)
 
+    @staticmethod
+    def _get_circuit_open_result():
+        return {
+            "is_ok": False,
+            "circuit_open": True,
+            "error_obj": {
+                "error_res_code": 503,
+                "error_msg": "Not sent, Telegram API is failing (circuit open)",
+            },
+        }
+
+    def _get_request_error_result(self, e: Exception):
+        """
+        No response (timeout, connection error...), counts as the API failing
+        """
+        self.circuit_breaker.record_failure()
+        return {
+            "is_ok": False,
+            "error_obj": {"error_res_code": 503, "error_msg": f"Request failed: {e}"},
+        }
+
+    def _get_api_result(
+        self, res: requests.Response | httpx.Response, method_name: str, params: dict
+    ):
         status_code = res.status_code
 
+        # Client errors mean the API itself is up
+        if status_code >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
         if status_code == 200:
-            return {"is_ok": True, "time_sent": time.time(), "msg": res.json()}
+            try:
+                msg = res.json()
+            except ValueError:
+                # Sent all the same, it must not be retried
+                msg = res.text
+            return {"is_ok": True, "time_sent": time.time(), "msg": msg}
         else:
+            retry_after = None
             try:
                 res_json = res.json()
                 res_text = res_json.get("description")
+                # Seconds to wait before retrying, sent with 429s
+                retry_after = (res_json.get("parameters") or {}).get("retry_after")
             except Exception:
                 res_text = res.text
             if not res_text:
@@ -233,9 +351,30 @@ class Telegram(MessagingProvider):
                     )
             return {
                 "is_ok": False,
+                "retry_after": retry_after,
+                "unreachable_reason": self._get_unreachable_reason(
+                    status_code, res_text
+                ),
                 "error_obj": {"error_res_code": status_code, "error_msg": res_text},
             }
 
+    @staticmethod
+    def _get_unreachable_reason(
+        status_code: int, res_text: str
+    ) -> Optional[core_models.Chat.InactiveReason]:
+        """
+        Errors after which nothing can be sent to the chat anymore
+        (e.g. "Forbidden: bot was blocked by the user")
+        """
+        res_text = res_text.lower()
+        if status_code == 403:
+            if "deactivated" in res_text:
+                return core_models.Chat.InactiveReason.USER_DEACTIVATED
+            return core_models.Chat.InactiveReason.BOT_BLOCKED
+        if status_code == 400 and "chat not found" in res_text:
+            return core_models.Chat.InactiveReason.CHAT_NOT_FOUND
+        return None
+
     def handle_webhook(self, request: requests.Request):
         print("RECEIVED MESSAGE")
         data = request.data
@@ -337,6 +476,32 @@ class Telegram(MessagingProvider):
             parse_mode="Markdown",
         )
 
+    def get_async_client(self) -> httpx.AsyncClient:
+        """
+        Client for `send_message_async`, its keep-alive pool holds a
+        connection for every send that can be in flight
+        """
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MESSAGING_MAX_IN_FLIGHT,
+                max_keepalive_connections=MESSAGING_MAX_IN_FLIGHT,
+            ),
+            timeout=httpx.Timeout(
+                self.READ_TIMEOUT_SECONDS, connect=self.CONNECT_TIMEOUT_SECONDS
+            ),
+        )
+
+    async def send_message_async(
+        self, message: core_models.Message, client: httpx.AsyncClient
+    ):
+        return await self._post_api_async(
+            client,
+            "sendMessage",
+            chat_id=message.chat.reference,
+            text=message.text,
+            parse_mode="Markdown",
+        )
+
     def _get_webhook_url(self):
         """
         Default get_webhook_url cannot be called during init due to circular import
@@ -1,11 +1,25 @@
 import time
+import heapq
+import asyncio
 import random
-from typing import Optional, Tuple, List, Dict
+import itertools
+import threading
+from collections import defaultdict, deque
+from typing import Any, Optional, Tuple, List, Dict
 
+import httpx
+from asgiref.sync import async_to_sync, sync_to_async
 from django.db import transaction
 
-from config.settings import MAX_RETRIES_PER_MESSAGE
+from config.settings import (
+    MAX_RETRIES_PER_MESSAGE,
+    MAX_RATE_LIMITED_RETRIES_PER_MESSAGE,
+    MESSAGE_RETRY_BACKOFF_SECONDS,
+    MESSAGING_DISPATCH_MODE,
+    MESSAGING_MAX_IN_FLIGHT,
+)
 from pingcycle.tools.messaging_providers import MessagingProvider
+from pingcycle.tools.circuit_breaker import CircuitBreaker
 import pingcycle.apps.core.models as core_models
 
 
@@ -23,8 +37,18 @@ class MessageScheduler:
 
     # TODO: Raising error for chat intervals should be on boot + test
 
-    def __init__(self, provider: MessagingProvider):
+    # How often the async loop checks for a stop request while waiting
+    STOP_CHECK_SECONDS = 1
+
+    def __init__(
+        self,
+        provider: MessagingProvider,
+        stop_requested: Optional[threading.Event] = None,
+    ):
         self.chat_provider = provider
+        # Set from another thread to stop sending after the sends in progress,
+        # the messages left keep their CREATED status
+        self._stop_requested = stop_requested
 
         self.chat_interval, self.total_interval = self._set_intervals(
             provider.CHAT_LIMIT_SECONDS, provider.TOTAL_LIMIT_SECONDS
@@ -34,8 +58,28 @@ class MessageScheduler:
         self.max_retries = (
             MAX_RETRIES_PER_MESSAGE  # Maximum number of retries per message
         )
+        self.retry_backoff_seconds = MESSAGE_RETRY_BACKOFF_SECONDS
+        # Rate limited sends per message id, retried apart from `max_retries`
+        self.max_rate_limited_retries = MAX_RATE_LIMITED_RETRIES_PER_MESSAGE
+        self._rate_limited_counts = defaultdict(int)
+        # No sends before this time, set when the provider rate limits us
+        self.paused_until = 0
+        # Same, per chat, set when retrying a failed message
+        self._chat_paused_until = {}
+        # Providers may pause sending while they are failing
+        self.circuit_breaker: Optional[CircuitBreaker] = getattr(
+            provider, "circuit_breaker", None
+        )
         self.message_queue = self._set_message_queue()
 
+        # Messages of `message_queue` waiting to be sent, per chat
+        self._chat_queues: Dict[Any, deque] = defaultdict(deque)
+        # (time the chat may send next, tie breaker, chat) of chats with
+        # waiting messages, each chat is in the heap at most once
+        self._chats_heap: List[Tuple[float, int, Any]] = []
+        self._scheduled_chats = set()
+        self._heap_counter = itertools.count()
+
     @staticmethod
     def _set_intervals(chat_limit, total_limit):
         """
@@ -64,132 +108,335 @@ class MessageScheduler:
 
     def send_notified_products_in_queue(self):
         """
-        Continuously loops through the message queue until it is empty.
+        Sends queued messages until none are left, as fast as the chat and
+        total limits allow.
+
+        Pending messages are kept per chat in queue order, and the chats in a
+        heap keyed on the time their next message may be sent. Each send is
+        O(log n) whatever the backlog looks like, and the loop only sleeps
+        until the earliest message that is allowed to go out.
 
-        In each iteration, it checks whether the chat limit or the total
-        limit has been exceeded.
+        Messages appended to `message_queue` while sending are picked up on
+        the next iteration.
+
+        With MESSAGING_DISPATCH_MODE "ASYNC" this runs
+        `send_notified_products_in_queue_async` instead.
+        """
+        if MESSAGING_DISPATCH_MODE == "ASYNC":
+            async_to_sync(self.send_notified_products_in_queue_async)()
+            return
 
-        If the total limit is exceeded, the process waits before proceeding
-        to the next iteration.
+        self._schedule_queued_messages()
 
-        If the chat limit is exceeded, the entry is re-added
-        to the end of the queue.
+        while self._chats_heap and not self._is_stop_requested():
+            chat_ready_time, _, chat = heapq.heappop(self._chats_heap)
+            self._scheduled_chats.discard(chat)
 
-        At the end of the loop, if there are entries left, it calculates
-        the wait time based on the chat with the shortest remaining wait time.
+            ready_time = self._get_ready_time(chat_ready_time)
+            wait_time = ready_time - time.time()
+            if wait_time > 0:
+                self._sleep(wait_time)
+                if self._is_stop_requested():
+                    break
 
-        TODO: Could be further optimised
-        e.g. Current flaw if there is 1 chat in the loop with 30 messages
-        and we reach the limit we will only be able to wait after we have
-        looped though the whole list with 29 items. Then, will hit the limit again
-        and will only wait after looping through 28 items...
+            message = self._chat_queues[chat].popleft()
+            result = self._attempt_send(message)
+            self._handle_send_result(message, result)
+            if result["is_ok"]:
+                self.last_overall_send_time = result["time_sent"]
+
+            self._schedule_queued_messages()
+            self._schedule_chat(chat)
+
+    async def send_notified_products_in_queue_async(self):
         """
-        while len(self.message_queue) > 0:
-            for _ in range(len(self.message_queue)):
-                current_time = time.time()
+        Same as `send_notified_products_in_queue`, but keeps up to
+        MESSAGING_MAX_IN_FLIGHT sends in flight over the provider's pooled
+        async client, so the round trip of a send does not cap throughput
+        below the provider's total limit.
+
+        The global slot is taken when a send starts, while a chat is only
+        rescheduled once its send finished, so the chat limit, the order of
+        a chat's messages and retries work like in the sync loop.
+        """
+        semaphore = asyncio.Semaphore(MESSAGING_MAX_IN_FLIGHT)
+        sends = []
+        in_flight = set()
+
+        async with self.chat_provider.get_async_client() as client:
+            self._schedule_queued_messages()
+
+            while self._chats_heap or in_flight:
+                if not self._chats_heap or self._is_stop_requested():
+                    if not in_flight:
+                        break
+                    # A finished send may reschedule its chat
+                    await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                # Waiting for a slot may change the heap and the pauses, so the
+                # next chat is only picked once a slot is taken
+                await semaphore.acquire()
+                chat_ready_time, _, chat = self._chats_heap[0]
+                ready_time = self._get_ready_time(chat_ready_time)
+                wait_time = ready_time - time.time()
+                if wait_time > 0:
+                    semaphore.release()
+                    if self._stop_requested is not None:
+                        wait_time = min(wait_time, self.STOP_CHECK_SECONDS)
+                    if in_flight:
+                        # Wake up early if a finished send schedules an earlier chat
+                        await asyncio.wait(
+                            in_flight,
+                            timeout=wait_time,
+                            return_when=asyncio.FIRST_COMPLETED,
+                        )
+                    else:
+                        await asyncio.sleep(wait_time)
+                    continue
 
-                message = self.message_queue.pop(0)
-                last_chat_time = self.last_sent_time_per_chat.get(message.chat, 0)
+                heapq.heappop(self._chats_heap)
+                self._scheduled_chats.discard(chat)
+                self.last_overall_send_time = time.time()
 
-                chat_interval_passed = (
-                    current_time - last_chat_time >= self.chat_interval
+                message = self._chat_queues[chat].popleft()
+                send = asyncio.create_task(
+                    self._send_async(client, semaphore, chat, message)
                 )
-                total_interval_passed = (
-                    current_time - self.last_overall_send_time >= self.total_interval
+                sends.append(send)
+                in_flight.add(send)
+                send.add_done_callback(in_flight.discard)
+
+        # Raises the first error of a send, if any
+        await asyncio.gather(*sends)
+
+    async def _send_async(
+        self,
+        client: httpx.AsyncClient,
+        semaphore: asyncio.Semaphore,
+        chat,
+        message: core_models.Message,
+    ):
+        # The slot is held until the result is handled, so the next send
+        # sees any pause it sets
+        try:
+            result = await self._attempt_send_async(client, message)
+            await sync_to_async(self._handle_send_result)(message, result)
+            self._schedule_chat(chat)
+        finally:
+            semaphore.release()
+
+    def _is_stop_requested(self) -> bool:
+        return self._stop_requested is not None and self._stop_requested.is_set()
+
+    def _sleep(self, seconds: float):
+        if self._stop_requested is None:
+            time.sleep(seconds)
+        else:
+            # Wakes up as soon as a stop is requested
+            self._stop_requested.wait(seconds)
+
+    def _get_ready_time(self, chat_ready_time: float) -> float:
+        """
+        Time a chat whose limit allows a send at `chat_ready_time` may send,
+        given the total limit and the provider's circuit breaker
+        """
+        ready_time = max(
+            chat_ready_time,
+            self.last_overall_send_time + self.total_interval,
+            self.paused_until,
+        )
+        if self.circuit_breaker is not None:
+            ready_time = max(ready_time, self.circuit_breaker.paused_until or 0)
+        return ready_time
+
+    def _handle_send_result(self, message: core_models.Message, result: dict):
+        """
+        Saves the outcome of a send. Failed messages are retried depending
+        on the error:
+        - 429 (rate limited): retried without using up a retry, after pausing
+          all sends for the `retry_after` seconds the provider asked for.
+          Failed once rate limited more than `max_rate_limited_retries` times
+        - other 4xx (bad request, bot blocked...): failed at once, retrying
+          would fail the same way. If the chat is unreachable (bot blocked,
+          account deleted...) it is also deactivated and its other queued
+          messages skipped
+        - anything else (5xx, internal errors): back to the end of their
+          chat's queue until they run out of retries, the chat waiting an
+          exponential backoff (with jitter) first
+
+        Messages not sent because the provider's circuit is open keep their
+        place and retries, and are sent once the circuit allows it.
+        """
+        if result.get("circuit_open"):
+            self._chat_queues[message.chat].appendleft(message)
+            return
+
+        if result["is_ok"]:
+            self._udpate_message_status(
+                message=message, status=core_models.Message.Status.SENT
+            )
+            self.last_sent_time_per_chat[message.chat] = result["time_sent"]
+            return
+
+        error_res_code = result["error_obj"]["error_res_code"]
+
+        if error_res_code == 429:
+            retry_after = result.get("retry_after") or self.retry_backoff_seconds
+            print(f"⏳ Rate limited, pausing sends for {retry_after}s")
+            # Flood control applies to the bot, not only to this chat
+            self.paused_until = max(self.paused_until, time.time() + retry_after)
+
+            self._rate_limited_counts[message.id] += 1
+            if self._rate_limited_counts[message.id] <= self.max_rate_limited_retries:
+                self._chat_queues[message.chat].appendleft(message)
+            else:
+                self._udpate_message_status(
+                    message=message,
+                    status=core_models.Message.Status.FAILED,
+                    error_obj=result["error_obj"],
                 )
+            return
 
-                if chat_interval_passed and total_interval_passed:
-                    result = self._attempt_send(message)
-                    if result["is_ok"]:
-                        self._udpate_message_status(
-                            message=message, status=core_models.Message.Status.SENT
-                        )
-                        self.last_sent_time_per_chat[message.chat] = result["time_sent"]
-                        self.last_overall_send_time = result["time_sent"]
-                    else:
-                        message.retry_count += 1
-                        if message.retry_count < self.max_retries:
-                            # Return item back to the queue if below retry limit
-                            self.message_queue.append(message)
-                        else:
-                            self._udpate_message_status(
-                                message=message,
-                                status=core_models.Message.Status.FAILED,
-                                error_obj=result["error_obj"],
-                            )
-                        message.save(update_fields=["retry_count"])
-                else:
-                    # If not sent, return the item back to the queue
-                    self.message_queue.append(message)
-                    # Sleep if total limit exceeded
-                    if not total_interval_passed:
-                        time.sleep(
-                            self.total_interval
-                            - (current_time - self.last_overall_send_time)
-                            + 0.01
-                        )
+        if 400 <= error_res_code < 500:
+            self._udpate_message_status(
+                message=message,
+                status=core_models.Message.Status.FAILED,
+                error_obj=result["error_obj"],
+            )
+            if result.get("unreachable_reason"):
+                self._chat_queues[message.chat].clear()
+                message.chat.deactivate_unreachable(result["unreachable_reason"])
+            return
+
+        message.retry_count += 1
+        if message.retry_count < self.max_retries:
+            self._chat_queues[message.chat].append(message)
+            self._chat_paused_until[message.chat] = (
+                time.time() + self._get_retry_backoff(message.retry_count)
+            )
+        else:
+            self._udpate_message_status(
+                message=message,
+                status=core_models.Message.Status.FAILED,
+                error_obj=result["error_obj"],
+            )
+        message.save(update_fields=["retry_count"])
 
-            # Reached the end of the loop
-            if len(self.message_queue) > 0:
-                # Calculate the shortest wait time needed for the next action
-                current_time = time.time()
-
-                # The max function ensures that we do not calculate negative wait times.
-                next_chat_intervals = [
-                    max(
-                        0,
-                        (
-                            self.chat_interval
-                            - (
-                                current_time
-                                - self.last_sent_time_per_chat.get(message.chat, 0)
-                            )
-                        ),
-                    )
-                    for message in self.message_queue
-                ]
-
-                wait_time = min(next_chat_intervals)
+    def _get_retry_backoff(self, retry_count: int) -> float:
+        """
+        Doubles with every retry, half of it random so retries of messages
+        that failed together are spread out
+        """
+        backoff = self.retry_backoff_seconds * 2 ** (retry_count - 1)
+        return backoff / 2 + random.uniform(0, backoff / 2)
 
-                if wait_time > 0:
-                    time.sleep(wait_time + 0.01)
+    def _schedule_queued_messages(self):
+        """
+        Moves messages from `message_queue` to their chat's queue
+        """
+        for message in self.message_queue:
+            self._chat_queues[message.chat].append(message)
+            self._schedule_chat(message.chat)
+        self.message_queue.clear()
+
+    def _schedule_chat(self, chat):
+        """
+        Adds the chat to the heap (once) if it has messages waiting, at the
+        time its chat limit allows the next one
+        """
+        if chat in self._scheduled_chats:
+            return
+        if not self._chat_queues[chat]:
+            del self._chat_queues[chat]
+            return
+
+        ready_time = max(
+            self.last_sent_time_per_chat.get(chat, 0) + self.chat_interval,
+            self._chat_paused_until.get(chat, 0),
+        )
+        heapq.heappush(self._chats_heap, (ready_time, next(self._heap_counter), chat))
+        self._scheduled_chats.add(chat)
 
     def _attempt_send(self, message) -> dict:
         try:
             return self.chat_provider.send_message(message)
         except Exception as e:
             # TODO: Should formatting be standardised into error object???
-            return {
-                "is_ok": False,
-                "error_obj": {
-                    "error_res_code": 500,
-                    "error_msg": f"Internal error: {e}",
-                },
-            }
+            return self._get_internal_error_result(e)
+
+    async def _attempt_send_async(self, client: httpx.AsyncClient, message) -> dict:
+        try:
+            return await self.chat_provider.send_message_async(message, client)
+        except Exception as e:
+            return self._get_internal_error_result(e)
+
+    @staticmethod
+    def _get_internal_error_result(e: Exception) -> dict:
+        return {
+            "is_ok": False,
+            "error_obj": {
+                "error_res_code": 500,
+                "error_msg": f"Internal error: {e}",
+            },
+        }
+
+    def queue_new_messages(self, external_ids: List[int]):
+        """
+        Creates messages for a batch of newly matched products and adds them
+        to the queue, so they can be sent without waiting for other batches
+        """
+        self._create_messages(external_ids)
+
+        queued_message_ids = {message.id for message in self.message_queue}
+        for chat_queue in self._chat_queues.values():
+            queued_message_ids.update(message.id for message in chat_queue)
+        for message in self._get_messages_to_send(external_ids):
+            if message.id not in queued_message_ids:
+                self.message_queue.append(message)
 
     def _set_message_queue(
         self,
     ) -> List[core_models.Message]:
         self._create_messages()
 
-        messages = core_models.Message.objects.filter(
-            status=core_models.Message.Status.CREATED,
-            sender=core_models.Message.Sender.BOT,
-        ).exclude(notified_product=None)
+        return self._get_messages_to_send()
+
+    @staticmethod
+    def _get_messages_to_send(
+        external_ids: Optional[List[int]] = None,
+    ) -> List[core_models.Message]:
+        # The chat is loaded up front since async sends can't query it lazily
+        messages = (
+            core_models.Message.objects.filter(
+                status=core_models.Message.Status.CREATED,
+                sender=core_models.Message.Sender.BOT,
+            )
+            .exclude(notified_product=None)
+            .select_related("chat")
+        )
+
+        if external_ids is not None:
+            messages = messages.filter(notified_product__external_id__in=external_ids)
 
         return list(messages)
 
     def _create_messages(
         self,
+        external_ids: Optional[List[int]] = None,
     ):
         """
         Creates new messages in the database for any products that have
         state KEYWORDS_LINKED; and then sets state to MESSAGES_CREATED
+
+        `external_ids` limits this to a batch of products
         """
         with transaction.atomic():
             products = core_models.NotifiedProduct.objects.filter(
                 state=core_models.NotifiedProduct.State.KEYWORDS_LINKED
             ).prefetch_related("keywords__user__chats")
+            if external_ids is not None:
+                products = products.filter(external_id__in=external_ids)
 
             updated_products = []
             created_messages = []
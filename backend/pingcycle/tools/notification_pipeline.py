@@ -0,0 +1,100 @@
+import time
+import asyncio
+import threading
+from typing import List, Optional
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+
+from pingcycle.tools.messaging_providers import MessagingProvider
+from pingcycle.tools.messaging_scheduler import MessageScheduler
+import pingcycle.apps.core.models as core_models
+
+
+class NotificationPipeline:
+    """
+    Matches, creates messages for and sends each town's new products as soon
+    as they are stored, instead of waiting for the whole scraper run.
+
+    Batches are processed one at a time in a worker thread, so sending (which
+    sleeps to respect the provider's rate limits) never blocks the scraper
+    and a single MessageScheduler keeps track of the limits across batches.
+
+    Once the scraper is done, the batches left are processed until
+    `drain_deadline` (a `time.monotonic()` value). Past it, sending stops
+    after the sends in progress and the products left are handled by
+    whatever runs after the pipeline.
+
+    Usage:
+        async with NotificationPipeline(provider) as pipeline:
+            await scraper.run_main(pipeline=pipeline)
+    """
+
+    def __init__(
+        self, provider: MessagingProvider, drain_deadline: Optional[float] = None
+    ):
+        self.provider = provider
+        self.drain_deadline = drain_deadline
+        self.scheduler: Optional[MessageScheduler] = None
+        self.processed_batches = 0
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        # Checked by the worker thread between batches and sends
+        self._stop_requested = threading.Event()
+
+    async def __aenter__(self):
+        self._worker = asyncio.create_task(self._run_worker())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # Drain the batches already submitted before returning
+        await self._queue.put(None)
+        timeout = (
+            max(0.0, self.drain_deadline - time.monotonic())
+            if self.drain_deadline is not None
+            else None
+        )
+        try:
+            await asyncio.wait_for(asyncio.shield(self._worker), timeout=timeout)
+        except asyncio.TimeoutError:
+            print("⌛ Out of time, leaving the products left for after the pipeline")
+            self._stop_requested.set()
+            # Only waits for the sends in progress, so they are not sent twice
+            await self._worker
+
+    async def submit(self, external_ids: List[int]):
+        if external_ids:
+            await self._queue.put(external_ids)
+
+    async def _run_worker(self):
+        while True:
+            external_ids = await self._queue.get()
+            if external_ids is None or self._stop_requested.is_set():
+                return
+
+            try:
+                await sync_to_async(self._process_batch, thread_sensitive=False)(
+                    external_ids
+                )
+                self.processed_batches += 1
+            except Exception as e:
+                # Products left behind are picked up after the scraper run
+                print(
+                    f"❌ Failed to process batch of {len(external_ids)} products - {e}"
+                )
+
+    def _process_batch(self, external_ids: List[int]):
+        try:
+            core_models.NotifiedProduct.objects.find_keyword_matches(external_ids)
+
+            if self.scheduler is None:
+                # Also queues messages left over from previous runs
+                self.scheduler = MessageScheduler(
+                    provider=self.provider, stop_requested=self._stop_requested
+                )
+            self.scheduler.queue_new_messages(external_ids)
+            self.scheduler.send_notified_products_in_queue()
+        finally:
+            # Runs outside of the thread Django's async adapters reuse
+            connection.close()
@@ -0,0 +1,55 @@
+import time
+import random
+import asyncio
+from typing import Dict, Hashable, Optional
+
+
+class PolitenessScheduler:
+    """
+    Spaces out requests so that every target host and every proxy keeps a
+    minimum gap between two requests, while different proxies can still
+    scrape at the same time.
+
+    Each caller reserves the earliest slot that respects both gaps and only
+    waits for its own slot, so there is no global serial sleep.
+    """
+
+    def __init__(
+        self,
+        min_host_gap: float,
+        min_proxy_gap: float,
+        jitter: float = 0.0,
+    ):
+        self.min_host_gap = min_host_gap
+        self.min_proxy_gap = min_proxy_gap
+        # Random extra seconds added to every gap so requests look human-paced
+        self.jitter = jitter
+
+        self._lock = asyncio.Lock()
+        # Monotonic time from which the next request is allowed
+        self._host_ready_at: Dict[str, float] = {}
+        self._proxy_ready_at: Dict[Optional[Hashable], float] = {}
+        # Seconds spent waiting for a slot, summed over all callers
+        self.idle_seconds = 0.0
+
+    async def wait_turn(self, host: str, proxy_key: Optional[Hashable] = None):
+        """
+        Waits until a request to `host` through `proxy_key` is allowed
+        """
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(
+                now,
+                self._host_ready_at.get(host, now),
+                self._proxy_ready_at.get(proxy_key, now),
+            )
+            self._host_ready_at[host] = slot + self._get_gap(self.min_host_gap)
+            self._proxy_ready_at[proxy_key] = slot + self._get_gap(self.min_proxy_gap)
+
+        wait = slot - now
+        if wait > 0:
+            self.idle_seconds += wait
+            await asyncio.sleep(wait)
+
+    def _get_gap(self, min_gap: float) -> float:
+        return min_gap + random.uniform(0, self.jitter) if self.jitter else min_gap
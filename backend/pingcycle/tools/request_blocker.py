@@ -0,0 +1,84 @@
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from playwright.async_api import BrowserContext, Route, Request, Response
+
+# Rough average size of blocked requests whose size is not known, only a guess
+ESTIMATED_BYTES_PER_RESOURCE_TYPE = {
+    "image": 40_000,
+    "media": 250_000,
+    "font": 35_000,
+    "stylesheet": 20_000,
+    "script": 30_000,
+}
+ESTIMATED_BYTES_DEFAULT = 5_000
+
+
+class RequestBlocker:
+    """
+    Aborts requests the scraper does not need (images, fonts, ads,
+    analytics...) on a browser context and keeps count of what was blocked
+    and what was downloaded.
+
+    Blocked requests that declare their size (content-length) count towards
+    `bytes_saved`. Only a rough average per resource type is known for the
+    rest, which is kept apart in `estimated_bytes_saved`.
+    """
+
+    def __init__(self, blocked_resource_types: List[str], blocked_domains: List[str]):
+        self.blocked_resource_types = set(blocked_resource_types)
+        self.blocked_domains = blocked_domains
+
+        self.blocked_requests = 0
+        self.bytes_saved = 0
+        self.estimated_bytes_saved = 0
+        self.bytes_loaded = 0
+
+    async def attach(self, context: BrowserContext):
+        await context.route("**/*", self._handle_route)
+        context.on("response", self._count_response)
+
+    def is_blocked(self, request: Request) -> bool:
+        if request.resource_type in self.blocked_resource_types:
+            return True
+
+        host = urlparse(request.url).hostname or ""
+        return any(
+            host == domain or host.endswith(f".{domain}")
+            for domain in self.blocked_domains
+        )
+
+    async def _handle_route(self, route: Route):
+        request = route.request
+        if self.is_blocked(request):
+            self.blocked_requests += 1
+            content_length = self._get_content_length(request.headers)
+            if content_length is not None:
+                self.bytes_saved += content_length
+            else:
+                self.estimated_bytes_saved += ESTIMATED_BYTES_PER_RESOURCE_TYPE.get(
+                    request.resource_type, ESTIMATED_BYTES_DEFAULT
+                )
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def _count_response(self, response: Response):
+        content_length = self._get_content_length(response.headers)
+        if content_length is not None:
+            self.bytes_loaded += content_length
+
+    @staticmethod
+    def _get_content_length(headers: Dict[str, str]) -> Optional[int]:
+        content_length = headers.get("content-length")
+        if content_length and content_length.isdigit():
+            return int(content_length)
+        return None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "blocked_requests": self.blocked_requests,
+            "bytes_saved": self.bytes_saved,
+            "estimated_bytes_saved": self.estimated_bytes_saved,
+            "bytes_loaded": self.bytes_loaded,
+        }
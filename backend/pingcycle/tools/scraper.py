@@ -1,31 +1,194 @@
 import os
+import re
+import math
+import time
 import asyncio
-from datetime import datetime
-from typing import Tuple, Dict, Optional, Literal, Any
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+from typing import (
+    Tuple,
+    Dict,
+    List,
+    Set,
+    Optional,
+    Literal,
+    Any,
+    AsyncIterator,
+    TypedDict,
+    TYPE_CHECKING,
+)
 from asgiref.sync import sync_to_async
+from django.utils import timezone
 import random
 import traceback
 
 import sentry_sdk
-from playwright.async_api import async_playwright, Page, Playwright, Browser
-
-from config.settings import ENV, DEBUG_PLAYWRIGHT_LOGS
+from playwright.async_api import async_playwright, Page, BrowserContext
+
+from config.settings import (
+    ENV,
+    DEBUG_PLAYWRIGHT_LOGS,
+    SCRAPER_CONCURRENCY,
+    SCRAPER_EXTRACTION_MODE,
+    SCRAPER_FETCH_MODE,
+    SCRAPER_BLOCKED_RESOURCE_TYPES,
+    SCRAPER_BLOCKED_DOMAINS,
+    SCRAPER_MAX_CATCHUP_HOURS,
+    SCRAPER_HOST_MIN_GAP_SECONDS,
+    SCRAPER_PROXY_MIN_GAP_SECONDS,
+    SCRAPER_GAP_JITTER_SECONDS,
+    SCRAPER_MAX_ATTEMPTS_PER_TOWN,
+    SCRAPER_MIN_SECONDS_PER_TOWN,
+    SCRAPER_HEDGING,
+    SCRAPER_HEDGE_PERCENTILE,
+    SCRAPER_HEDGE_MIN_SAMPLES,
+    SCRAPER_HEDGE_DEFAULT_SECONDS,
+    PROXY_LEASE_WAIT_SECONDS,
+    PROXY_LEASE_MAX_WAIT_SECONDS,
+)
+from pingcycle.tools.browser_manager import BrowserManager
+from pingcycle.tools.http_fetcher import HttpFetcher, HttpFallbackError
+from pingcycle.tools.request_blocker import RequestBlocker
+from pingcycle.tools.politeness import PolitenessScheduler
 import pingcycle.apps.core.models as core_models
 
-# TODO: Temporary solution
-TOWN_NAME_URL_EXT = [
-    ("Dublin", "DublinIE"),
-    ("County Kildare", "KildareIE"),
-    ("County Wicklow", "CountyWicklow"),
-    ("County Wexford", "WexfordIRE"),
-    ("Waterford", "WaterfordIE"),
-]
+if TYPE_CHECKING:
+    # Importing it loads the messaging providers, which call the Telegram API
+    from pingcycle.tools.notification_pipeline import NotificationPipeline
+
+PRODUCT_ROWS_SELECTOR = "#fc-data div[data-id]"
+
+# Reads every product row in a single round trip to the browser
+EXTRACT_PRODUCT_ROWS_JS = """
+(rows, startIndex) => rows.slice(startIndex).map((row) => {
+    const text = (element) => (element ? element.innerText : null);
+    const nameDescription = row.querySelector(
+        ".post-list-item-content-description.hide-for-small-only"
+    );
+    const img = row.querySelector("img[data-src]");
+    return {
+        external_id: row.getAttribute("data-id"),
+        is_offered: row.querySelector(".text-offer") !== null,
+        time_ago: text(
+            row.querySelector("span.post-list-item-date.text-lighten-less")
+        ),
+        product_name: text(nameDescription && nameDescription.querySelector("h4 > a")),
+        description: text(nameDescription && nameDescription.querySelector("p")),
+        img: img ? img.getAttribute("data-src") : null,
+        sublocation: text(
+            row.querySelector(".post-list-item-header-icon.location-icon span")
+        ),
+    };
+})
+"""
+
+
+class ProductRow(TypedDict):
+    external_id: str
+    is_offered: bool
+    time_ago: Optional[str]
+    product_name: Optional[str]
+    description: Optional[str]
+    img: Optional[str]
+    sublocation: Optional[str]
 
 
 class OpenBlankPageError(Exception):
     pass
 
 
+class NoProxyAvailableError(Exception):
+    """
+    Raised when no proxy is active, i.e. all of them failed too often
+    """
+
+    pass
+
+
+TIME_AGO_RE = re.compile(
+    r"(\d+|an?|one)\s+(second|minute|hour|day|week)s?", re.IGNORECASE
+)
+
+
+def parse_time_ago(time_ago: Optional[str], now: datetime) -> Optional[datetime]:
+    """
+    Approximates when a post was made from text like "5 minutes ago"
+    """
+    if not time_ago:
+        return None
+    if "just now" in time_ago.lower():
+        return now
+
+    match = TIME_AGO_RE.search(time_ago)
+    if match is None:
+        return None
+
+    amount, unit = match.groups()
+    amount = int(amount) if amount.isdigit() else 1
+    return now - timedelta(**{f"{unit.lower()}s": amount})
+
+
+class TownScan:
+    """
+    State of a single town being scraped across one or more listing pages
+    """
+
+    def __init__(self, town_name: str, cursor: Optional[core_models.TownCursor]):
+        self.town_name = town_name
+        self.cursor = cursor
+        self.started_at = timezone.now()
+        # Without a cursor (first run) only the last hour is considered
+        self.max_age = timedelta(hours=SCRAPER_MAX_CATCHUP_HOURS if cursor else 1)
+
+        self.products_to_create: List[core_models.NotifiedProduct] = []
+        self.newest_external_id: Optional[int] = None
+        self.newest_posted_at: Optional[datetime] = None
+        self.next_index = 0
+        # Posts newer than the cursor, used to adapt how often the town is polled
+        self.unseen_posts = 0
+        # Reached a post that was already ingested or is too old
+        self.all_found = False
+
+    def is_known(self, external_id: int) -> bool:
+        return self.cursor is not None and external_id <= self.cursor.latest_external_id
+
+    def is_too_old(self, posted_at: Optional[datetime]) -> bool:
+        # Posts whose age could not be read are kept, the cursor still stops
+        # the scan at posts already ingested
+        return posted_at is not None and posted_at < self.started_at - self.max_age
+
+    def track_newest(self, external_id: int, posted_at: Optional[datetime]):
+        if self.newest_external_id is None or external_id > self.newest_external_id:
+            self.newest_external_id = external_id
+            self.newest_posted_at = posted_at
+
+
+class TownAttempt:
+    """
+    A single try at scraping a town, one of several when hedging
+    """
+
+    def __init__(self):
+        # Per attempt, so the winner's stats are not mixed with the loser's
+        self.request_blocker = RequestBlocker(
+            SCRAPER_BLOCKED_RESOURCE_TYPES, SCRAPER_BLOCKED_DOMAINS
+        )
+        self.created_at = time.perf_counter()
+        # Set once the proxy is leased and the politeness wait is over
+        self.navigation_started = asyncio.Event()
+        self.navigation_started_at: Optional[float] = None
+
+    def start_navigation(self):
+        self.navigation_started_at = time.perf_counter()
+        self.navigation_started.set()
+
+    def get_navigation_seconds(self) -> float:
+        started_at = self.navigation_started_at
+        if started_at is None:
+            started_at = self.created_at
+        return time.perf_counter() - started_at
+
+
 # def load_proxies_from_file(path: str):
 #     proxies = []
 #     try:
@@ -63,46 +226,179 @@ class Scraper:
             "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.3.1 Safari/605.1.15",
             "Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36",
         ]
+        # Receives every stored batch of products when streaming
+        self.pipeline: Optional["NotificationPipeline"] = None
+
+    async def run_main(
+        self,
+        with_proxy=True,
+        concurrency: int = SCRAPER_CONCURRENCY,
+        time_budget_seconds: Optional[float] = None,
+        pipeline: Optional["NotificationPipeline"] = None,
+    ):
+        """
+        Scrapes every due town by priority, running up to `concurrency` towns
+        at the same time.
 
-    async def run_main(self, with_proxy=True):
-        print("Started Running Scraper")
+        Each town is handled by its own worker with its own proxy and browser,
+        so a slow town or a failing proxy only delays that town.
+
+        With a `time_budget_seconds`, towns are skipped once too little time
+        is left and running towns are cut short at the deadline. Products
+        found so far are still stored, the towns stay due for the next run.
+
+        With a `pipeline`, each town's new products are matched and sent as
+        soon as they are stored.
+        """
+        print(
+            f"Started Running Scraper (concurrency: {concurrency}, budget: {time_budget_seconds}s)"
+        )
         self.start_time = datetime.now()
+        self.pipeline = pipeline
+        deadline = (
+            time.monotonic() + time_budget_seconds
+            if time_budget_seconds is not None
+            else None
+        )
+        # Towns not started / not finished because of the time budget
+        self.skipped_towns: List[str] = []
+        self.cut_short_towns: List[str] = []
+        # Which path (Town.FetchMode) served each town
+        self.served_by: Dict[str, str] = {}
+        # Requests blocked & bytes saved by the browser per town
+        self.request_stats: Dict[str, Dict[str, int]] = {}
+        # Seconds taken by successful town attempts, used for the hedge deadline
+        self._attempt_durations: List[float] = []
+        self.hedged_attempts = 0
+        self._politeness = PolitenessScheduler(
+            SCRAPER_HOST_MIN_GAP_SECONDS,
+            SCRAPER_PROXY_MIN_GAP_SECONDS,
+            SCRAPER_GAP_JITTER_SECONDS,
+        )
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
 
         async with async_playwright() as p:
-            for town_name, town_url_ext in TOWN_NAME_URL_EXT:
-
-                while True:
-                    proxy = None
-                    if with_proxy:
-                        proxy = await sync_to_async(
-                            core_models.Proxy.get_relevant_proxy
-                        )()
-
-                        if proxy is None:
-                            error_msg = f"🚨 ALL PROXIES FAILED"
-                            print("Scraping error: ", error_msg)
-                            sentry_sdk.capture_message(error_msg, level="error")
-                            return  # Stop execution
-
-                        print(
-                            f"Trying proxy domain '{proxy.domain}' at port {proxy.port} for town {town_name}"
-                        )
+            self._browser_manager = BrowserManager(p)
+            self._http_fetcher = HttpFetcher()
+
+            async def scrape_town_with_limit(town: core_models.Town):
+                async with semaphore:
+                    remaining = (
+                        deadline - time.monotonic() if deadline is not None else None
+                    )
+                    if (
+                        remaining is not None
+                        and remaining < SCRAPER_MIN_SECONDS_PER_TOWN
+                    ):
+                        print(f"⏭️ Skipping town {town.name}, {remaining:.0f}s left")
+                        self.skipped_towns.append(town.url_ext)
+                        return
 
-                    browser = None
                     try:
-                        browser, page = await self._open_blank_browser_page(p, proxy)
+                        await asyncio.wait_for(
+                            self._scrape_town(town, with_proxy), timeout=remaining
+                        )
+                    except asyncio.TimeoutError:
+                        print(f"⌛ Time budget ran out while scraping town {town.name}")
+                        self.cut_short_towns.append(town.url_ext)
+
+            towns = await sync_to_async(list)(core_models.Town.objects.due())
+            print(f"Towns due: {[town.name for town in towns]}")
 
-                        await self._create_products_from_town(
-                            page, town_name, town_url_ext
+            results = await asyncio.gather(
+                *[scrape_town_with_limit(town) for town in towns],
+                return_exceptions=True,
+            )
+
+            for town, result in zip(towns, results):
+                if isinstance(result, Exception):
+                    print(f"❌ Unexpected error for town {town.name}: {result}")
+                    await self.send_capture_exception(result)
+
+            await self._browser_manager.close()
+            await self._http_fetcher.close()
+            print("Browser timings: ", self._browser_manager.get_timings_summary())
+            print("HTTP fetch timings: ", self._http_fetcher.get_timings_summary())
+            print("Served by: ", self.served_by)
+            print("Browser request stats: ", self.request_stats)
+            print(f"Politeness idle time: {self._politeness.idle_seconds:.1f}s")
+            print("Hedged attempts: ", self.hedged_attempts)
+            print("Skipped towns (time budget): ", self.skipped_towns)
+            print("Cut short towns (time budget): ", self.cut_short_towns)
+            print("🏁 Finished Running Scraper")
+
+    async def _scrape_town(self, town: core_models.Town, with_proxy: bool):
+        """
+        Tries proxies for a single town until one of them succeeds or
+        SCRAPER_MAX_ATTEMPTS_PER_TOWN attempts were made, then schedules the
+        town's next poll.
+
+        With SCRAPER_HEDGING, a second attempt starts on another proxy when
+        the running one passes the hedge deadline. The deadline counts from
+        when the attempt starts navigating, waiting for a proxy lease or for
+        its politeness turn does not count. The first success wins and the
+        other attempt is cancelled.
+        """
+        town_name, town_url_ext = town.name, town.url_ext
+        attempts_left = SCRAPER_MAX_ATTEMPTS_PER_TOWN
+        running: Dict[asyncio.Task, TownAttempt] = {}
+
+        def start_attempt():
+            nonlocal attempts_left
+            attempts_left -= 1
+            attempt = TownAttempt()
+            task = asyncio.create_task(self._attempt_town(town, with_proxy, attempt))
+            running[task] = attempt
+
+        try:
+            while attempts_left > 0 or running:
+                if not running:
+                    start_attempt()
+
+                waiting = set(running)
+                timeout = None
+                navigation_started = None
+                if SCRAPER_HEDGING and attempts_left > 0 and len(running) == 1:
+                    attempt = next(iter(running.values()))
+                    if attempt.navigation_started_at is None:
+                        # The hedge deadline starts with navigation
+                        navigation_started = asyncio.create_task(
+                            attempt.navigation_started.wait()
                         )
-                        print(f"✅ Success")
+                        waiting.add(navigation_started)
+                    else:
+                        elapsed = time.perf_counter() - attempt.navigation_started_at
+                        timeout = max(0.0, self._get_hedge_deadline() - elapsed)
 
-                        if with_proxy:
-                            await sync_to_async(proxy.update_usage)(True)
-                        await asyncio.sleep(random.randint(10, 30))
+                done, _ = await asyncio.wait(
+                    waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if navigation_started is not None:
+                    navigation_started.cancel()
+                    if done == {navigation_started}:
+                        continue
+                    done.discard(navigation_started)
+
+                if not done:
+                    print(f"⏱️ Slow attempt for town {town_name}, hedging")
+                    self.hedged_attempts += 1
+                    start_attempt()
+                    continue
 
-                        await browser.close()
-                        break  # Go to next town
+                for task in done:
+                    attempt = running.pop(task)
+                    try:
+                        scan, served_by = task.result()
+                    except NoProxyAvailableError:
+                        attempts_left = 0
+                        if running:
+                            continue  # Wait for the other attempt
+
+                        error_msg = f"🚨 ALL PROXIES FAILED"
+                        print(f"Scraping error for town {town_name}: ", error_msg)
+                        sentry_sdk.capture_message(error_msg, level="error")
+                        return  # Stop trying this town
                     except OpenBlankPageError:
                         # TODO: Temp setup until issue resolved
                         await self.send_sentry_message(
@@ -117,25 +413,143 @@ class Scraper:
                             os.environ["DEBUG_FILE"] = (
                                 f"{app_home}/playwright_debug.log"
                             )
-                        break  # Go to next town
+                        return  # Go to next town
                     except Exception as e:
-                        print(f"❌ Fail - {e}")
-                        traceback.print_exc()
-
-                        if with_proxy:
-                            await sync_to_async(proxy.update_usage)(False)
+                        print(f"❌ Fail for town {town_name} - {e}")
+                        traceback.print_exception(e)
                         await self.send_capture_exception(e)
+                        continue  # Try next proxy
 
-                        if browser:
-                            await browser.close()
+                    self._attempt_durations.append(attempt.get_navigation_seconds())
+                    self.served_by[town_url_ext] = served_by
+                    if served_by == core_models.Town.FetchMode.BROWSER:
+                        self.request_stats[town_url_ext] = (
+                            attempt.request_blocker.get_stats()
+                        )
+                    print(f"✅ Success for town {town_name} (served by {served_by})")
+                    await sync_to_async(town.schedule_next_poll)(scan.unseen_posts)
+                    return  # Town done
+
+            error_msg = f"🚨 TOWN FAILED AFTER {SCRAPER_MAX_ATTEMPTS_PER_TOWN} ATTEMPTS"
+            print(f"Scraping error for town {town_name}: ", error_msg)
+            sentry_sdk.capture_message(error_msg, level="error")
+        finally:
+            # Cancelling closes the loser's browser context & releases its proxy
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+    async def _attempt_town(
+        self,
+        town: core_models.Town,
+        with_proxy: bool,
+        attempt: "TownAttempt",
+    ) -> Tuple["TownScan", str]:
+        """
+        Scrapes a town once with a newly leased proxy, returning the scan and
+        the fetch mode that served it. The proxy is released with the result
+        and the browser context closed, even if the attempt is cancelled.
+        """
+        town_name, town_url_ext = town.name, town.url_ext
 
-                        continue  # Try next proxy
+        proxy = None
+        if with_proxy:
+            proxy = await self._lease_proxy(town_name)
+            print(
+                f"Trying proxy domain '{proxy.domain}' at port {proxy.port} for town {town_name}"
+            )
 
-            print("🏁 Finished Running Scraper")
+        context = None
+        # Result given back with the proxy lease, None records nothing
+        proxy_success = None
+        proxy_latency = None
+        attempt_start = time.perf_counter()
+        # Launching the browser is not down to the proxy
+        browser_startup_seconds = 0.0
+        try:
+            await self._politeness.wait_turn(
+                urlparse(self._get_town_url(town_url_ext)).hostname,
+                proxy.id if proxy is not None else None,
+            )
+            attempt_start = time.perf_counter()
+            attempt.start_navigation()
+
+            if self._get_fetch_mode(town) == core_models.Town.FetchMode.HTTP:
+                try:
+                    scan = await self._create_products_from_town_over_http(
+                        town_name, town_url_ext, proxy
+                    )
+                    proxy_success = True
+                    return scan, core_models.Town.FetchMode.HTTP
+                except HttpFallbackError as e:
+                    print(f"Falling back to browser for town {town_name}: {e}")
+
+            browser_open_start = time.perf_counter()
+            context, page = await self._open_blank_browser_page(
+                proxy, attempt.request_blocker
+            )
+            browser_startup_seconds = time.perf_counter() - browser_open_start
+            scan = await self._create_products_from_town(page, town_name, town_url_ext)
+            proxy_success = True
+            return scan, core_models.Town.FetchMode.BROWSER
+        except OpenBlankPageError:
+            raise
+        except asyncio.CancelledError:
+            # Lost a hedged race or ran out of time, nothing is recorded
+            raise
+        except Exception:
+            proxy_success = False
+            raise
+        finally:
+            if proxy_success:
+                proxy_latency = (
+                    time.perf_counter() - attempt_start - browser_startup_seconds
+                )
+            if context:
+                await context.close()
+            if proxy is not None:
+                await sync_to_async(proxy.release)(proxy_success, proxy_latency)
+
+    async def _lease_proxy(self, town_name: str) -> core_models.Proxy:
+        """
+        Leases a proxy, waiting with backoff while every active proxy is
+        leased by another scraper. The town's time budget cuts the wait short.
+        """
+        wait_seconds = PROXY_LEASE_WAIT_SECONDS
+        while True:
+            proxy = await sync_to_async(core_models.Proxy.lease)()
+            if proxy is not None:
+                return proxy
+            if not await self._has_active_proxies():
+                raise NoProxyAvailableError()
+
+            print(f"⏳ All proxies leased, town {town_name} waits {wait_seconds}s")
+            # Half of it random so waiting towns don't retry in lockstep
+            await asyncio.sleep(wait_seconds / 2 + random.uniform(0, wait_seconds / 2))
+            wait_seconds = min(wait_seconds * 2, PROXY_LEASE_MAX_WAIT_SECONDS)
+
+    @sync_to_async
+    def _has_active_proxies(self) -> bool:
+        return core_models.Proxy.objects.filter(
+            status=core_models.Proxy.Status.ACTIVE
+        ).exists()
+
+    def _get_hedge_deadline(self) -> float:
+        """
+        Seconds after which a running town attempt gets hedged: the
+        SCRAPER_HEDGE_PERCENTILE of the successful attempts in this run
+        """
+        if len(self._attempt_durations) < SCRAPER_HEDGE_MIN_SAMPLES:
+            return SCRAPER_HEDGE_DEFAULT_SECONDS
+
+        # Nearest-rank percentile
+        durations = sorted(self._attempt_durations)
+        index = math.ceil(len(durations) * SCRAPER_HEDGE_PERCENTILE / 100) - 1
+        return durations[index]
 
     async def _create_products_from_town(
         self, page: Page, town_name: str, town_url_ext: str
-    ):
+    ) -> "TownScan":
         """
         # TODO: TESTS + REFACTOR
 
@@ -153,120 +567,270 @@ class Scraper:
         # List View shows all needed info
         await self._ensure_list_view(page)
 
-        products_to_create = []
+        scan = TownScan(town_name, await self._get_town_cursor(town_url_ext))
 
-        global_index = 0  # will be used if we need to load more items
-
-        all_found = False
-        while not all_found:
-            products_locator = page.locator("#fc-data div[data-id]")
-
-            products_count = await products_locator.count()
-
-            start_loop_from_index = (
-                global_index + 1 if global_index > 0 else global_index
-            )
-            if start_loop_from_index == products_count:
-                print("NEW PRODUCTS NOT LAODED")
-                break  # Prevents continuous loop if more content was not loaded for some reason
-            for i in range(start_loop_from_index, products_count):
-                global_index = i
-                product = products_locator.nth(i)
-
-                # Is product on offer?
-                is_offered_locator = product.locator(".text-offer")
-                if await is_offered_locator.count() == 0:
-                    continue
-
-                # Is it a recent product?
-                time_ago_span = product.locator(
-                    "span.post-list-item-date.text-lighten-less"
+        try:
+            while not scan.all_found:
+                start_loop_from_index = scan.next_index
+                products_count, product_rows = await self._extract_product_rows(
+                    page, start_loop_from_index
                 )
-                time_ago = await time_ago_span.inner_text()
-                if not "minutes" in time_ago:
-                    all_found = True
-                    break
 
-                # Do we have this product in db?
-                try:
-                    product_id = await product.get_attribute("data-id")
-                    await sync_to_async(core_models.NotifiedProduct.objects.get)(
-                        external_id=product_id
-                    )
-                    continue
-                except core_models.NotifiedProduct.DoesNotExist:
-                    pass
+                if start_loop_from_index == products_count:
+                    print("NEW PRODUCTS NOT LAODED")
+                    break  # Prevents continuous loop if more content was not loaded for some reason
 
-                # Get product name and description
-                name_description_parent_div = product.locator(
-                    ".post-list-item-content-description.hide-for-small-only"
-                )
-                link_element = name_description_parent_div.locator("h4 > a")
-                product_name = await link_element.inner_text()
-
-                description_element = name_description_parent_div.locator("p")
-                description = None
-                if await description_element.count() > 0:
-                    description = await description_element.inner_text()
-
-                # Get product image
-                product_img_div = product.locator("img[data-src]")
-                product_img_url = None
-                if await product_img_div.count() > 0:
-                    product_img_url = await product_img_div.get_attribute("data-src")
-
-                # Get product sublocation
-                sublocation_div = product.locator(
-                    ".post-list-item-header-icon.location-icon"
-                )
-                sublocation_span = sublocation_div.locator("span")
-                sublocation = None
-                if await sublocation_span.count() > 0:
-                    sublocation = await sublocation_span.inner_text()
-
-                print(f"Adding new Product: {product_name}")
-                products_to_create.append(
-                    core_models.NotifiedProduct(
-                        product_name=product_name,
-                        external_id=product_id,
-                        description=description,
-                        location=town_name,
-                        sublocation=sublocation,
-                        img=product_img_url,
-                    )
+                load_more = await self._scan_product_rows(
+                    scan, product_rows, products_count
                 )
 
-                # If the last element is on offer and is recent, load more items
-                if i == products_count - 1:
+                # Unseen posts may remain on the next page
+                if load_more:
                     load_more_btn = page.locator("#item-list-load-more .btn-action")
 
                     await load_more_btn.click()
                     await asyncio.sleep(1)
                     print("LAODED MORE")
-                    # await self.send_sentry_message(
-                    #     message="Last element is recent and on offer",
-                    #     level="warning",
-                    #     data={
-                    #         "town_name": town_name,
-                    #         "is_offered": "True" if is_offered else "False",
-                    #         "time_ago": time_ago,
-                    #         "array_index": index,
-                    #     },
-                    # )
+        except asyncio.CancelledError:
+            # Cut short (time budget or lost hedge), keep what was read so far.
+            # The cursor is not moved so the rest is read by the next run,
+            # the scan may have reached it before storing the rows above it.
+            await asyncio.shield(
+                self._save_town_scan(scan, town_url_ext, advance_cursor=False)
+            )
+            raise
+
+        await self._save_town_scan(scan, town_url_ext)
+        return scan
+
+    async def _create_products_from_town_over_http(
+        self,
+        town_name: str,
+        town_url_ext: str,
+        proxy: Optional[core_models.Proxy] = None,
+    ) -> "TownScan":
+        """
+        Reads the server-rendered listing without a browser. Raises
+        HttpFallbackError when the browser is needed instead, e.g. when
+        unseen posts continue past the first page.
+        """
+        print(f"Checking products over HTTP for town: {town_name}")
+        url = self._get_town_url(town_url_ext)
+
+        product_rows = await self._http_fetcher.fetch_product_rows(
+            url, random.choice(self.user_agents_pool), proxy
+        )
+
+        scan = TownScan(town_name, await self._get_town_cursor(town_url_ext))
+        load_more = await self._scan_product_rows(
+            scan, self._iterate_rows(product_rows, 0), len(product_rows)
+        )
+        if load_more:
+            raise HttpFallbackError("Unseen products continue past the first page")
+
+        await self._save_town_scan(scan, town_url_ext)
+        return scan
+
+    async def _scan_product_rows(
+        self,
+        scan: "TownScan",
+        product_rows: AsyncIterator[Tuple[int, ProductRow]],
+        products_count: int,
+    ) -> bool:
+        """
+        Goes through the rows of a page, adding new products to the scan.
+
+        Returns whether more rows should be loaded, i.e. the whole page was
+        read without reaching an already-seen or too old post.
+        """
+        # Offered rows of this page, checked against db in one query
+        candidate_rows = []
+        async for i, product_row in product_rows:
+            scan.next_index = i + 1
+
+            external_id = int(product_row["external_id"])
+            posted_at = parse_time_ago(product_row["time_ago"], scan.started_at)
+
+            # Have we reached posts ingested by a previous run?
+            if scan.is_known(external_id) or scan.is_too_old(posted_at):
+                scan.all_found = True
+                break
+
+            scan.track_newest(external_id, posted_at)
+            scan.unseen_posts += 1
+
+            # Is product on offer?
+            if not product_row["is_offered"]:
+                continue
+
+            candidate_rows.append(product_row)
+
+        # Do we have these products in db?
+        known_external_ids = await self._get_known_external_ids(
+            [int(product_row["external_id"]) for product_row in candidate_rows]
+        )
+
+        for product_row in candidate_rows:
+            product_id = int(product_row["external_id"])
+            if product_id in known_external_ids:
+                continue
+
+            product_name = product_row["product_name"]
+            print(f"Adding new Product: {product_name}")
+            scan.products_to_create.append(
+                core_models.NotifiedProduct(
+                    product_name=product_name,
+                    external_id=product_id,
+                    description=product_row["description"],
+                    location=scan.town_name,
+                    sublocation=product_row["sublocation"],
+                    img=product_row["img"],
+                )
+            )
+
+        return not scan.all_found and scan.next_index == products_count
 
+    async def _save_town_scan(
+        self, scan: "TownScan", town_url_ext: str, advance_cursor: bool = True
+    ):
+        products_to_create = scan.products_to_create
         if products_to_create:
             print(f"bulk creating {len(products_to_create)} products")
+            # Conflicts happen when an overlapping run already stored a product
             await sync_to_async(core_models.NotifiedProduct.objects.bulk_create)(
-                products_to_create
+                products_to_create, ignore_conflicts=True
             )
+            if self.pipeline is not None:
+                await self.pipeline.submit(
+                    [product.external_id for product in products_to_create]
+                )
+
+        # Only move the cursor once every post down to it was read, so a
+        # partial scan is picked up again by the next run without gaps
+        if advance_cursor and scan.all_found and scan.newest_external_id is not None:
+            await sync_to_async(core_models.TownCursor.advance)(
+                town_url_ext, scan.newest_external_id, scan.newest_posted_at
+            )
+
+    @sync_to_async
+    def _get_town_cursor(self, town_url_ext: str) -> Optional[core_models.TownCursor]:
+        return core_models.TownCursor.objects.filter(town_url_ext=town_url_ext).first()
+
+    @sync_to_async
+    def _get_known_external_ids(self, external_ids: List[int]) -> Set[int]:
+        if not external_ids:
+            return set()
+
+        return set(
+            core_models.NotifiedProduct.objects.filter(
+                external_id__in=external_ids
+            ).values_list("external_id", flat=True)
+        )
+
+    async def _extract_product_rows(
+        self, page: Page, start_index: int
+    ) -> Tuple[int, AsyncIterator[Tuple[int, ProductRow]]]:
+        """
+        Returns the total number of product rows on the page and an iterator
+        over (index, row) pairs from `start_index` onwards.
+
+        The "evaluate" mode reads every row in a single in-page call, the
+        "locator" mode reads each field with its own locator call.
+        """
+        if SCRAPER_EXTRACTION_MODE == "evaluate":
+            try:
+                product_rows = await page.locator(PRODUCT_ROWS_SELECTOR).evaluate_all(
+                    EXTRACT_PRODUCT_ROWS_JS, start_index
+                )
+                return start_index + len(product_rows), self._iterate_rows(
+                    product_rows, start_index
+                )
+            except Exception as e:
+                print(f"In-page extraction failed, falling back to locators: {e}")
+                await self.send_capture_exception(e)
+
+        products_count = await page.locator(PRODUCT_ROWS_SELECTOR).count()
+        return products_count, self._iterate_rows_with_locators(
+            page, start_index, products_count
+        )
+
+    @staticmethod
+    async def _iterate_rows(
+        product_rows: List[ProductRow], start_index: int
+    ) -> AsyncIterator[Tuple[int, ProductRow]]:
+        for i, product_row in enumerate(product_rows, start=start_index):
+            yield i, product_row
+
+    async def _iterate_rows_with_locators(
+        self, page: Page, start_index: int, products_count: int
+    ) -> AsyncIterator[Tuple[int, ProductRow]]:
+        """
+        Reads rows field by field, only loading the details of offered rows.
+        The age of every row is read since scanning stops at old rows.
+        """
+        products_locator = page.locator(PRODUCT_ROWS_SELECTOR)
+
+        for i in range(start_index, products_count):
+            product = products_locator.nth(i)
+            product_row = {
+                "external_id": await product.get_attribute("data-id"),
+                "is_offered": await product.locator(".text-offer").count() > 0,
+                "time_ago": None,
+                "product_name": None,
+                "description": None,
+                "img": None,
+                "sublocation": None,
+            }
+
+            time_ago_span = product.locator(
+                "span.post-list-item-date.text-lighten-less"
+            )
+            if await time_ago_span.count() > 0:
+                product_row["time_ago"] = await time_ago_span.inner_text()
+
+            if not product_row["is_offered"]:
+                yield i, product_row
+                continue
+
+            # Get product name and description
+            name_description_parent_div = product.locator(
+                ".post-list-item-content-description.hide-for-small-only"
+            )
+            link_element = name_description_parent_div.locator("h4 > a")
+            product_row["product_name"] = await link_element.inner_text()
+
+            description_element = name_description_parent_div.locator("p")
+            if await description_element.count() > 0:
+                product_row["description"] = await description_element.inner_text()
+
+            # Get product image
+            product_img_div = product.locator("img[data-src]")
+            if await product_img_div.count() > 0:
+                product_row["img"] = await product_img_div.get_attribute("data-src")
+
+            # Get product sublocation
+            sublocation_div = product.locator(
+                ".post-list-item-header-icon.location-icon"
+            )
+            sublocation_span = sublocation_div.locator("span")
+            if await sublocation_span.count() > 0:
+                product_row["sublocation"] = await sublocation_span.inner_text()
+
+            yield i, product_row
+
+    @staticmethod
+    def _get_fetch_mode(town: core_models.Town) -> str:
+        return town.fetch_mode or SCRAPER_FETCH_MODE
 
     def _get_town_url(self, town_ext: str) -> str:
         # https://www.freecycle.org/town/CountyWicklow
         return f"https://www.freecycle.org/town/{town_ext}"
 
     async def _open_blank_browser_page(
-        self, playwright: Playwright, proxy: core_models.Proxy = None
-    ) -> Tuple[Browser, Page]:
+        self,
+        proxy: core_models.Proxy = None,
+        request_blocker: Optional[RequestBlocker] = None,
+    ) -> Tuple[BrowserContext, Page]:
         try:
             # Determine proxy settings based on provided proxy
             proxy_settings = (
@@ -278,20 +842,21 @@ class Scraper:
                 if proxy is not None
                 else None
             )
-            # Launch the browser and set context
-            browser = await playwright.chromium.launch(
-                proxy=proxy_settings, headless=True, args=["--disable-gpu"]
-            )
-
             # Select a random user agent from the pool
             random_user_agent = random.choice(self.user_agents_pool)
             print("Selected user agent: ", random_user_agent)
-            context = await browser.new_context(user_agent=random_user_agent)
-            print("Browser and Context created")
+            # Reuse the shared browser, each context gets its own proxy
+            context = await self._browser_manager.new_context(
+                proxy_settings=proxy_settings, user_agent=random_user_agent
+            )
+            print("Context created")
+
+            if request_blocker is not None:
+                await request_blocker.attach(context)
 
             print("Creating new page...")
             page: Page = await context.new_page()
-            return browser, page
+            return context, page
         except Exception as e:
             print("🔴 Error getting blank page: ", e)
             traceback.print_exc()
@@ -0,0 +1,125 @@
+import re
+import struct
+from typing import FrozenSet, List, Optional, Tuple
+
+# Port of pg_trgm's trigram extraction & `strict_word_similarity`
+# (contrib/pg_trgm/trgm_op.c) so keywords can be matched in Python with the
+# same scores Postgres gives
+
+# Words are runs of alphanumeric characters, padded like pg_trgm does
+WORD_RE = re.compile(r"[^\W_]+")
+LPADDING = "  "
+RPADDING = " "
+
+TRGM_BOUND_LEFT = 1
+TRGM_BOUND_RIGHT = 2
+
+
+def _to_float4(value: float) -> float:
+    """
+    Rounds to a Postgres `real`, so comparisons between candidate scores
+    behave exactly like the C implementation
+    """
+    return struct.unpack("f", struct.pack("f", value))[0]
+
+
+def _calc_similarity(count: int, len1: int, len2: int) -> float:
+    return _to_float4(count / (len1 + len2 - count))
+
+
+def get_trigrams(text: Optional[str]) -> Tuple[List[str], List[int]]:
+    """
+    Returns the trigrams of every word in `text` in order (with duplicates),
+    and for each trigram whether it starts and/or ends a word
+    """
+    trigrams = []
+    bounds = []
+    for word in WORD_RE.findall((text or "").lower()):
+        padded_word = f"{LPADDING}{word}{RPADDING}"
+        word_trigrams = [padded_word[i : i + 3] for i in range(len(padded_word) - 2)]
+        word_bounds = [0] * len(word_trigrams)
+        word_bounds[0] |= TRGM_BOUND_LEFT
+        word_bounds[-1] |= TRGM_BOUND_RIGHT
+
+        trigrams.extend(word_trigrams)
+        bounds.extend(word_bounds)
+
+    return trigrams, bounds
+
+
+def get_trigram_set(text: Optional[str]) -> FrozenSet[str]:
+    return frozenset(get_trigrams(text)[0])
+
+
+def normalize_keyword_name(name: Optional[str]) -> str:
+    """
+    Lower-cased words of `name`, names normalizing to the same string
+    always get the same trigrams and therefore the same scores
+    """
+    return " ".join(WORD_RE.findall((name or "").lower()))
+
+
+def strict_word_similarity(
+    keyword_trigrams: FrozenSet[str], trigrams: List[str], bounds: List[int]
+) -> float:
+    """
+    Greatest similarity between the keyword and any run of whole words of
+    the text, see `iterate_word_similarity` in pg_trgm.
+
+    Takes the keyword's trigram set and the text's `get_trigrams` so both
+    can be computed once and reused across many comparisons.
+    """
+    keyword_trigrams_count = len(keyword_trigrams)
+    # Position each trigram was last seen at within the current run of words
+    last_positions = {}
+    unique_count = 0
+    shared_count = 0
+    lower = 0
+    max_similarity = 0.0
+
+    for i, trigram in enumerate(trigrams):
+        if last_positions.get(trigram, -1) < 0:
+            unique_count += 1
+            if trigram in keyword_trigrams:
+                shared_count += 1
+        last_positions[trigram] = i
+
+        if not bounds[i] & TRGM_BOUND_RIGHT:
+            continue
+
+        # End of a word, score the run of words from `lower` up to here
+        upper = i
+        similarity = _calc_similarity(
+            shared_count, keyword_trigrams_count, unique_count
+        )
+
+        # Also try to move the start of the run to a later word
+        tmp_shared_count = shared_count
+        tmp_unique_count = unique_count
+        prev_lower = lower
+        for tmp_lower in range(lower, upper + 1):
+            if bounds[tmp_lower] & TRGM_BOUND_LEFT:
+                tmp_similarity = _calc_similarity(
+                    tmp_shared_count, keyword_trigrams_count, tmp_unique_count
+                )
+                if tmp_similarity > similarity:
+                    similarity = tmp_similarity
+                    unique_count = tmp_unique_count
+                    lower = tmp_lower
+                    shared_count = tmp_shared_count
+
+            tmp_trigram = trigrams[tmp_lower]
+            if last_positions[tmp_trigram] == tmp_lower:
+                tmp_unique_count -= 1
+                if tmp_trigram in keyword_trigrams:
+                    tmp_shared_count -= 1
+
+        max_similarity = max(max_similarity, similarity)
+
+        # Forget trigrams that are now before the start of the run
+        for tmp_lower in range(prev_lower, lower):
+            tmp_trigram = trigrams[tmp_lower]
+            if last_positions[tmp_trigram] == tmp_lower:
+                last_positions[tmp_trigram] = -1
+
+    return max_similarity
@@ -0,0 +1,209 @@
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from pingcycle.tools.keyword_matchers import (
+    InMemoryKeywordMatcher,
+    VectorizedKeywordMatcher,
+)
+from pingcycle.tools.trigrams import (
+    get_trigrams,
+    get_trigram_set,
+    strict_word_similarity,
+)
+import pingcycle.apps.core.models as core_models
+
+User = get_user_model()
+
+
+def create_keywords(names, chat_state=core_models.Chat.State.ACTIVE, username="user1"):
+    user = User.objects.create(username=username, email=f"{username}@pingcycle.org")
+    core_models.Chat.objects.create(
+        reference=f"chat_{username}",
+        provider=core_models.Chat.Provider.TELEGRAM,
+        user=user,
+        state=chat_state,
+    )
+    return [core_models.Keyword.objects.create(name=name, user=user) for name in names]
+
+
+def create_product(external_id, product_name, description=None):
+    return core_models.NotifiedProduct.objects.create(
+        product_name=product_name,
+        description=description,
+        external_id=external_id,
+        location="Test Location",
+    )
+
+
+MATCHERS = ["SQL", "IN_MEMORY", "VECTORIZED"]
+
+
+@pytest.mark.parametrize("matcher", MATCHERS)
+@pytest.mark.django_db
+def test_find_keyword_matches_links_all_matching_keywords(matcher, mocker):
+    mocker.patch.object(core_models, "KEYWORD_MATCHER", new=matcher)
+    apple, chair = create_keywords(["apple", "chair"])
+    (inactive_bike,) = create_keywords(
+        ["bike"], chat_state=core_models.Chat.State.INACTIVE, username="user2"
+    )
+    apple_pie = create_product(1, "hot apple pie")
+    kitchen = create_product(2, "Kitchen table", description="comes with a chair")
+    bike = create_product(3, "kids bike")
+
+    core_models.NotifiedProduct.objects.find_keyword_matches()
+
+    for product in (apple_pie, kitchen, bike):
+        product.refresh_from_db()
+    assert list(apple_pie.keywords.all()) == [apple]
+    assert list(kitchen.keywords.all()) == [chair]
+    assert apple_pie.state == core_models.NotifiedProduct.State.KEYWORDS_LINKED
+    assert kitchen.state == core_models.NotifiedProduct.State.KEYWORDS_LINKED
+    # Only keywords of users with an active chat are matched
+    assert not bike.keywords.exists()
+    assert bike.state == core_models.NotifiedProduct.State.IRRELEVANT
+
+
+@pytest.mark.parametrize("matcher", MATCHERS)
+@pytest.mark.django_db
+def test_find_keyword_matches_only_checks_given_batch(matcher, mocker):
+    mocker.patch.object(core_models, "KEYWORD_MATCHER", new=matcher)
+    create_keywords(["apple"])
+    in_batch = create_product(1, "apple pie")
+    not_in_batch = create_product(2, "apple tree")
+
+    core_models.NotifiedProduct.objects.find_keyword_matches(external_ids=[1])
+
+    in_batch.refresh_from_db()
+    not_in_batch.refresh_from_db()
+    assert in_batch.state == core_models.NotifiedProduct.State.KEYWORDS_LINKED
+    assert not_in_batch.state == core_models.NotifiedProduct.State.CREATED
+
+
+@pytest.mark.parametrize("matcher", MATCHERS)
+@pytest.mark.django_db
+def test_find_keyword_matches_fans_out_shared_names(matcher, mocker):
+    mocker.patch.object(core_models, "KEYWORD_MATCHER", new=matcher)
+    keywords = [
+        *create_keywords(["Sofa"], username="user1"),
+        *create_keywords(["sofa"], username="user2"),
+        *create_keywords([" SOFA  "], username="user3"),
+    ]
+    create_keywords(
+        ["sofa"], chat_state=core_models.Chat.State.INACTIVE, username="user4"
+    )
+    product = create_product(1, "Grey sofa")
+
+    core_models.NotifiedProduct.objects.find_keyword_matches()
+
+    assert set(product.keywords.all()) == set(keywords)
+
+
+@pytest.mark.parametrize("matcher", MATCHERS)
+@pytest.mark.django_db
+def test_find_keyword_matches_only_updates_state_of_matched_batch(matcher, mocker):
+    mocker.patch.object(core_models, "KEYWORD_MATCHER", new=matcher)
+    create_keywords(["apple"])
+    create_product(1, "apple pie")
+    create_product(2, "chair")
+    already_linked = create_product(3, "lamp")
+    already_linked.state = core_models.NotifiedProduct.State.KEYWORDS_LINKED
+    already_linked.save()
+
+    core_models.NotifiedProduct.objects.find_keyword_matches()
+
+    assert dict(
+        core_models.NotifiedProduct.objects.values_list("external_id", "state")
+    ) == {
+        1: core_models.NotifiedProduct.State.KEYWORDS_LINKED,
+        2: core_models.NotifiedProduct.State.IRRELEVANT,
+        3: core_models.NotifiedProduct.State.KEYWORDS_LINKED,
+    }
+
+
+@pytest.mark.parametrize("keywords_count", [1, 20])
+@pytest.mark.django_db
+def test_find_keyword_matches_query_count_does_not_grow_with_keywords(
+    keywords_count, django_assert_max_num_queries
+):
+    for i in range(keywords_count):
+        create_keywords(["apple"], username=f"user{i}")
+    create_product(1, "apple pie")
+    create_product(2, "chair")
+
+    # Savepoints of the transaction are counted as queries too
+    with django_assert_max_num_queries(6):
+        core_models.NotifiedProduct.objects.find_keyword_matches()
+
+
+@pytest.mark.parametrize(
+    "keyword, text",
+    [
+        ("word", "two words"),
+        ("apple", "hot apple pie"),
+        ("apples", "Apple-pie, apple tart"),
+        ("chair", "Kitchen table and 4 chairs"),
+        ("bike", "kids bi ke"),
+        ("sofa bed", "Sofa, comfy bed"),
+        ("desk", ""),
+        ("tv", "T.V. stand"),
+    ],
+)
+@pytest.mark.django_db
+def test_strict_word_similarity_matches_postgres(keyword, text):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT STRICT_WORD_SIMILARITY(%s, %s)::float8", [keyword, text])
+        (expected,) = cursor.fetchone()
+
+    trigrams, bounds = get_trigrams(text)
+    assert strict_word_similarity(get_trigram_set(keyword), trigrams, bounds) == (
+        expected
+    )
+
+
+def test_in_memory_matcher_syncs_keyword_changes():
+    matcher = InMemoryKeywordMatcher(threshold=0.3)
+    products = [(1, "apple pie", None), (2, "office chair", "with wheels")]
+
+    matcher.sync([(10, "apple"), (11, "desk")])
+    assert matcher.find_matches(products) == [(1, 10)]
+
+    # Keyword removed, renamed & added
+    matcher.sync([(11, "chair"), (12, "wheel")])
+    assert sorted(matcher.find_matches(products)) == [(2, 11), (2, 12)]
+    assert "app" not in matcher._index
+
+
+def test_vectorized_matcher_agrees_with_in_memory_matcher(mocker):
+    mocker.patch.object(VectorizedKeywordMatcher, "CHUNK_SIZE", new=2)
+    keywords = [(10, "apple"), (11, "chair"), (12, "mountain bike"), (13, "desk")]
+    products = [
+        (1, "apple pie", None),
+        (2, "office chair", "with wheels"),
+        (3, "Bike", "mountain bike, barely used"),
+        (4, "Lamp", None),
+        (5, "chairs", "pineapple"),
+    ]
+
+    in_memory_matcher = InMemoryKeywordMatcher(threshold=0.3)
+    in_memory_matcher.sync(keywords)
+    vectorized_matcher = VectorizedKeywordMatcher(threshold=0.3)
+    vectorized_matcher.sync(keywords)
+
+    expected_matches = sorted(in_memory_matcher.find_matches(products))
+    assert expected_matches
+    assert sorted(vectorized_matcher.find_matches(products)) == expected_matches
+
+
+def test_in_memory_matcher_indexes_shared_names_once():
+    matcher = InMemoryKeywordMatcher(threshold=0.3)
+
+    matcher.sync([(10, "Sofa"), (11, "sofa"), (12, "desk")])
+    assert matcher._index["sof"] == {"sofa"}
+    assert sorted(matcher.find_matches([(1, "sofa bed", None)])) == [(1, 10), (1, 11)]
+
+    # The name stays indexed until its last keyword is removed
+    matcher.sync([(11, "sofa"), (12, "desk")])
+    assert matcher.find_matches([(1, "sofa bed", None)]) == [(1, 11)]
+    matcher.sync([(12, "desk")])
+    assert "sof" not in matcher._index
@@ -1,7 +1,11 @@
 import time
+import asyncio
 
+import httpx
 import pytest
 
+from pingcycle.tools.circuit_breaker import CircuitBreaker
+from pingcycle.tools.messaging_providers import Telegram
 from pingcycle.tools.messaging_scheduler import MessageScheduler
 import pingcycle.apps.core.models as core_models
 
@@ -34,15 +38,18 @@ def message_send_res_success(*args, **kwargs):
     return {"is_ok": True, "time_sent": current_time + 0.5}
 
 
-TEST_SEND_MESSAGE_ERROR_RES_CODE = 400
+TEST_SEND_MESSAGE_ERROR_RES_CODE = 500
 TEST_SEND_MESSAGE_ERROR_RES_TEXT = "Test Error Text"
 
 
-def message_send_res_error(*args, **kwargs):
+def message_send_res_error(
+    error_res_code=TEST_SEND_MESSAGE_ERROR_RES_CODE, retry_after=None
+):
     return {
         "is_ok": False,
+        "retry_after": retry_after,
         "error_obj": {
-            "error_res_code": TEST_SEND_MESSAGE_ERROR_RES_CODE,
+            "error_res_code": error_res_code,
             "error_msg": TEST_SEND_MESSAGE_ERROR_RES_TEXT,
         },
     }
@@ -159,6 +166,183 @@ def test_total_chat_limit_enforce(
     assert expected_min_time <= elapsed_time < expected_max_time
 
 
+@pytest.mark.django_db
+def test_busy_chat_does_not_delay_other_chats(mocker):
+    """
+    One chat has a backlog of 30 messages limited to 1 every 10 seconds,
+    the 5 other chats should not wait behind it and sleeps should last until
+    the next allowed send only
+    """
+    mock_provider = MockMessagingProvider((1, 10), (1000, 1))
+    message_scheduler = MessageScheduler(provider=mock_provider)
+
+    mocker.patch("time.time", side_effect=get_fake_time)
+    mocker.patch("time.sleep", side_effect=increment_fake_time)
+
+    sent_times = {}
+
+    def send_and_record(message):
+        res = message_send_res_success()
+        sent_times.setdefault(message.chat.id, []).append(res["time_sent"])
+        return res
+
+    mocker.patch.object(message_scheduler, "_attempt_send", side_effect=send_and_record)
+    mocker.patch.object(message_scheduler, "_udpate_message_status", return_value=True)
+
+    busy_chat = mocker.Mock(id=1)
+    for i in range(30):
+        message_scheduler.message_queue.append(mocker.Mock(id=i, chat=busy_chat))
+    for chat_id in range(2, 7):
+        message_scheduler.message_queue.append(
+            mocker.Mock(id=100 + chat_id, chat=mocker.Mock(id=chat_id))
+        )
+
+    start_time = time.time()
+    message_scheduler.send_notified_products_in_queue()
+
+    # Other chats are sent right after the first message of the busy chat
+    assert max(sent_times[chat_id][0] for chat_id in range(2, 7)) < start_time + 4
+    # The busy chat sends exactly every 10 seconds after the previous send
+    busy_gaps = [b - a for a, b in zip(sent_times[1], sent_times[1][1:])]
+    assert busy_gaps == [pytest.approx(10.5)] * 29
+    # Never sleeps longer than needed for the next allowed send
+    assert time.time() == pytest.approx(start_time + 0.5 + 29 * 10.5)
+
+
+class MockAsyncMessagingProvider(MockMessagingProvider):
+    """
+    Async sends take `round_trip` seconds, keeping track of how many
+    were in flight at once and when each chat's sends started
+    """
+
+    def __init__(self, chat_limit, total_limit, round_trip):
+        super().__init__(chat_limit, total_limit)
+        self.round_trip = round_trip
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.start_times = {}
+
+    def get_async_client(self):
+        return httpx.AsyncClient()
+
+    async def send_message_async(self, message, client):
+        self.start_times.setdefault(message.chat.id, []).append(time.time())
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.round_trip)
+        self.in_flight -= 1
+        return {"is_ok": True, "time_sent": time.time()}
+
+
+@pytest.mark.django_db
+def test_async_dispatch_keeps_sends_in_flight_within_limits(mocker):
+    mocker.patch(
+        "pingcycle.tools.messaging_scheduler.MESSAGING_DISPATCH_MODE", new="ASYNC"
+    )
+    mocker.patch("pingcycle.tools.messaging_scheduler.MESSAGING_MAX_IN_FLIGHT", new=5)
+    mock_provider = MockAsyncMessagingProvider((1, 0.3), (50, 1), round_trip=0.1)
+    message_scheduler = MessageScheduler(provider=mock_provider)
+    mocker.patch.object(message_scheduler, "_udpate_message_status", return_value=True)
+
+    # 20 chats with 1 message and 1 chat with 3
+    for chat_id in range(1, 21):
+        message_scheduler.message_queue.append(
+            mocker.Mock(id=chat_id, chat=mocker.Mock(id=chat_id))
+        )
+    busy_chat = mocker.Mock(id=21)
+    for i in range(3):
+        message_scheduler.message_queue.append(mocker.Mock(id=100 + i, chat=busy_chat))
+
+    start_time = time.time()
+    message_scheduler.send_notified_products_in_queue()
+    elapsed_time = time.time() - start_time
+
+    assert sum(len(times) for times in mock_provider.start_times.values()) == 23
+    assert 1 < mock_provider.max_in_flight <= 5
+    # Sending one at a time would take at least 23 round trips
+    assert elapsed_time < 23 * 0.1
+    # Global limit: sends start at least 1/50 seconds apart
+    all_start_times = sorted(
+        start for times in mock_provider.start_times.values() for start in times
+    )
+    assert all(
+        b - a >= 0.02 - 0.001 for a, b in zip(all_start_times, all_start_times[1:])
+    )
+    # Chat limit: counted from the end of the chat's previous send
+    busy_start_times = mock_provider.start_times[21]
+    assert all(
+        b - a >= 0.1 + 0.3 - 0.001
+        for a, b in zip(busy_start_times, busy_start_times[1:])
+    )
+
+
+@pytest.mark.django_db
+def test_async_dispatch_waits_for_pause_set_while_waiting_for_slot(mocker):
+    mocker.patch(
+        "pingcycle.tools.messaging_scheduler.MESSAGING_DISPATCH_MODE", new="ASYNC"
+    )
+    mocker.patch("pingcycle.tools.messaging_scheduler.MESSAGING_MAX_IN_FLIGHT", new=1)
+    mock_provider = MockAsyncMessagingProvider((10, 1), (100, 1), round_trip=0.05)
+    message_scheduler = MessageScheduler(provider=mock_provider)
+    mocker.patch.object(message_scheduler, "_udpate_message_status", return_value=True)
+
+    # The first send is rate limited while the next chat waits for the slot
+    results = [
+        message_send_res_error(429, retry_after=0.3),
+        {"is_ok": True, "time_sent": 0},
+        {"is_ok": True, "time_sent": 0},
+    ]
+
+    async def send_message_async(message, client):
+        mock_provider.start_times.setdefault(message.chat.id, []).append(time.time())
+        await asyncio.sleep(mock_provider.round_trip)
+        return {**results.pop(0), "time_sent": time.time()}
+
+    mock_provider.send_message_async = send_message_async
+    for chat_id in range(1, 3):
+        message_scheduler.message_queue.append(
+            mocker.Mock(id=chat_id, chat=mocker.Mock(id=chat_id))
+        )
+
+    message_scheduler.send_notified_products_in_queue()
+
+    first_start = min(times[0] for times in mock_provider.start_times.values())
+    later_starts = sorted(
+        start for times in mock_provider.start_times.values() for start in times
+    )[1:]
+    assert len(later_starts) == 2
+    assert all(start >= first_start + 0.05 + 0.3 - 0.001 for start in later_starts)
+
+
+@pytest.mark.django_db
+def test_async_dispatch_sends_messages_from_database(
+    get_or_create_user_chats_keywords_products, mocker
+):
+    mocker.patch(
+        "pingcycle.tools.messaging_scheduler.MESSAGING_DISPATCH_MODE", new="ASYNC"
+    )
+    get_or_create_user_chats_keywords_products(
+        chats=[{"reference": "chat_1_user1"}, {"reference": "chat_2_user1"}],
+        keywords_products={
+            "apple": [
+                {"product_name": "apple pie", "external_id": 1},
+                {"product_name": "apple cake", "external_id": 2},
+            ]
+        },
+    )
+
+    mock_provider = MockAsyncMessagingProvider((10, 1), (100, 1), round_trip=0.01)
+    message_scheduler = MessageScheduler(provider=mock_provider)
+    message_scheduler.send_notified_products_in_queue()
+
+    chat_ids = core_models.Chat.objects.values_list("id", flat=True)
+    assert sorted(mock_provider.start_times) == sorted(chat_ids)
+    assert (
+        list(core_models.Message.objects.values_list("status", flat=True))
+        == [core_models.Message.Status.SENT] * 4
+    )
+
+
 @pytest.mark.django_db
 @pytest.mark.parametrize(
     "inputs, assert_messages",
@@ -759,6 +943,9 @@ def test_retry_on_fail(
     mocker.patch(
         "pingcycle.tools.messaging_scheduler.MAX_RETRIES_PER_MESSAGE", new=max_retries
     )
+    # Retries back off, control time progression
+    mocker.patch("time.time", side_effect=get_fake_time)
+    sleep_mock = mocker.patch("time.sleep", side_effect=increment_fake_time)
 
     mock_provider = MockMessagingProvider((1000, 1), (2000, 1))
     message_scheduler = MessageScheduler(provider=mock_provider)
@@ -795,3 +982,276 @@ def test_retry_on_fail(
     assert (
         message.error_msg == assert_message["error_msg"]
     ), f"Expected message error_msg to be {assert_message['error_msg']}"
+
+    # Every retry waited for an exponential backoff with jitter
+    retries = min(number_of_fail_attmepts, max_retries - 1)
+    backoffs = [call.args[0] for call in sleep_mock.call_args_list]
+    assert len(backoffs) == retries
+    for retry, backoff in enumerate(backoffs, start=1):
+        assert 2 ** (retry - 1) / 2 <= backoff <= 2 ** (retry - 1)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("error_res_code", [400, 403])
+def test_permanent_error_fails_without_retries(
+    error_res_code, get_or_create_user_chats_keywords_products, mocker
+):
+    get_or_create_user_chats_keywords_products()
+
+    mock_provider = MockMessagingProvider((1000, 1), (2000, 1))
+    message_scheduler = MessageScheduler(provider=mock_provider)
+    attempt_send_mock = mocker.patch.object(
+        message_scheduler,
+        "_attempt_send",
+        return_value=message_send_res_error(error_res_code),
+    )
+
+    message_scheduler.send_notified_products_in_queue()
+
+    message = core_models.Message.objects.get()
+    assert attempt_send_mock.call_count == 1
+    assert message.status == core_models.Message.Status.FAILED
+    assert message.retry_count == 0
+    assert message.error_res_code == error_res_code
+
+
+@pytest.mark.django_db
+def test_rate_limited_send_waits_retry_after_without_using_retries(mocker):
+    mocker.patch("time.time", side_effect=get_fake_time)
+    mocker.patch("time.sleep", side_effect=increment_fake_time)
+
+    mock_provider = MockMessagingProvider((1000, 1), (1000, 1))
+    message_scheduler = MessageScheduler(provider=mock_provider)
+    mocker.patch.object(message_scheduler, "_udpate_message_status", return_value=True)
+
+    sent_times = []
+
+    def rate_limit_first_send(message):
+        if not sent_times:
+            sent_times.append(None)
+            return message_send_res_error(429, retry_after=7)
+        res = message_send_res_success()
+        sent_times.append(res["time_sent"])
+        return res
+
+    mocker.patch.object(
+        message_scheduler, "_attempt_send", side_effect=rate_limit_first_send
+    )
+
+    messages = [
+        mocker.Mock(id=chat_id, chat=mocker.Mock(id=chat_id), retry_count=0)
+        for chat_id in range(1, 3)
+    ]
+    message_scheduler.message_queue.extend(messages)
+
+    start_time = time.time()
+    message_scheduler.send_notified_products_in_queue()
+
+    # Nothing (not even the other chat) was sent before retry_after passed
+    _, *sent_times = sent_times
+    assert len(sent_times) == 2
+    assert min(sent_times) >= start_time + 7
+    assert all(message.retry_count == 0 for message in messages)
+
+
+@pytest.mark.django_db
+def test_rate_limited_send_fails_after_rate_limited_retries(mocker):
+    mocker.patch("time.time", side_effect=get_fake_time)
+    mocker.patch("time.sleep", side_effect=increment_fake_time)
+
+    mock_provider = MockMessagingProvider((1000, 1), (1000, 1))
+    message_scheduler = MessageScheduler(provider=mock_provider)
+    message_scheduler.max_rate_limited_retries = 2
+    mocker.patch.object(message_scheduler, "_udpate_message_status", return_value=True)
+    attempt_send_mock = mocker.patch.object(
+        message_scheduler,
+        "_attempt_send",
+        side_effect=lambda message: message_send_res_error(429, retry_after=1),
+    )
+    message = mocker.Mock(id=1, chat=mocker.Mock(id=1), retry_count=0)
+    message_scheduler.message_queue.append(message)
+
+    message_scheduler.send_notified_products_in_queue()
+
+    assert attempt_send_mock.call_count == 3
+    assert message.retry_count == 0
+    message_scheduler._udpate_message_status.assert_called_once_with(
+        message=message,
+        status=core_models.Message.Status.FAILED,
+        error_obj=message_send_res_error(429)["error_obj"],
+    )
+
+
+def test_circuit_breaker_opens_and_lets_one_trial_through(mocker):
+    mocker.patch("time.time", side_effect=get_fake_time)
+    circuit_breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+
+    circuit_breaker.record_failure()
+    assert circuit_breaker.allow_request()
+    circuit_breaker.record_failure()
+    assert not circuit_breaker.allow_request()
+    assert circuit_breaker.paused_until == fake_time[0] + 30
+
+    increment_fake_time(30)
+    assert circuit_breaker.allow_request()
+    # Only one trial at a time
+    assert not circuit_breaker.allow_request()
+    circuit_breaker.record_success()
+    assert circuit_breaker.paused_until is None
+    assert circuit_breaker.allow_request()
+
+
+def test_telegram_unexpected_error_ends_circuit_breaker_trial(mocker):
+    mocker.patch.dict(
+        "pingcycle.tools.messaging_providers.CONFIG",
+        {
+            "TELEGRAM_BOT_USERNAME": "bot",
+            "TELEGRAM_BOT_TOKEN": "token",
+            "TELEGRAM_WEBHOOK_SECRET": "secret",
+        },
+    )
+    mocker.patch.object(Telegram, "_setup_webhook")
+    telegram = Telegram()
+    telegram.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    telegram.circuit_breaker.record_failure()
+    telegram.circuit_breaker.open_until = time.time() - 1
+    mocker.patch.object(telegram.session, "post", side_effect=KeyError("unexpected"))
+
+    with pytest.raises(KeyError):
+        telegram._post_api("sendMessage", chat_id=1, text="Hi")
+
+    # The failed trial opened the circuit again instead of blocking it for good
+    assert not telegram.circuit_breaker._trial_in_progress
+    assert telegram.circuit_breaker.paused_until > time.time()
+
+
+@pytest.mark.django_db
+def test_open_circuit_pauses_sending_without_using_retries(mocker):
+    mocker.patch("time.time", side_effect=get_fake_time)
+    mocker.patch("time.sleep", side_effect=increment_fake_time)
+
+    mock_provider = MockMessagingProvider((1000, 1), (1000, 1))
+    mock_provider.circuit_breaker = CircuitBreaker(
+        failure_threshold=2, reset_seconds=30
+    )
+    message_scheduler = MessageScheduler(provider=mock_provider)
+    mocker.patch.object(message_scheduler, "_udpate_message_status", return_value=True)
+
+    # The API fails 3 times (threshold + the first trial) before recovering
+    api_failures = [3]
+
+    def send_through_circuit_breaker(message):
+        if not mock_provider.circuit_breaker.allow_request():
+            return {"is_ok": False, "circuit_open": True, "error_obj": None}
+        if api_failures[0]:
+            api_failures[0] -= 1
+            mock_provider.circuit_breaker.record_failure()
+            return message_send_res_error()
+        mock_provider.circuit_breaker.record_success()
+        return message_send_res_success()
+
+    mocker.patch.object(
+        message_scheduler, "_attempt_send", side_effect=send_through_circuit_breaker
+    )
+
+    messages = [
+        mocker.Mock(id=chat_id, chat=mocker.Mock(id=chat_id), retry_count=0)
+        for chat_id in range(1, 6)
+    ]
+    message_scheduler.message_queue.extend(messages)
+
+    start_time = time.time()
+    message_scheduler.send_notified_products_in_queue()
+
+    # Only the requests actually made used up retries
+    assert sum(message.retry_count for message in messages) == 3
+    assert message_scheduler._udpate_message_status.call_count == 5
+    assert all(
+        call.kwargs["status"] == core_models.Message.Status.SENT
+        for call in message_scheduler._udpate_message_status.call_args_list
+    )
+    # Waited for the circuit to let a trial through twice
+    assert time.time() - start_time >= 60
+
+
+@pytest.mark.django_db
+def test_unreachable_chat_is_deactivated_and_its_messages_skipped(
+    get_or_create_user_chats_keywords_products, mocker
+):
+    get_or_create_user_chats_keywords_products(
+        keywords_products={
+            "apple": [
+                {"product_name": "apple pie", "external_id": 1},
+                {"product_name": "apple cake", "external_id": 2},
+                {"product_name": "apple tart", "external_id": 3},
+            ]
+        }
+    )
+    get_or_create_user_chats_keywords_products(
+        username="user2",
+        chats=[{"reference": "chat_1_user2"}],
+        keywords_products={"pie": [{"product_name": "apple pie", "external_id": 1}]},
+    )
+
+    mock_provider = MockMessagingProvider((1000, 1), (2000, 1))
+    message_scheduler = MessageScheduler(provider=mock_provider)
+
+    def block_user1(message):
+        if message.chat.reference == "chat_1_user1":
+            return {
+                **message_send_res_error(403),
+                "unreachable_reason": core_models.Chat.InactiveReason.BOT_BLOCKED,
+            }
+        return message_send_res_success()
+
+    attempt_send_mock = mocker.patch.object(
+        message_scheduler, "_attempt_send", side_effect=block_user1
+    )
+
+    message_scheduler.send_notified_products_in_queue()
+
+    blocked_chat = core_models.Chat.objects.get(reference="chat_1_user1")
+    assert blocked_chat.state == core_models.Chat.State.INACTIVE
+    assert blocked_chat.inactive_reason == core_models.Chat.InactiveReason.BOT_BLOCKED
+    assert sorted(blocked_chat.messages.values_list("status", flat=True)) == [
+        core_models.Message.Status.FAILED,
+        core_models.Message.Status.SKIPPED,
+        core_models.Message.Status.SKIPPED,
+    ]
+    # Only 1 send to the blocked chat, the other chat is not affected
+    assert attempt_send_mock.call_count == 2
+    other_message = core_models.Message.objects.get(chat__reference="chat_1_user2")
+    assert other_message.status == core_models.Message.Status.SENT
+
+
+@pytest.mark.parametrize(
+    "status_code, res_text, expected_reason",
+    [
+        pytest.param(
+            403,
+            "Forbidden: bot was blocked by the user",
+            core_models.Chat.InactiveReason.BOT_BLOCKED,
+            id="Bot blocked",
+        ),
+        pytest.param(
+            403,
+            "Forbidden: user is deactivated",
+            core_models.Chat.InactiveReason.USER_DEACTIVATED,
+            id="Account deleted",
+        ),
+        pytest.param(
+            400,
+            "Bad Request: chat not found",
+            core_models.Chat.InactiveReason.CHAT_NOT_FOUND,
+            id="Chat not found",
+        ),
+        pytest.param(
+            400,
+            "Bad Request: can't parse entities",
+            None,
+            id="Bad Markdown",
+        ),
+    ],
+)
+def test_telegram_unreachable_reason(status_code, res_text, expected_reason):
+    assert Telegram._get_unreachable_reason(status_code, res_text) == expected_reason
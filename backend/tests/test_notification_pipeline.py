@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+from pingcycle.tools.notification_pipeline import NotificationPipeline
+import pingcycle.apps.core.models as core_models
+
+
+class MockMessagingProvider:
+    CHAT_LIMIT_SECONDS = (1000, 1)
+    TOTAL_LIMIT_SECONDS = (1000, 1)
+
+    def __init__(self):
+        self.sent_messages = []
+
+    def send_message(self, message):
+        self.sent_messages.append(message)
+        return {"is_ok": True, "time_sent": time.time()}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pipeline_sends_each_batch_as_it_is_submitted(
+    get_or_create_user_chats_keywords_products,
+):
+    """
+    A submitted batch is matched, turned into messages and sent, other
+    products are left for later batches
+    """
+    get_or_create_user_chats_keywords_products(
+        keywords_products={
+            "apple": [
+                {
+                    "product_name": "hot apple pie",
+                    "external_id": 1,
+                    "state": core_models.NotifiedProduct.State.CREATED,
+                },
+                {
+                    "product_name": "apple tree",
+                    "external_id": 2,
+                    "state": core_models.NotifiedProduct.State.CREATED,
+                },
+            ]
+        }
+    )
+    provider = MockMessagingProvider()
+
+    async def run():
+        try:
+            async with NotificationPipeline(provider) as pipeline:
+                await pipeline.submit([1])
+            return pipeline
+        finally:
+            await sync_to_async(connections.close_all)()
+
+    pipeline = asyncio.run(run())
+
+    assert pipeline.processed_batches == 1
+    assert [
+        message.notified_product.external_id for message in provider.sent_messages
+    ] == [1]
+    assert core_models.Message.objects.get().status == core_models.Message.Status.SENT
+    assert (
+        core_models.NotifiedProduct.objects.get(external_id=2).state
+        == core_models.NotifiedProduct.State.CREATED
+    )
+
+
+class SlowChatMessagingProvider(MockMessagingProvider):
+    CHAT_LIMIT_SECONDS = (1, 10)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pipeline_stops_sending_at_drain_deadline(
+    get_or_create_user_chats_keywords_products,
+):
+    """
+    Messages that would be sent past the deadline are left for the pass
+    after the pipeline instead of waiting for the chat limit
+    """
+    get_or_create_user_chats_keywords_products(
+        keywords_products={
+            "apple": [
+                {
+                    "product_name": "hot apple pie",
+                    "external_id": 1,
+                    "state": core_models.NotifiedProduct.State.CREATED,
+                },
+                {
+                    "product_name": "apple tree",
+                    "external_id": 2,
+                    "state": core_models.NotifiedProduct.State.CREATED,
+                },
+            ]
+        }
+    )
+    provider = SlowChatMessagingProvider()
+
+    async def run():
+        try:
+            async with NotificationPipeline(
+                provider, drain_deadline=time.monotonic() + 0.5
+            ) as pipeline:
+                await pipeline.submit([1, 2])
+        finally:
+            await sync_to_async(connections.close_all)()
+
+    start_time = time.monotonic()
+    asyncio.run(run())
+
+    assert time.monotonic() - start_time < 5
+    assert len(provider.sent_messages) == 1
+    assert sorted(core_models.Message.objects.values_list("status", flat=True)) == [
+        core_models.Message.Status.CREATED,
+        core_models.Message.Status.SENT,
+    ]
@@ -0,0 +1,1102 @@
+import asyncio
+import contextlib
+from datetime import timedelta
+
+import httpx
+import pytest
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+
+from pingcycle.tools import scraper as scraper_module
+from pingcycle.tools.scraper import Scraper, TownAttempt, parse_time_ago
+from pingcycle.tools.browser_manager import BrowserManager
+from pingcycle.tools.http_fetcher import (
+    HttpFetcher,
+    ProductRowsParser,
+    HttpFallbackError,
+)
+from pingcycle.tools.request_blocker import RequestBlocker, ESTIMATED_BYTES_DEFAULT
+from pingcycle.tools.politeness import PolitenessScheduler
+import pingcycle.apps.core.models as core_models
+
+
+@contextlib.asynccontextmanager
+async def mock_async_playwright():
+    yield None
+
+
+def run_with_db(coroutine):
+    """
+    Runs a coroutine that uses the db through `sync_to_async`, closing the
+    connections it opened so the test database can be torn down
+    """
+
+    async def _run():
+        try:
+            return await coroutine
+        finally:
+            await sync_to_async(connections.close_all)()
+
+    return asyncio.run(_run())
+
+
+@pytest.fixture
+def towns():
+    core_models.Town.objects.all().delete()
+    return core_models.Town.objects.bulk_create(
+        [
+            core_models.Town(name="Dublin", url_ext="DublinIE", priority=5),
+            core_models.Town(name="County Kildare", url_ext="KildareIE", priority=4),
+            core_models.Town(
+                name="County Wicklow", url_ext="CountyWicklow", priority=3
+            ),
+            core_models.Town(name="County Wexford", url_ext="WexfordIRE", priority=2),
+            core_models.Town(name="Waterford", url_ext="WaterfordIE", priority=1),
+        ]
+    )
+
+
+@pytest.mark.parametrize(
+    "concurrency, expected_max_running",
+    [
+        pytest.param(1, 1, id="Sequential"),
+        pytest.param(2, 2, id="2 towns at a time"),
+        pytest.param(10, 5, id="More workers than towns"),
+    ],
+)
+@pytest.mark.django_db(transaction=True)
+def test_run_main_bounds_concurrency(concurrency, expected_max_running, towns, mocker):
+    """
+    Every town is scraped, and never more than `concurrency` at the same time
+    """
+    mocker.patch.object(scraper_module, "async_playwright", mock_async_playwright)
+
+    running = {"now": 0, "max": 0}
+    scraped_towns = []
+
+    async def mock_scrape_town(town, with_proxy):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.01)
+        scraped_towns.append(town.name)
+        running["now"] -= 1
+
+    scraper = Scraper()
+    mocker.patch.object(scraper, "_scrape_town", side_effect=mock_scrape_town)
+
+    run_with_db(scraper.run_main(with_proxy=False, concurrency=concurrency))
+
+    assert sorted(scraped_towns) == sorted(town.name for town in towns)
+    assert running["max"] == expected_max_running
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_main_isolates_town_failures(towns, mocker):
+    """
+    An unexpected error in one town does not stop the other towns
+    """
+    mocker.patch.object(scraper_module, "async_playwright", mock_async_playwright)
+    failing_town_name = towns[0].name
+    scraped_towns = []
+
+    async def mock_scrape_town(town, with_proxy):
+        if town.name == failing_town_name:
+            raise RuntimeError("Town failed")
+        scraped_towns.append(town.name)
+
+    scraper = Scraper()
+    mocker.patch.object(scraper, "_scrape_town", side_effect=mock_scrape_town)
+    mocker.patch.object(scraper, "send_capture_exception")
+
+    run_with_db(scraper.run_main(with_proxy=False, concurrency=3))
+
+    assert failing_town_name not in scraped_towns
+    assert len(scraped_towns) == len(towns) - 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_main_only_scrapes_due_towns(towns, mocker):
+    """
+    Disabled towns and towns polled recently are skipped, the rest are
+    scraped by priority
+    """
+    mocker.patch.object(scraper_module, "async_playwright", mock_async_playwright)
+    core_models.Town.objects.filter(url_ext="KildareIE").update(enabled=False)
+    core_models.Town.objects.filter(url_ext="WexfordIRE").update(
+        next_due_at=timezone.now() + timedelta(minutes=30)
+    )
+    scraped_towns = []
+
+    async def mock_scrape_town(town, with_proxy):
+        scraped_towns.append(town.url_ext)
+
+    scraper = Scraper()
+    mocker.patch.object(scraper, "_scrape_town", side_effect=mock_scrape_town)
+
+    run_with_db(scraper.run_main(with_proxy=False, concurrency=1))
+
+    assert scraped_towns == ["DublinIE", "CountyWicklow", "WaterfordIE"]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_main_respects_time_budget(towns, mocker):
+    """
+    A town still running at the deadline is cut short and the towns after
+    it are skipped, by priority order
+    """
+    mocker.patch.object(scraper_module, "async_playwright", mock_async_playwright)
+    mocker.patch.object(scraper_module, "SCRAPER_MIN_SECONDS_PER_TOWN", new=0.1)
+    scraped_towns = []
+
+    async def mock_scrape_town(town, with_proxy):
+        scraped_towns.append(town.url_ext)
+        # The second town is too slow for the budget
+        await asyncio.sleep(10 if len(scraped_towns) == 2 else 0)
+
+    scraper = Scraper()
+    mocker.patch.object(scraper, "_scrape_town", side_effect=mock_scrape_town)
+
+    run_with_db(
+        scraper.run_main(with_proxy=False, concurrency=1, time_budget_seconds=0.3)
+    )
+
+    assert scraped_towns == ["DublinIE", "KildareIE"]
+    assert scraper.cut_short_towns == ["KildareIE"]
+    assert scraper.skipped_towns == ["CountyWicklow", "WexfordIRE", "WaterfordIE"]
+
+
+@pytest.mark.parametrize(
+    "posts_per_hour, new_posts_count, expected_interval_minutes",
+    [
+        pytest.param(None, 12, 10, id="Busy town polled at the minimum interval"),
+        pytest.param(None, 4, 30, id="Interval spaced to the target posts per poll"),
+        pytest.param(None, 0, 60, id="Quiet town polled at the maximum interval"),
+        pytest.param(12.0, 0, 2 / 8.4 * 60, id="Rate is smoothed over previous polls"),
+    ],
+)
+@pytest.mark.django_db
+def test_town_schedule_next_poll(
+    posts_per_hour, new_posts_count, expected_interval_minutes, mocker
+):
+    mocker.patch.object(core_models, "SCRAPER_MIN_POLL_MINUTES", new=10)
+    mocker.patch.object(core_models, "SCRAPER_MAX_POLL_MINUTES", new=60)
+    mocker.patch.object(core_models, "SCRAPER_TARGET_POSTS_PER_POLL", new=2)
+    now = timezone.now()
+    mocker.patch.object(core_models.timezone, "now", return_value=now)
+    town = core_models.Town.objects.create(
+        name="Dublin",
+        url_ext="DublinIE-test",
+        posts_per_hour=posts_per_hour,
+        last_scraped_at=now - timedelta(hours=1),
+    )
+
+    town.schedule_next_poll(new_posts_count)
+
+    town.refresh_from_db()
+    assert town.poll_interval_minutes == pytest.approx(expected_interval_minutes)
+    assert town.last_scraped_at == now
+    assert town.next_due_at == now + timedelta(minutes=town.poll_interval_minutes)
+
+
+@pytest.mark.django_db
+def test_town_first_poll_keeps_default_interval(mocker):
+    """
+    Without a previous poll the counted posts cover an unknown window,
+    so no rate is estimated from them
+    """
+    mocker.patch.object(core_models, "SCRAPER_MIN_POLL_MINUTES", new=10)
+    now = timezone.now()
+    mocker.patch.object(core_models.timezone, "now", return_value=now)
+    town = core_models.Town.objects.create(
+        name="Dublin", url_ext="DublinIE-test", poll_interval_minutes=15
+    )
+
+    town.schedule_next_poll(12)
+
+    town.refresh_from_db()
+    assert town.posts_per_hour is None
+    assert town.poll_interval_minutes == 15
+    assert town.last_scraped_at == now
+    assert town.next_due_at == now + timedelta(minutes=15)
+
+
+def test_browser_manager_reuses_browser_until_disconnected(mocker):
+    """
+    Chromium is launched once and only relaunched after it disconnects
+    """
+    browser = mocker.Mock()
+    browser.is_connected.return_value = True
+    browser.new_context = mocker.AsyncMock()
+    playwright = mocker.Mock()
+    playwright.chromium.launch = mocker.AsyncMock(return_value=browser)
+
+    browser_manager = BrowserManager(playwright)
+
+    async def open_contexts(count):
+        for _ in range(count):
+            await browser_manager.new_context(proxy_settings=None)
+
+    asyncio.run(open_contexts(3))
+    assert playwright.chromium.launch.await_count == 1
+    assert browser.new_context.await_count == 3
+
+    browser.is_connected.return_value = False
+    asyncio.run(open_contexts(1))
+    assert playwright.chromium.launch.await_count == 2
+    assert browser_manager.get_timings_summary()["new_context"]["count"] == 4
+
+
+def build_product_row(external_id, is_offered=True, time_ago="5 minutes ago"):
+    return {
+        "external_id": str(external_id),
+        "is_offered": is_offered,
+        "time_ago": time_ago,
+        "product_name": f"Product {external_id}",
+        "description": f"Description {external_id}",
+        "img": None,
+        "sublocation": "Sublocation",
+    }
+
+
+def build_mock_page(mocker, product_rows):
+    page = mocker.Mock()
+    page.goto = mocker.AsyncMock()
+    page.content = mocker.AsyncMock()
+    page.locator.return_value.evaluate_all = mocker.AsyncMock(
+        side_effect=lambda js, start_index: product_rows[start_index:]
+    )
+    return page
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_products_from_town_with_in_page_extraction(mocker):
+    """
+    Only new, offered and recent rows are stored, and extraction stops at
+    the first row that is not recent
+    """
+    mocker.patch.object(scraper_module, "SCRAPER_EXTRACTION_MODE", new="evaluate")
+    core_models.NotifiedProduct.objects.create(
+        product_name="Existing", external_id=3, location="Dublin"
+    )
+    page = build_mock_page(
+        mocker,
+        [
+            build_product_row(1),
+            build_product_row(2, is_offered=False),
+            build_product_row(3),
+            build_product_row(4, time_ago="2 hours ago"),
+            build_product_row(5),
+        ],
+    )
+
+    scraper = Scraper()
+    mocker.patch.object(scraper, "accept_privacy_dialog_if_present")
+    mocker.patch.object(scraper, "_ensure_list_view")
+
+    run_with_db(scraper._create_products_from_town(page, "Dublin", "DublinIE"))
+
+    assert page.locator.return_value.evaluate_all.await_count == 1
+    assert sorted(
+        core_models.NotifiedProduct.objects.values_list("external_id", flat=True)
+    ) == [1, 3]
+    product = core_models.NotifiedProduct.objects.get(external_id=1)
+    assert product.product_name == "Product 1"
+    assert product.location == "Dublin"
+
+
+LISTING_HTML = """
+<html><body>
+<div id="fc-data">
+  <div data-id="101" class="post-list-item">
+    <div class="post-list-item-header-icon location-icon"><i></i><span>Rathmines</span></div>
+    <span class="text-offer">OFFER</span>
+    <img src="placeholder.png" data-src="https://images.freecycle.org/101.jpg">
+    <div class="post-list-item-content-description hide-for-small-only">
+      <h4><a href="/posts/101">Oak   Desk</a></h4>
+      <p>Solid desk, <b>collection</b> only</p>
+    </div>
+    <span class="post-list-item-date text-lighten-less">5 minutes ago</span>
+  </div>
+  <div data-id="102" class="post-list-item">
+    <span class="text-wanted">WANTED</span>
+    <div class="post-list-item-content-description hide-for-small-only">
+      <h4><a href="/posts/102">Bike</a></h4>
+    </div>
+    <span class="post-list-item-date text-lighten-less">8 minutes ago</span>
+  </div>
+</div>
+</body></html>
+"""
+
+
+def test_product_rows_parser_reads_server_rendered_listing():
+    parser = ProductRowsParser()
+    parser.feed(LISTING_HTML)
+    parser.close()
+
+    assert parser.found_data_container
+    assert parser.product_rows == [
+        {
+            "external_id": "101",
+            "is_offered": True,
+            "time_ago": "5 minutes ago",
+            "product_name": "Oak Desk",
+            "description": "Solid desk, collection only",
+            "img": "https://images.freecycle.org/101.jpg",
+            "sublocation": "Rathmines",
+        },
+        {
+            "external_id": "102",
+            "is_offered": False,
+            "time_ago": "8 minutes ago",
+            "product_name": "Bike",
+            "description": None,
+            "img": None,
+            "sublocation": None,
+        },
+    ]
+
+
+@pytest.mark.parametrize(
+    "html, expected_error",
+    [
+        pytest.param(LISTING_HTML, None, id="Complete rows"),
+        pytest.param(
+            LISTING_HTML.replace("<h4><a", "<h5><a").replace("</a></h4>", "</a></h5>"),
+            "Incomplete product rows in HTML",
+            id="Offered row without name",
+        ),
+        pytest.param(
+            LISTING_HTML.replace('data-id="101"', 'data-id=""'),
+            "Incomplete product rows in HTML",
+            id="Row without external id",
+        ),
+        pytest.param(
+            "<html><body></body></html>",
+            "Product rows not found in HTML",
+            id="No rows",
+        ),
+    ],
+)
+def test_http_fetcher_falls_back_on_unexpected_markup(html, expected_error, mocker):
+    fetcher = HttpFetcher()
+    client = mocker.Mock(
+        get=mocker.AsyncMock(return_value=mocker.Mock(status_code=200, text=html))
+    )
+    mocker.patch.object(fetcher, "_get_client", return_value=client)
+
+    fetch = fetcher.fetch_product_rows("https://www.freecycle.org/town/X", "UA")
+
+    if expected_error is None:
+        assert len(asyncio.run(fetch)) == 2
+    else:
+        with pytest.raises(HttpFallbackError, match=expected_error):
+            asyncio.run(fetch)
+
+
+def test_http_fetcher_escapes_proxy_credentials():
+    proxy = core_models.Proxy(
+        domain="proxy.example.com", port=8000, username="user@x", password="p@ss:/%25w"
+    )
+
+    httpx_proxy = httpx.Proxy(HttpFetcher._get_proxy_url(proxy))
+
+    assert httpx_proxy.url == "http://proxy.example.com:8000"
+    assert httpx_proxy.auth == ("user@x", "p@ss:/%25w")
+
+
+@pytest.mark.parametrize(
+    "http_side_effect, expected_served_by",
+    [
+        pytest.param(None, "HTTP", id="Served over HTTP"),
+        pytest.param(
+            HttpFallbackError("Challenge page detected (403)"),
+            "BROWSER",
+            id="Falls back to browser",
+        ),
+    ],
+)
+def test_scrape_town_http_fetch_mode(http_side_effect, expected_served_by, mocker):
+    schedule_next_poll = mocker.patch.object(core_models.Town, "schedule_next_poll")
+    town = core_models.Town(
+        name="Dublin", url_ext="DublinIE", fetch_mode=core_models.Town.FetchMode.HTTP
+    )
+
+    scraper = Scraper()
+    scraper.served_by = {}
+    scraper.request_stats = {}
+    scraper._politeness = PolitenessScheduler(0, 0)
+    scraper._attempt_durations = []
+    over_http = mocker.patch.object(
+        scraper,
+        "_create_products_from_town_over_http",
+        side_effect=http_side_effect,
+    )
+    context = mocker.Mock(close=mocker.AsyncMock())
+    open_page = mocker.patch.object(
+        scraper, "_open_blank_browser_page", return_value=(context, mocker.Mock())
+    )
+    over_browser = mocker.patch.object(scraper, "_create_products_from_town")
+
+    asyncio.run(scraper._scrape_town(town, with_proxy=False))
+
+    assert over_http.await_count == 1
+    assert scraper.served_by == {"DublinIE": expected_served_by}
+    assert over_browser.await_count == (1 if expected_served_by == "BROWSER" else 0)
+    assert open_page.await_count == over_browser.await_count
+    assert context.close.await_count == over_browser.await_count
+    assert schedule_next_poll.call_count == 1
+
+
+def build_scraper_for_town_attempts():
+    scraper = Scraper()
+    scraper.served_by = {}
+    scraper.request_stats = {}
+    scraper._attempt_durations = []
+    scraper.hedged_attempts = 0
+    return scraper
+
+
+def test_scrape_town_bounds_attempts(mocker):
+    """
+    A town that keeps failing is given up after SCRAPER_MAX_ATTEMPTS_PER_TOWN
+    """
+    mocker.patch.object(scraper_module, "SCRAPER_MAX_ATTEMPTS_PER_TOWN", new=3)
+    schedule_next_poll = mocker.patch.object(core_models.Town, "schedule_next_poll")
+    scraper = build_scraper_for_town_attempts()
+    attempt_town = mocker.patch.object(
+        scraper, "_attempt_town", side_effect=RuntimeError("Proxy failed")
+    )
+    mocker.patch.object(scraper, "send_capture_exception")
+
+    asyncio.run(
+        scraper._scrape_town(
+            core_models.Town(name="Dublin", url_ext="DublinIE"), with_proxy=False
+        )
+    )
+
+    assert attempt_town.await_count == 3
+    assert schedule_next_poll.call_count == 0
+
+
+def test_scrape_town_hedges_slow_attempt(mocker):
+    """
+    A second attempt starts once the first passes the hedge deadline,
+    the first success wins and the slow attempt is cancelled
+    """
+    mocker.patch.object(scraper_module, "SCRAPER_HEDGING", new=True)
+    mocker.patch.object(scraper_module, "SCRAPER_HEDGE_DEFAULT_SECONDS", new=0.05)
+    schedule_next_poll = mocker.patch.object(core_models.Town, "schedule_next_poll")
+    scraper = build_scraper_for_town_attempts()
+    attempts = {"started": 0, "cancelled": 0}
+
+    async def mock_attempt_town(town, with_proxy, attempt):
+        attempts["started"] += 1
+        attempt.start_navigation()
+        try:
+            # The first attempt hangs, the hedged one is fast
+            await asyncio.sleep(10 if attempts["started"] == 1 else 0.01)
+        except asyncio.CancelledError:
+            attempts["cancelled"] += 1
+            raise
+        return mocker.Mock(unseen_posts=2), core_models.Town.FetchMode.HTTP
+
+    mocker.patch.object(scraper, "_attempt_town", side_effect=mock_attempt_town)
+
+    asyncio.run(
+        asyncio.wait_for(
+            scraper._scrape_town(
+                core_models.Town(name="Dublin", url_ext="DublinIE"), with_proxy=False
+            ),
+            timeout=5,
+        )
+    )
+
+    assert attempts == {"started": 2, "cancelled": 1}
+    assert scraper.hedged_attempts == 1
+    assert scraper.served_by == {"DublinIE": "HTTP"}
+    schedule_next_poll.assert_called_once_with(2)
+
+
+def test_scrape_town_hedge_deadline_starts_with_navigation(mocker):
+    """
+    Time spent waiting for a proxy lease or politeness turn does not count
+    towards the hedge deadline, and each attempt gets its own request blocker
+    """
+    mocker.patch.object(scraper_module, "SCRAPER_HEDGING", new=True)
+    mocker.patch.object(scraper_module, "SCRAPER_HEDGE_DEFAULT_SECONDS", new=0.05)
+    mocker.patch.object(core_models.Town, "schedule_next_poll")
+    scraper = build_scraper_for_town_attempts()
+    attempts = []
+
+    async def mock_attempt_town(town, with_proxy, attempt):
+        attempts.append(attempt)
+        # Waiting for a lease, well past the hedge deadline
+        await asyncio.sleep(0.2)
+        attempt.start_navigation()
+        await asyncio.sleep(0.01)
+        return mocker.Mock(unseen_posts=2), core_models.Town.FetchMode.BROWSER
+
+    mocker.patch.object(scraper, "_attempt_town", side_effect=mock_attempt_town)
+
+    asyncio.run(
+        asyncio.wait_for(
+            scraper._scrape_town(
+                core_models.Town(name="Dublin", url_ext="DublinIE"), with_proxy=False
+            ),
+            timeout=5,
+        )
+    )
+
+    assert len(attempts) == 1
+    assert scraper.hedged_attempts == 0
+    assert scraper.request_stats == {
+        "DublinIE": attempts[0].request_blocker.get_stats()
+    }
+    assert scraper._attempt_durations == [pytest.approx(0.01, abs=0.05)]
+
+
+@pytest.mark.parametrize(
+    "scrape_error, expected_release",
+    [
+        pytest.param(None, (True, 3.0), id="Success, without browser startup"),
+        pytest.param(RuntimeError("Proxy failed"), (False, None), id="Failure"),
+    ],
+)
+def test_attempt_town_records_proxy_latency_of_successes(
+    mocker, scrape_error, expected_release
+):
+    clock = {"now": 0.0}
+    mocker.patch("pingcycle.tools.scraper.time.perf_counter", lambda: clock["now"])
+    proxy = mocker.Mock(id=1, domain="proxy.example.com", port=8000)
+    scraper = build_scraper_for_town_attempts()
+    scraper._politeness = PolitenessScheduler(min_host_gap=0, min_proxy_gap=0)
+    mocker.patch.object(scraper, "_lease_proxy", return_value=proxy)
+
+    async def open_blank_browser_page(proxy, request_blocker):
+        clock["now"] += 20.0  # Launching Chromium
+        return mocker.AsyncMock(), mocker.Mock()
+
+    async def create_products_from_town(page, town_name, town_url_ext):
+        clock["now"] += 3.0
+        if scrape_error is not None:
+            raise scrape_error
+        return mocker.Mock()
+
+    mocker.patch.object(
+        scraper, "_open_blank_browser_page", side_effect=open_blank_browser_page
+    )
+    mocker.patch.object(
+        scraper, "_create_products_from_town", side_effect=create_products_from_town
+    )
+    town = core_models.Town(
+        name="Dublin",
+        url_ext="DublinIE",
+        fetch_mode=core_models.Town.FetchMode.BROWSER,
+    )
+
+    with contextlib.suppress(RuntimeError):
+        asyncio.run(scraper._attempt_town(town, True, TownAttempt()))
+
+    proxy.release.assert_called_once_with(*expected_release)
+
+
+@pytest.mark.parametrize(
+    "durations, expected_deadline",
+    [
+        pytest.param([1.0, 2.0], 45, id="Default until enough samples"),
+        pytest.param([float(i) for i in range(1, 11)], 9.0, id="90th percentile"),
+    ],
+)
+def test_get_hedge_deadline(durations, expected_deadline, mocker):
+    mocker.patch.object(scraper_module, "SCRAPER_HEDGE_DEFAULT_SECONDS", new=45)
+    mocker.patch.object(scraper_module, "SCRAPER_HEDGE_PERCENTILE", new=90)
+    mocker.patch.object(scraper_module, "SCRAPER_HEDGE_MIN_SAMPLES", new=3)
+    scraper = build_scraper_for_town_attempts()
+    scraper._attempt_durations = durations
+
+    assert scraper._get_hedge_deadline() == expected_deadline
+
+
+@pytest.mark.parametrize(
+    "resource_type, url, expected_blocked",
+    [
+        pytest.param("document", "https://www.freecycle.org/town/DublinIE", False),
+        pytest.param("image", "https://images.freecycle.org/1.jpg", True),
+        pytest.param("script", "https://www.googletagmanager.com/gtm.js", True),
+        pytest.param("script", "https://cmp.quantcast.com/choice.js", True),
+        pytest.param("script", "https://www.freecycle.org/app.js", False),
+    ],
+)
+def test_request_blocker(resource_type, url, expected_blocked, mocker):
+    request_blocker = RequestBlocker(
+        ["image", "font"], ["googletagmanager.com", "quantcast.com"]
+    )
+    route = mocker.Mock(
+        request=mocker.Mock(resource_type=resource_type, url=url, headers={}),
+        abort=mocker.AsyncMock(),
+        continue_=mocker.AsyncMock(),
+    )
+
+    asyncio.run(request_blocker._handle_route(route))
+
+    assert route.abort.await_count == (1 if expected_blocked else 0)
+    assert route.continue_.await_count == (0 if expected_blocked else 1)
+    assert request_blocker.get_stats()["blocked_requests"] == int(expected_blocked)
+
+
+def test_request_blocker_only_estimates_bytes_of_unknown_size(mocker):
+    request_blocker = RequestBlocker([], ["googletagmanager.com"])
+
+    def build_route(headers):
+        return mocker.Mock(
+            request=mocker.Mock(
+                resource_type="xhr",
+                url="https://www.googletagmanager.com/collect",
+                headers=headers,
+            ),
+            abort=mocker.AsyncMock(),
+        )
+
+    asyncio.run(request_blocker._handle_route(build_route({"content-length": "1234"})))
+    asyncio.run(request_blocker._handle_route(build_route({})))
+
+    assert request_blocker.get_stats() == {
+        "blocked_requests": 2,
+        "bytes_saved": 1234,
+        "estimated_bytes_saved": ESTIMATED_BYTES_DEFAULT,
+        "bytes_loaded": 0,
+    }
+
+
+@pytest.mark.parametrize(
+    "time_ago, expected_delta",
+    [
+        pytest.param("5 minutes ago", timedelta(minutes=5)),
+        pytest.param("1 minute ago", timedelta(minutes=1)),
+        pytest.param("an hour ago", timedelta(hours=1)),
+        pytest.param("3 hours ago", timedelta(hours=3)),
+        pytest.param("2 days ago", timedelta(days=2)),
+        pytest.param("just now", timedelta(0)),
+        pytest.param("21 Mar 2025", None),
+        pytest.param(None, None),
+    ],
+)
+def test_parse_time_ago(time_ago, expected_delta):
+    now = timezone.now()
+    posted_at = parse_time_ago(time_ago, now)
+
+    if expected_delta is None:
+        assert posted_at is None
+    else:
+        assert now - posted_at == expected_delta
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_products_from_town_stops_at_cursor(mocker):
+    """
+    With a cursor, posts older than an hour are still picked up and
+    scraping stops at the first post already ingested
+    """
+    mocker.patch.object(scraper_module, "SCRAPER_EXTRACTION_MODE", new="evaluate")
+    core_models.TownCursor.objects.create(town_url_ext="DublinIE", latest_external_id=8)
+    page = build_mock_page(
+        mocker,
+        [
+            build_product_row(11, time_ago="5 minutes ago"),
+            build_product_row(10, time_ago="2 hours ago"),
+            build_product_row(9, is_offered=False, time_ago="3 hours ago"),
+            build_product_row(8, time_ago="4 hours ago"),
+            build_product_row(7, time_ago="5 hours ago"),
+        ],
+    )
+
+    scraper = Scraper()
+    mocker.patch.object(scraper, "accept_privacy_dialog_if_present")
+    mocker.patch.object(scraper, "_ensure_list_view")
+
+    run_with_db(scraper._create_products_from_town(page, "Dublin", "DublinIE"))
+
+    assert sorted(
+        core_models.NotifiedProduct.objects.values_list("external_id", flat=True)
+    ) == [10, 11]
+    assert (
+        core_models.TownCursor.objects.get(town_url_ext="DublinIE").latest_external_id
+        == 11
+    )
+
+
+def build_mock_element(mocker, text=None, attributes=None, children=None):
+    """
+    Locator of a single element, `children` maps selectors to elements
+    (None for no match)
+    """
+    children = children or {}
+    element = mocker.Mock()
+    element.count = mocker.AsyncMock(return_value=1)
+    element.inner_text = mocker.AsyncMock(return_value=text)
+    element.get_attribute = mocker.AsyncMock(
+        side_effect=lambda name: (attributes or {}).get(name)
+    )
+
+    def locator(selector):
+        child = children.get(selector)
+        if child is None:
+            child = build_mock_element(mocker)
+            child.count.return_value = 0
+        return child
+
+    element.locator = locator
+    return element
+
+
+def build_mock_locator_page(mocker, product_rows):
+    """
+    Page read field by field through locators, see `_iterate_rows_with_locators`
+    """
+    row_elements = []
+    for product_row in product_rows:
+        children = {
+            "span.post-list-item-date.text-lighten-less": build_mock_element(
+                mocker, text=product_row["time_ago"]
+            ),
+            ".post-list-item-content-description.hide-for-small-only": build_mock_element(
+                mocker,
+                children={
+                    "h4 > a": build_mock_element(
+                        mocker, text=product_row["product_name"]
+                    ),
+                    "p": build_mock_element(mocker, text=product_row["description"]),
+                },
+            ),
+        }
+        if product_row["is_offered"]:
+            children[".text-offer"] = build_mock_element(mocker)
+        row_elements.append(
+            build_mock_element(
+                mocker,
+                attributes={"data-id": product_row["external_id"]},
+                children=children,
+            )
+        )
+
+    page = mocker.Mock()
+    page.goto = mocker.AsyncMock()
+    page.content = mocker.AsyncMock()
+    page.locator.return_value.count = mocker.AsyncMock(return_value=len(row_elements))
+    page.locator.return_value.nth = lambda i: row_elements[i]
+    return page
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_products_from_town_with_locators_reads_age_of_every_row(mocker):
+    """
+    A WANTED row between offered rows does not end the scan, so the
+    offered rows below it are not skipped once the cursor moves
+    """
+    mocker.patch.object(scraper_module, "SCRAPER_EXTRACTION_MODE", new="locator")
+    core_models.TownCursor.objects.create(town_url_ext="DublinIE", latest_external_id=5)
+    page = build_mock_locator_page(
+        mocker,
+        [
+            build_product_row(9),
+            build_product_row(8, is_offered=False),
+            build_product_row(7),
+            build_product_row(5),
+        ],
+    )
+
+    scraper = Scraper()
+    mocker.patch.object(scraper, "accept_privacy_dialog_if_present")
+    mocker.patch.object(scraper, "_ensure_list_view")
+
+    run_with_db(scraper._create_products_from_town(page, "Dublin", "DublinIE"))
+
+    assert sorted(
+        core_models.NotifiedProduct.objects.values_list("external_id", flat=True)
+    ) == [7, 9]
+    assert core_models.NotifiedProduct.objects.get(external_id=7).product_name == (
+        "Product 7"
+    )
+    assert (
+        core_models.TownCursor.objects.get(town_url_ext="DublinIE").latest_external_id
+        == 9
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_products_from_town_keeps_cursor_when_not_all_read(mocker):
+    """
+    If more rows could not be loaded, the cursor is not moved so the next
+    run reads the remaining posts
+    """
+    mocker.patch.object(scraper_module, "SCRAPER_EXTRACTION_MODE", new="evaluate")
+    core_models.TownCursor.objects.create(town_url_ext="DublinIE", latest_external_id=5)
+    page = build_mock_page(
+        mocker,
+        [build_product_row(7), build_product_row(6)],
+    )
+    page.locator.return_value.click = mocker.AsyncMock()
+    mocker.patch.object(scraper_module.asyncio, "sleep", new=mocker.AsyncMock())
+
+    scraper = Scraper()
+    mocker.patch.object(scraper, "accept_privacy_dialog_if_present")
+    mocker.patch.object(scraper, "_ensure_list_view")
+
+    run_with_db(scraper._create_products_from_town(page, "Dublin", "DublinIE"))
+
+    assert page.locator.return_value.click.await_count == 1
+    assert core_models.NotifiedProduct.objects.count() == 2
+    assert (
+        core_models.TownCursor.objects.get(town_url_ext="DublinIE").latest_external_id
+        == 5
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_products_from_town_saves_scanned_rows_when_cut_short(mocker):
+    """
+    Rows read before the scan is cancelled are stored, the cursor is not
+    moved so the next run reads the rest
+    """
+    mocker.patch.object(scraper_module, "SCRAPER_EXTRACTION_MODE", new="evaluate")
+    core_models.TownCursor.objects.create(town_url_ext="DublinIE", latest_external_id=5)
+    page = build_mock_page(
+        mocker,
+        [build_product_row(7), build_product_row(6)],
+    )
+
+    async def hanging_click():
+        await asyncio.Event().wait()
+
+    page.locator.return_value.click = mocker.AsyncMock(side_effect=hanging_click)
+
+    scraper = Scraper()
+    mocker.patch.object(scraper, "accept_privacy_dialog_if_present")
+    mocker.patch.object(scraper, "_ensure_list_view")
+
+    with pytest.raises(asyncio.TimeoutError):
+        run_with_db(
+            asyncio.wait_for(
+                scraper._create_products_from_town(page, "Dublin", "DublinIE"),
+                timeout=0.5,
+            )
+        )
+
+    assert core_models.NotifiedProduct.objects.count() == 2
+    assert (
+        core_models.TownCursor.objects.get(town_url_ext="DublinIE").latest_external_id
+        == 5
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_products_from_town_keeps_cursor_when_cut_short_at_cursor(mocker):
+    """
+    Cancelled after reaching the cursor but before storing the rows above
+    it, the cursor is not moved past them
+    """
+    mocker.patch.object(scraper_module, "SCRAPER_EXTRACTION_MODE", new="evaluate")
+    core_models.TownCursor.objects.create(town_url_ext="DublinIE", latest_external_id=5)
+    page = build_mock_page(
+        mocker,
+        [build_product_row(7), build_product_row(6), build_product_row(5)],
+    )
+
+    async def hanging_query(external_ids):
+        await asyncio.Event().wait()
+
+    scraper = Scraper()
+    mocker.patch.object(scraper, "accept_privacy_dialog_if_present")
+    mocker.patch.object(scraper, "_ensure_list_view")
+    mocker.patch.object(scraper, "_get_known_external_ids", side_effect=hanging_query)
+
+    with pytest.raises(asyncio.TimeoutError):
+        run_with_db(
+            asyncio.wait_for(
+                scraper._create_products_from_town(page, "Dublin", "DublinIE"),
+                timeout=0.5,
+            )
+        )
+
+    assert core_models.NotifiedProduct.objects.count() == 0
+    assert (
+        core_models.TownCursor.objects.get(town_url_ext="DublinIE").latest_external_id
+        == 5
+    )
+
+
+def test_politeness_scheduler_spaces_requests_per_host_and_proxy(mocker):
+    """
+    Requests through the same proxy or to the same host wait for their gap,
+    requests through other proxies only wait for the host gap
+    """
+    clock = {"now": 0.0}
+    sleeps = []
+
+    async def mock_sleep(seconds):
+        sleeps.append(seconds)
+        clock["now"] += seconds
+
+    mocker.patch("pingcycle.tools.politeness.time.monotonic", lambda: clock["now"])
+    mocker.patch("pingcycle.tools.politeness.asyncio.sleep", side_effect=mock_sleep)
+
+    politeness = PolitenessScheduler(min_host_gap=2, min_proxy_gap=10)
+
+    async def run():
+        await politeness.wait_turn("www.freecycle.org", 1)
+        await politeness.wait_turn("www.freecycle.org", 2)
+        await politeness.wait_turn("www.freecycle.org", 1)
+        await politeness.wait_turn("other.org", 3)
+
+    asyncio.run(run())
+
+    assert sleeps == [2, 8]
+    assert politeness.idle_seconds == 10
+
+
+def create_proxies(count: int):
+    return [
+        core_models.Proxy.objects.create(
+            domain=f"proxy{i}.example.com",
+            port=8000 + i,
+            username="user",
+            password="password",
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_lease_proxy_waits_while_all_proxies_are_leased(mocker):
+    """
+    Busy proxies are waited for with backoff instead of dropping the town,
+    only having no active proxy at all is an error
+    """
+    (proxy,) = create_proxies(1)
+    core_models.Proxy.objects.filter(id=proxy.id).update(
+        leased_until=timezone.now() + timedelta(minutes=5)
+    )
+    sleeps = []
+
+    async def mock_sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 3:
+            # Another scraper gives its lease back
+            await sync_to_async(core_models.Proxy.objects.filter(id=proxy.id).update)(
+                leased_until=None
+            )
+
+    mocker.patch.object(scraper_module, "PROXY_LEASE_WAIT_SECONDS", new=2)
+    mocker.patch.object(scraper_module, "PROXY_LEASE_MAX_WAIT_SECONDS", new=6)
+    mocker.patch("pingcycle.tools.scraper.asyncio.sleep", side_effect=mock_sleep)
+
+    assert run_with_db(Scraper()._lease_proxy("Dublin")).id == proxy.id
+    # Doubling up to the max, half of each wait random
+    assert 1 <= sleeps[0] <= 2
+    assert 2 <= sleeps[1] <= 4
+    assert 3 <= sleeps[2] <= 6
+
+    core_models.Proxy.objects.update(status=core_models.Proxy.Status.INACTIVE)
+    with pytest.raises(scraper_module.NoProxyAvailableError):
+        run_with_db(Scraper()._lease_proxy("Dublin"))
+    assert len(sleeps) == 3
+
+
+@pytest.mark.django_db
+def test_proxy_lease_skips_leased_proxies():
+    """
+    Leased proxies are not handed out again until released or expired,
+    the least recently used one is claimed first
+    """
+    first_proxy, second_proxy = create_proxies(2)
+    core_models.Proxy.objects.filter(id=first_proxy.id).update(last_used=timezone.now())
+
+    assert core_models.Proxy.lease().id == second_proxy.id
+    assert core_models.Proxy.lease().id == first_proxy.id
+    assert core_models.Proxy.lease() is None
+
+    core_models.Proxy.objects.filter(id=second_proxy.id).update(
+        leased_until=timezone.now() - timedelta(seconds=1)
+    )
+    assert core_models.Proxy.lease().id == second_proxy.id
+
+
+@pytest.mark.parametrize(
+    "fail_count, success, expected_fail_count, expected_status",
+    [
+        pytest.param(0, True, 1, "ACTIVE", id="Success"),
+        pytest.param(0, None, 1, "ACTIVE", id="No result"),
+        pytest.param(0, False, 2, "ACTIVE", id="Failure counted"),
+        pytest.param(9, False, 11, "INACTIVE", id="Too many failures"),
+    ],
+)
+@pytest.mark.django_db
+def test_proxy_release(fail_count, success, expected_fail_count, expected_status):
+    (proxy,) = create_proxies(1)
+    core_models.Proxy.objects.filter(id=proxy.id).update(fail_count=fail_count)
+
+    leased_proxy = core_models.Proxy.lease()
+    # A failure recorded meanwhile by another worker is not overwritten
+    core_models.Proxy.objects.filter(id=proxy.id).update(fail_count=F("fail_count") + 1)
+    leased_proxy.release(success)
+
+    proxy.refresh_from_db()
+    assert proxy.fail_count == expected_fail_count
+    assert proxy.status == expected_status
+    assert proxy.leased_until is None
+    assert proxy.lease_token is None
+
+
+@pytest.mark.parametrize(
+    "exploration_roll, expected_proxy_index",
+    [
+        pytest.param(0.99, 1, id="Best score"),
+        pytest.param(0.0, 0, id="Exploration picks least recently used"),
+    ],
+)
+@pytest.mark.django_db
+def test_proxy_lease_picks_by_score(exploration_roll, expected_proxy_index, mocker):
+    mocker.patch.object(core_models.random, "random", return_value=exploration_roll)
+    proxies = create_proxies(3)
+    now = timezone.now()
+    # Slow & failing, used the longest time ago
+    core_models.Proxy.objects.filter(id=proxies[0].id).update(
+        latency_seconds=20, success_rate=0.5, last_used=now - timedelta(hours=2)
+    )
+    # Fast & reliable
+    core_models.Proxy.objects.filter(id=proxies[1].id).update(
+        latency_seconds=2, success_rate=1.0, last_used=now - timedelta(minutes=1)
+    )
+    # Fast but failing often
+    core_models.Proxy.objects.filter(id=proxies[2].id).update(
+        latency_seconds=2, success_rate=0.1, last_used=now - timedelta(hours=1)
+    )
+
+    assert core_models.Proxy.lease().id == proxies[expected_proxy_index].id
+
+
+@pytest.mark.django_db
+def test_proxy_release_updates_rolling_scores(mocker):
+    mocker.patch.object(core_models, "PROXY_SCORE_SMOOTHING", new=0.5)
+    mocker.patch.object(core_models, "PROXY_EXPLORATION_RATE", new=0)
+    (proxy,) = create_proxies(1)
+
+    core_models.Proxy.lease().release(True, 4.0)
+    proxy.refresh_from_db()
+    assert proxy.latency_seconds == 4.0
+    assert proxy.success_rate == 1.0
+
+    core_models.Proxy.lease().release(True, 10.0)
+    proxy.refresh_from_db()
+    assert proxy.latency_seconds == 7.0
+    assert proxy.success_rate == 1.0
+
+    # Failures only lower the success rate
+    core_models.Proxy.lease().release(False, 100.0)
+    proxy.refresh_from_db()
+    assert proxy.latency_seconds == 7.0
+    assert proxy.success_rate == 0.5
+    assert core_models.Proxy.with_score().get().score == 14.0
@@ -25,6 +25,7 @@ import {
   ChatProviderIcon,
   ChatProviderColor,
   ChatStateEmoji,
+  ChatInactiveReasonText,
 } from "../utils/enum_records";
 import UnlinkChatModal from "../components/UnlinkChatModal";
 
@@ -168,6 +169,11 @@ export default function ManageChats() {
                         { label: "OFF", value: "INACTIVE" },
                       ]}
                     />
+                    {chat.inactive_reason && (
+                      <Text c="dimmed" size="sm" mt="xs">
+                        {ChatInactiveReasonText[chat.inactive_reason]}
+                      </Text>
+                    )}
                   </Stack>
                   <Group gap="xs">
                     <Button
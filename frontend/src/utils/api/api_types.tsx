@@ -11,6 +11,12 @@ export enum ChatStateType {
   INACTIVE = "INACTIVE",
 }
 
+export enum ChatInactiveReasonType {
+  BOT_BLOCKED = "BOT_BLOCKED",
+  USER_DEACTIVATED = "USER_DEACTIVATED",
+  CHAT_NOT_FOUND = "CHAT_NOT_FOUND",
+}
+
 export enum ChatProviderType {
   TELEGRAM = "TELEGRAM",
 }
@@ -22,5 +28,6 @@ export interface Chat {
   reference: string;
   provider: ChatProviderType;
   state: ChatStateType;
+  inactive_reason: ChatInactiveReasonType | null;
   created_at: string;
 }
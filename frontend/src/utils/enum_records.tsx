@@ -1,4 +1,8 @@
-import { ChatStateType, ChatProviderType } from "./api/api_types";
+import {
+  ChatStateType,
+  ChatProviderType,
+  ChatInactiveReasonType,
+} from "./api/api_types";
 import { Icon, IconBrandTelegram } from "@tabler/icons-react";
 
 export const ChatStateNameAndEmoji: Record<ChatStateType, string> = {
@@ -13,6 +17,14 @@ export const ChatStateEmoji: Record<ChatStateType, string> = {
   SETUP: "📲",
 };
 
+export const ChatInactiveReasonText: Record<ChatInactiveReasonType, string> = {
+  BOT_BLOCKED:
+    "Turned off because the bot was blocked. Unblock it, then turn notifications back on.",
+  USER_DEACTIVATED:
+    "Turned off because this account was deleted or deactivated.",
+  CHAT_NOT_FOUND: "Turned off because the chat could not be found.",
+};
+
 export const ChatProviderIcon: Record<ChatProviderType, Icon> = {
   TELEGRAM: IconBrandTelegram,
 };